@@ -0,0 +1,196 @@
+"""
+Admission control for the API.
+
+Ingest requests (POST .../reading, .../prediction and .../inference/latency)
+spend a token from their gateway's token bucket (GATEWAY_RATE_LIMIT_PER_S,
+GATEWAY_RATE_LIMIT_BURST) and are rejected with 429 when the bucket is
+empty, before they take a slot. Every request then needs one of a fixed
+number of slots (MAX_CONCURRENT_REQUESTS, by default the size of the
+connection pool) and is rejected with 503 if none frees up within
+ADMISSION_QUEUE_TIMEOUT_MS, instead of queueing for a pooled connection until
+it times out. Both responses carry a Retry-After header. Streamed responses
+that keep reading the database hold their slot until the stream ends (see
+hold_slot).
+
+Endpoints are plain functions run in the threadpool, since they make
+blocking database calls; size_threadpool() makes sure it has a thread for
+every admitted request, so that the slots, not the threadpool, bound how many
+requests run at once.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+import anyio.to_thread
+from fastapi import HTTPException, Request, status
+from starlette.concurrency import iterate_in_threadpool
+
+from app.core.config import Settings
+
+MAX_TRACKED_GATEWAYS = 10000
+
+
+class GatewayRateLimiter:
+    """
+    Token buckets keyed by gateway name. Buckets of gateways that have not been
+    seen for a while are evicted once MAX_TRACKED_GATEWAYS is reached; an
+    evicted gateway simply starts again with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: int, max_gateways: int = MAX_TRACKED_GATEWAYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_gateways = max_gateways
+        self._buckets: OrderedDict = OrderedDict()
+
+    def acquire(self, gateway_name: str) -> float:
+        """
+        Spend a token for gateway_name. Returns 0 if the request is admitted,
+        or the number of seconds until a token will be available.
+        """
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(gateway_name, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+
+        self._buckets[gateway_name] = (tokens, now)
+        if len(self._buckets) > self.max_gateways:
+            self._buckets.popitem(last=False)
+        return wait
+
+class AdmissionController:
+    """
+    Per-gateway rate limiting plus a global cap on in-flight requests.
+    """
+
+    def __init__(self, settings: Settings):
+        self.rate_limiter: Optional[GatewayRateLimiter] = None
+        if settings.gateway_rate_limit_per_s > 0:
+            self.rate_limiter = GatewayRateLimiter(settings.gateway_rate_limit_per_s, settings.gateway_rate_limit_burst)
+        self.concurrency_limit = settings.concurrency_limit
+        self.queue_timeout = settings.admission_queue_timeout_ms / 1000
+        self._slots = asyncio.Semaphore(self.concurrency_limit) if self.concurrency_limit > 0 else None
+
+    async def acquire_slot(self) -> bool:
+        if self._slots is None:
+            return True
+        if not self._slots.locked():
+            await self._slots.acquire()
+            return True
+        if self.queue_timeout <= 0:
+            return False
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def release_slot(self):
+        if self._slots is not None:
+            self._slots.release()
+
+
+class AdmissionSlot:
+    """
+    The slot taken by a request. It is released when the endpoint returns,
+    unless the endpoint keeps it for its streamed response.
+    """
+
+    def __init__(self, release: Optional[Callable[[], None]] = None):
+        self._release = release
+        self.kept = False
+
+    def release(self):
+        # Idempotent, since both the stream and the response's background task release it
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
+    async def stream(self, iterator: Iterator) -> AsyncIterator:
+        """
+        Iterate over a blocking iterator in the threadpool, releasing the slot
+        once it is exhausted, fails or the client goes away.
+        """
+        try:
+            async for item in iterate_in_threadpool(iterator):
+                yield item
+        finally:
+            self.release()
+
+
+def size_threadpool(controller: AdmissionController):
+    """
+    Grow the threadpool running the endpoints to at least one thread per
+    admission slot. Must be called from the event loop.
+    """
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    if controller.concurrency_limit > limiter.total_tokens:
+        limiter.total_tokens = controller.concurrency_limit
+
+def _controller(request: Request) -> Optional[AdmissionController]:
+    return getattr(request.app.state, "admission", None)
+
+async def limit_gateway_rate(request: Request):
+    """
+    Per-gateway rate limiting dependency for FastAPI, applied to the ingest endpoints.
+
+    Router dependencies are solved before endpoint ones, so the check itself
+    is made by limit_concurrency, before a slot is taken; this only marks the
+    endpoint.
+    """
+
+def _is_rate_limited(request: Request) -> bool:
+    dependant = getattr(request.scope.get("route"), "dependant", None)
+    return dependant is not None and any(dependency.call is limit_gateway_rate for dependency in dependant.dependencies)
+
+def _check_gateway_rate(controller: AdmissionController, request: Request):
+    wait = controller.rate_limiter.acquire(request.path_params["gateway_name"])
+    if wait > 0:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded for edge gateway",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+async def limit_concurrency(request: Request):
+    """
+    Admission control dependency for FastAPI, applied to the whole router:
+    rate limits the endpoints marked with limit_gateway_rate, then takes a slot.
+    """
+    controller = _controller(request)
+    if controller is None:
+        yield
+        return
+
+    if controller.rate_limiter is not None and _is_rate_limited(request):
+        _check_gateway_rate(controller, request)
+    if not await controller.acquire_slot():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service is saturated",
+            headers={"Retry-After": "1"}
+        )
+    slot = request.state.admission_slot = AdmissionSlot(controller.release_slot)
+    try:
+        yield
+    finally:
+        if not slot.kept:
+            slot.release()
+
+def hold_slot(request: Request) -> AdmissionSlot:
+    """
+    Keep the slot of a request past the end of its endpoint, for a streamed
+    response that keeps using the database. The caller streams through
+    AdmissionSlot.stream and releases the slot in the response's background
+    task, which covers a stream that never started.
+    """
+    slot = getattr(request.state, "admission_slot", None) or AdmissionSlot()
+    slot.kept = True
+    return slot
@@ -0,0 +1,148 @@
+"""
+Content negotiation.
+
+Besides JSON, request bodies may be sent and responses requested as
+MessagePack (application/msgpack) or, when cbor2 is installed, CBOR
+(application/cbor). The request format follows Content-Type and the response
+format follows Accept; JSON stays the default for both.
+
+In the binary formats reading values travel as native arrays of floats
+(list[list[float]]) instead of the JSON encoded string used in JSON bodies,
+so neither side has to encode or parse them as text.
+"""
+import contextvars
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+import msgpack
+import orjson
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from app.core import payloads
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+@dataclass(frozen=True)
+class Codec:
+    """
+    A supported content type.
+
+    Attributes:
+    media_type: str, the media type it is negotiated by
+    encode: Callable, turns JSON-able content into bytes
+    decode: Callable, turns a body into JSON-able content
+    native_values: bool, whether reading values are carried as arrays rather than JSON text
+    """
+
+    media_type: str
+    encode: Callable[[Any], bytes]
+    decode: Callable[[bytes], Any]
+    native_values: bool
+
+
+JSON = Codec("application/json", orjson.dumps, orjson.loads, native_values=False)
+MSGPACK = Codec(
+    "application/msgpack",
+    lambda content: msgpack.packb(content, use_bin_type=True),
+    lambda body: msgpack.unpackb(body, raw=False),
+    native_values=True
+)
+
+CODECS: dict[str, Codec] = {"application/json": JSON, "application/msgpack": MSGPACK, "application/x-msgpack": MSGPACK}
+if cbor2 is not None:
+    CODECS["application/cbor"] = Codec("application/cbor", cbor2.dumps, cbor2.loads, native_values=True)
+
+_response_codec: contextvars.ContextVar = contextvars.ContextVar("response_codec", default=JSON)
+
+
+def _media_type(value: str) -> str:
+    return value.split(";", 1)[0].strip().lower()
+
+def request_codec(content_type: Optional[str]) -> Codec:
+    """
+    Return the codec of a request body, JSON for anything unknown.
+    """
+    return CODECS.get(_media_type(content_type or ""), JSON)
+
+def negotiate(accept: Optional[str]) -> Codec:
+    """
+    Return the codec to answer with: the supported media type with the
+    highest quality in the Accept header, the first listed on ties, and JSON
+    when nothing supported is asked for.
+    """
+    best, best_quality = JSON, 0.0
+    for item in (accept or "").split(","):
+        media_type, *params = item.split(";")
+        codec = CODECS.get(_media_type(media_type))
+        if codec is None:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality:
+            best, best_quality = codec, quality
+    return best
+
+def use_response_codec(codec: Codec):
+    """
+    Set the codec the current request is answered with.
+    """
+    _response_codec.set(codec)
+
+def serialize_values(values: str, values_array: Optional[bytes] = None, values_shape: Optional[list[int]] = None):
+    """
+    Serialize stored reading values for the current response: the JSON text
+    as it is for JSON, arrays of floats for binary formats. Arrays are
+    rebuilt from the stored array when there is one; older rows whose text
+    cannot be decoded are sent as the text.
+    """
+    if not _response_codec.get().native_values:
+        return values
+    try:
+        return payloads.stored_values(values, values_array, values_shape).tolist()
+    except ValueError:
+        # InvalidReadingValues, or a stored array that does not fit its shape
+        return values
+
+
+class DecodedRequest(Request):
+    """
+    Request with a body in a binary format. FastAPI only hands bodies typed as
+    JSON to request.json(), so the request presents itself as JSON and json()
+    decodes the body with the codec instead.
+    """
+
+    def __init__(self, request: Request, codec: Codec):
+        scope = dict(request.scope)
+        scope["headers"] = [(name, value) for name, value in request.scope["headers"] if name != b"content-type"]
+        scope["headers"].append((b"content-type", JSON.media_type.encode()))
+        super().__init__(scope, request.receive)
+        self.codec = codec
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = self.codec.decode(await self.body())
+        return self._json
+
+
+class NegotiatedResponse(JSONResponse):
+    """
+    Response encoded with the codec negotiated for the current request.
+    """
+
+    def render(self, content: Any) -> bytes:
+        codec = _response_codec.get()
+        if codec is JSON:
+            return super().render(content)
+        self.media_type = codec.media_type
+        return codec.encode(content)
@@ -1,8 +1,107 @@
-from app.db import SessionLocal
+import hmac
+from typing import Optional
+
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core import auth
+from app.db import SessionLocal, ReadSessionLocal
+from app.db import crud
+
+CONSISTENCY_HEADER = "X-Consistency"
 
 def get_session():
     """
     Database dependency for FastAPI
     """
     with SessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+def read_session_factory(request: Request) -> sessionmaker:
+    """
+    Return the session factory to read with for a request: the read replica,
+    if one is configured, unless the caller asked for strong consistency.
+    """
+    return SessionLocal if strong_consistency(request) else ReadSessionLocal
+
+def strong_consistency(request: Request) -> bool:
+    """
+    Return whether a request asked to read from the primary.
+    """
+    consistency = request.headers.get(CONSISTENCY_HEADER) or request.query_params.get("consistency")
+    return consistency == "strong"
+
+def get_read_session(request: Request):
+    """
+    Read-only database dependency for FastAPI
+
+    Uses the read replica, if one is configured. Callers that need to see
+    their own recent writes can send "X-Consistency: strong" (or the
+    consistency=strong query parameter) to read from the primary instead.
+    """
+    with read_session_factory(request)() as session:
+        yield session
+
+def authenticate_gateway(request: Request, session: Session = Depends(get_session)) -> Optional[str]:
+    """
+    Edge gateway authentication dependency for FastAPI
+
+    Checks the bearer token of a request against the gateway named in its
+    path and returns the gateway's uuid, which spares the endpoint looking the
+    gateway up. Returns None, accepting any request, unless
+    GATEWAY_AUTH_ENABLED is set.
+    """
+    settings = request.app.state.settings
+    if not settings.gateway_auth_enabled:
+        return None
+
+    gateway = _verify_gateway_token(request, session)
+    if gateway.name != request.path_params.get("gateway_name"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Edge gateway token is for another gateway")
+    return gateway.uuid
+
+def authorize_token_issue(request: Request, session: Session = Depends(get_session)) -> None:
+    """
+    Token issuing authorization dependency for FastAPI
+
+    Accepts the ADMIN_TOKEN, or the current token of the gateway named in the
+    path, which lets a gateway rotate its own token. Checked whether or not
+    GATEWAY_AUTH_ENABLED is set, since issuing a token revokes the previous one.
+    """
+    admin_token = request.app.state.settings.admin_token
+    token = _bearer_token(request)
+    if admin_token and hmac.compare_digest(token.encode(), admin_token.encode()):
+        return None
+
+    gateway = _verify_gateway_token(request, session)
+    if gateway.name != request.path_params.get("gateway_name"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Edge gateway token is for another gateway")
+    return None
+
+def _bearer_token(request: Request) -> str:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing edge gateway token", headers={"WWW-Authenticate": "Bearer"})
+    return token
+
+def _verify_gateway_token(request: Request, session: Session) -> auth.AuthenticatedGateway:
+    # Look the bearer token up in the cache, or check its signature and that
+    # it is still the token stored for its gateway
+    token = _bearer_token(request)
+    secret_key = request.app.state.settings.secret_key
+    if not secret_key:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid edge gateway token", headers={"WWW-Authenticate": "Bearer"})
+    cache = auth.get_token_cache()
+    gateway = cache.get(token)
+    if gateway is None:
+        generation = cache.generation()
+        try:
+            claims = auth.verify_token(secret_key, token)
+            db_gateway = crud.read_edge_gateway_by_token(session=session, token=token)
+        except (auth.InvalidGatewayToken, crud.EdgeGatewayNotFound):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid edge gateway token", headers={"WWW-Authenticate": "Bearer"})
+        if claims["sub"] != db_gateway.device_name:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid edge gateway token", headers={"WWW-Authenticate": "Bearer"})
+        gateway = auth.AuthenticatedGateway(name=db_gateway.device_name, uuid=db_gateway.uuid)
+        cache.put(token, gateway, claims, generation)
+    return gateway
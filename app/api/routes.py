@@ -1,19 +1,31 @@
-
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+import logging
+import os
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.background import BackgroundTask
+from datetime import datetime
 from typing import Optional
+from uuid import UUID
+
+from app.core import auth, jobs, payloads
+from app.db import crud, get_engine, get_read_engine, histograms
+from app.api import content, schemas
+from app.api.admission import hold_slot, limit_concurrency, limit_gateway_rate
+from app.api.dependencies import authenticate_gateway, authorize_token_issue, get_session, get_read_session, read_session_factory, strong_consistency
+from app.api.routing import ServiceRoute
 
-from app.db import crud
-from app.api import schemas
-from app.api.dependencies import get_session
+logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(route_class=ServiceRoute, default_response_class=content.NegotiatedResponse, dependencies=[Depends(limit_concurrency)])
 
 
 # --- Edge Gateway ---
 
 @router.get("/gateway", status_code=status.HTTP_200_OK, tags=["Edge Gateway"])
-async def read_edge_gateways(session: Session = Depends(get_session)) -> list[schemas.ReadEdgeGateway]:
+def read_edge_gateways(session: Session = Depends(get_read_session)) -> list[schemas.ReadEdgeGateway]:
     """
     GET /gateway endpoint
 
@@ -23,7 +35,7 @@ async def read_edge_gateways(session: Session = Depends(get_session)) -> list[sc
     return crud.read_edge_gateways(session=session)
 
 @router.get("/gateway/{gateway_name}", status_code=status.HTTP_200_OK, tags=["Edge Gateway"])
-async def read_edge_gateway(gateway_name: str, session: Session = Depends(get_session)) -> Optional[schemas.ReadEdgeGateway]:
+def read_edge_gateway(gateway_name: str, session: Session = Depends(get_read_session)) -> Optional[schemas.ReadEdgeGateway]:
     """
     GET /gateway/{gateway_name} endpoint
     
@@ -34,11 +46,12 @@ async def read_edge_gateway(gateway_name: str, session: Session = Depends(get_se
         return crud.read_edge_gateway(session=session, device_name=gateway_name)
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in read_edge_gateway")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
 @router.post("/gateway", status_code=status.HTTP_201_CREATED, tags=["Edge Gateway"])
-async def create_edge_gateway(gateway: schemas.CreateEdgeGateway, session: Session = Depends(get_session)):
+def create_edge_gateway(gateway: schemas.CreateEdgeGateway, session: Session = Depends(get_session)):
     """
     POST /gateway endpoint
 
@@ -49,12 +62,13 @@ async def create_edge_gateway(gateway: schemas.CreateEdgeGateway, session: Sessi
         crud.create_edge_gateway(session=session, fields=gateway.model_dump())
     except crud.EdgeGatewayAlreadyExists:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Edge gateway already exists")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in create_edge_gateway")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
     
 @router.put("/gateway/{gateway_name}", status_code=status.HTTP_200_OK, tags=["Edge Gateway"])
-async def update_edge_gateway(gateway_name: str, gateway: schemas.UpdateEdgeGateway, session: Session = Depends(get_session)):
+def update_edge_gateway(gateway_name: str, gateway: schemas.UpdateEdgeGateway, session: Session = Depends(get_session)):
     """
     PUT /gateway endpoint
 
@@ -65,11 +79,12 @@ async def update_edge_gateway(gateway_name: str, gateway: schemas.UpdateEdgeGate
         crud.update_edge_gateway(session=session, device_name=gateway_name, fields=gateway.model_dump())
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in update_edge_gateway")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
 @router.delete("/gateway/{gateway_name}", status_code=status.HTTP_200_OK, tags=["Edge Gateway"])
-async def delete_edge_gateway(gateway_name: str, session: Session = Depends(get_session)):
+def delete_edge_gateway(gateway_name: str, session: Session = Depends(get_session)):
     """
     DELETE /gateway/{gateway_name} endpoint
 
@@ -80,15 +95,35 @@ async def delete_edge_gateway(gateway_name: str, session: Session = Depends(get_
         crud.delete_edge_gateway(session=session, device_name=gateway_name)
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in delete_edge_gateway")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
+
+@router.post("/gateway/{gateway_name}/token", status_code=status.HTTP_201_CREATED, tags=["Edge Gateway"], dependencies=[Depends(authorize_token_issue)])
+def create_edge_gateway_token(gateway_name: str, request: Request, session: Session = Depends(get_session)) -> schemas.EdgeGatewayToken:
+    """
+    POST /gateway/{gateway_name}/token endpoint
+
+    Endpoint to issue a new token for an existing edge gateway, revoking the previous one.
+    Requires the ADMIN_TOKEN or the gateway's current token.
+    """
+
+    secret_key = request.app.state.settings.secret_key
+    if not secret_key:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="SECRET_KEY is not set")
+    token = auth.issue_token(secret_key, gateway_name)
+    try:
+        crud.update_edge_gateway_token(session=session, device_name=gateway_name, token=token)
+    except crud.EdgeGatewayNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
+    return schemas.EdgeGatewayToken(token=token)
     
 
 # --- Edge Sensor ---
 
 
 @router.get("/gateway/{gateway_name}/sensor", status_code=status.HTTP_200_OK, tags=["Edge Sensor"])
-async def read_edge_sensors(gateway_name: str, session: Session = Depends(get_session)) -> list[schemas.ReadEdgeSensor]:
+def read_edge_sensors(gateway_name: str, session: Session = Depends(get_read_session)) -> list[schemas.ReadEdgeSensor]:
     """
     GET /gateway/{gateway_name}/sensor endpoint
 
@@ -101,7 +136,7 @@ async def read_edge_sensors(gateway_name: str, session: Session = Depends(get_se
     return result
 
 @router.get("/gateway/{gateway_name}/sensor/{sensor_name}", status_code=status.HTTP_200_OK, tags=["Edge Sensor"])
-async def read_edge_sensor(gateway_name: str, sensor_name: str, session: Session = Depends(get_session)) -> Optional[schemas.ReadEdgeSensor]:
+def read_edge_sensor(gateway_name: str, sensor_name: str, session: Session = Depends(get_read_session)) -> Optional[schemas.ReadEdgeSensor]:
     """
     GET /gateway/{gateway_name}/sensor/{sensor_name} endpoint
 
@@ -114,11 +149,12 @@ async def read_edge_sensor(gateway_name: str, sensor_name: str, session: Session
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in read_edge_sensor")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
 @router.post("/gateway/{gateway_name}/sensor", status_code=status.HTTP_201_CREATED, tags=["Edge Sensor"])
-async def create_edge_sensor(gateway_name: str, sensor: schemas.CreateEdgeSensor, session: Session = Depends(get_session)):
+def create_edge_sensor(gateway_name: str, sensor: schemas.CreateEdgeSensor, session: Session = Depends(get_session)):
     """
     POST /gateway/{gateway_name}/sensor endpoint
 
@@ -131,12 +167,12 @@ async def create_edge_sensor(gateway_name: str, sensor: schemas.CreateEdgeSensor
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorAlreadyExists:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Edge sensor already exists")
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Unexpected error in create_edge_sensor")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
     
 @router.put("/gateway/{gateway_name}/sensor/{sensor_name}", status_code=status.HTTP_200_OK, tags=["Edge Sensor"])
-async def update_edge_sensor(gateway_name: str, sensor_name: str, sensor: schemas.UpdateEdgeSensor, session: Session = Depends(get_session)):
+def update_edge_sensor(gateway_name: str, sensor_name: str, sensor: schemas.UpdateEdgeSensor, session: Session = Depends(get_session)):
     """
     PUT /gateway/{gateway_name}/sensor endpoint
 
@@ -144,17 +180,17 @@ async def update_edge_sensor(gateway_name: str, sensor_name: str, sensor: schema
     """
     
     try:
-        crud.update_edge_sensor(session=session, gateway_name=gateway_name, device_name=sensor_name, fields=sensor.model_dump())
+        crud.update_edge_sensor(session=session, gateway_name=gateway_name, device_name=sensor_name, fields=sensor.model_dump(exclude_unset=True))
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.exception("Unexpected error in update_edge_sensor")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
 @router.delete("/gateway/{gateway_name}/sensor/{sensor_name}", status_code=status.HTTP_200_OK, tags=["Edge Sensor"])
-async def delete_edge_sensor(gateway_name: str, sensor_name: str, session: Session = Depends(get_session)):
+def delete_edge_sensor(gateway_name: str, sensor_name: str, session: Session = Depends(get_session)):
     """
     DELETE /gateway/{gateway_name}/sensor/{sensor_name} endpoint
 
@@ -167,12 +203,95 @@ async def delete_edge_sensor(gateway_name: str, sensor_name: str, session: Sessi
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in delete_edge_sensor")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
+@router.post("/gateway/{gateway_name}/sensor/{sensor_name}/state", status_code=status.HTTP_200_OK, tags=["Edge Sensor"])
+def transition_edge_sensor_state(gateway_name: str, sensor_name: str, transition: schemas.SensorStateTransition, session: Session = Depends(get_session)) -> schemas.ReadSensorStateChange:
+    """
+    POST /gateway/{gateway_name}/sensor/{sensor_name}/state endpoint
+
+    Endpoint to move a sensor to a new state, only if it is in the expected state.
+    """
+
+    try:
+        return crud.transition_edge_sensor_state(
+            session=session,
+            gateway_name=gateway_name,
+            device_name=sensor_name,
+            expected_state=transition.expected_state,
+            new_state=transition.state
+        )
+    except crud.EdgeGatewayNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
+    except crud.EdgeSensorNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
+    except crud.SensorStateConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Edge sensor is in state '{e.current_state.value}'")
+
+@router.get("/gateway/{gateway_name}/sensor/{sensor_name}/state/history", status_code=status.HTTP_200_OK, tags=["Edge Sensor"])
+def read_sensor_state_changes(gateway_name: str, sensor_name: str, limit: int = 100, before_id: Optional[int] = None, session: Session = Depends(get_read_session)) -> list[schemas.ReadSensorStateChange]:
+    """
+    GET /gateway/{gateway_name}/sensor/{sensor_name}/state/history endpoint
+
+    Endpoint to return the most recent state changes of a specific sensor, newest first.
+    """
+
+    try:
+        return crud.read_sensor_state_changes(session=session, gateway_name=gateway_name, device_name=sensor_name, limit=limit, before_id=before_id)
+    except crud.EdgeGatewayNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
+    except crud.EdgeSensorNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
+
+# --- Snapshot ---
+
+def _build_snapshot(gateways, latest_readings) -> list[schemas.SnapshotEdgeGateway]:
+    snapshot = []
+    for gateway in gateways:
+        edge_sensors = []
+        for sensor in gateway.edge_sensors:
+            reading = latest_readings.get(sensor.uuid)
+            edge_sensors.append(schemas.SnapshotEdgeSensor(
+                **schemas.ReadEdgeSensor.model_validate(sensor).model_dump(),
+                state=sensor.state,
+                latest_reading=schemas.ReadSensorReading.model_validate(reading) if reading else None
+            ))
+        snapshot.append(schemas.SnapshotEdgeGateway(
+            **schemas.ReadEdgeGateway.model_validate(gateway).model_dump(),
+            edge_sensors=edge_sensors
+        ))
+    return snapshot
+
+@router.get("/snapshot", status_code=status.HTTP_200_OK, tags=["Snapshot"])
+def read_fleet_snapshot(session: Session = Depends(get_read_session)) -> list[schemas.SnapshotEdgeGateway]:
+    """
+    GET /snapshot endpoint
+
+    Endpoint to return every gateway with its sensors, their state, config and latest reading.
+    """
+
+    gateways, latest_readings = crud.read_fleet_snapshot(session=session)
+    return _build_snapshot(gateways, latest_readings)
+
+@router.get("/gateway/{gateway_name}/snapshot", status_code=status.HTTP_200_OK, tags=["Snapshot"])
+def read_gateway_snapshot(gateway_name: str, session: Session = Depends(get_read_session)) -> schemas.SnapshotEdgeGateway:
+    """
+    GET /gateway/{gateway_name}/snapshot endpoint
+
+    Endpoint to return a specific gateway with its sensors, their state, config and latest reading.
+    """
+
+    try:
+        gateways, latest_readings = crud.read_fleet_snapshot(session=session, gateway_name=gateway_name)
+    except crud.EdgeGatewayNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
+    return _build_snapshot(gateways, latest_readings)[0]
+
 # --- Sensor Config ---
 @router.get("/gateway/{gateway_name}/sensor/{sensor_name}/config", status_code=status.HTTP_200_OK, tags=["Sensor Config"])
-async def read_sensor_config(gateway_name: str, sensor_name: str, session: Session = Depends(get_session)) -> Optional[schemas.SensorConfig]:
+def read_sensor_config(gateway_name: str, sensor_name: str, session: Session = Depends(get_read_session)) -> Optional[schemas.SensorConfig]:
     """
     GET /gateway/{gateway_name}/sensor/{sensor_name}/config endpoint
 
@@ -186,11 +305,12 @@ async def read_sensor_config(gateway_name: str, sensor_name: str, session: Sessi
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
     except crud.SensorConfigNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sensor config not found")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in read_sensor_config")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
     
 @router.post("/gateway/{gateway_name}/sensor/{sensor_name}/config", status_code=status.HTTP_201_CREATED, tags=["Sensor Config"])
-async def create_or_update_sensor_config(gateway_name: str, sensor_name: str, config: schemas.SensorConfig, session: Session = Depends(get_session)):
+def create_or_update_sensor_config(gateway_name: str, sensor_name: str, config: schemas.SensorConfig, session: Session = Depends(get_session)):
     """
     POST /gateway/{gateway_name}/sensor/{sensor_name}/config endpoint
 
@@ -198,18 +318,42 @@ async def create_or_update_sensor_config(gateway_name: str, sensor_name: str, co
     """
     
     try:
-        crud.create_sensor_config(session=session, gateway_name=gateway_name, device_name=sensor_name, fields=config.model_dump())
+        configured = crud.upsert_sensor_configs(session=session, gateway_name=gateway_name, fields=config.model_dump(), device_names=[sensor_name])
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
-    except crud.EdgeSensorNotFound:
+    except Exception:
+        logger.exception("Unexpected error in create_or_update_sensor_config")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
+    if not configured:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
-    except crud.SensorConfigAlreadyExists:
-        crud.update_sensor_config(session=session, gateway_name=gateway_name, device_name=sensor_name, fields=config.model_dump())
-    except:
+
+@router.post("/gateway/{gateway_name}/sensors/config", status_code=status.HTTP_200_OK, tags=["Sensor Config"])
+def upsert_sensor_configs(gateway_name: str, config: schemas.BulkSensorConfig, session: Session = Depends(get_session)) -> schemas.BulkSensorConfigResult:
+    """
+    POST /gateway/{gateway_name}/sensors/config endpoint
+
+    Endpoint to create or update the configuration of the listed sensors of a gateway,
+    or of all its sensors if no list is given, in a single statement.
+    """
+
+    try:
+        configured = crud.upsert_sensor_configs(
+            session=session,
+            gateway_name=gateway_name,
+            fields=config.model_dump(exclude={"sensor_names"}),
+            device_names=config.sensor_names
+        )
+    except crud.EdgeGatewayNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
+    except Exception:
+        logger.exception("Unexpected error in upsert_sensor_configs")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
+    missing = sorted(set(config.sensor_names or []) - set(configured))
+    return schemas.BulkSensorConfigResult(configured=configured, missing=missing)
+
 @router.delete("/gateway/{gateway_name}/sensor/{sensor_name}/config", status_code=status.HTTP_200_OK, tags=["Sensor Config"])
-async def delete_sensor_config(gateway_name: str, sensor_name: str, session: Session = Depends(get_session)):
+def delete_sensor_config(gateway_name: str, sensor_name: str, session: Session = Depends(get_session)):
     """
     DELETE /gateway/{gateway_name}/sensor/{sensor_name}/config endpoint
 
@@ -224,47 +368,70 @@ async def delete_sensor_config(gateway_name: str, sensor_name: str, session: Ses
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
     except crud.SensorConfigNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sensor config not found")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in delete_sensor_config")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
 # --- Sensor Reading ---
 
 @router.get("/gateway/{gateway_name}/sensor/{sensor_name}/readings", status_code=status.HTTP_200_OK, tags=["Sensor Reading"])
-async def read_sensor_readings(gateway_name: str, sensor_name: str, session: Session = Depends(get_session)) -> list[schemas.ReadSensorReading]:
+def read_sensor_readings(gateway_name: str, sensor_name: str, start: Optional[schemas.LocalDatetime] = None, end: Optional[schemas.LocalDatetime] = None, session: Session = Depends(get_read_session)) -> list[schemas.ReadSensorReading]:
     """
     GET /gateway/{gateway_name}/sensor/{sensor_name}/readings endpoint
 
-    Endpoint to return all sensor readings for a specific sensor.
+    Endpoint to return all sensor readings for a specific sensor, optionally
+    restricted to a time range. Archived readings are included when the range
+    reaches back past the hot window.
     """
     try:
-        result = crud.read_sensor_readings(session=session, gateway_name=gateway_name, device_name=sensor_name)
+        result = crud.read_sensor_readings(session=session, gateway_name=gateway_name, device_name=sensor_name, start=start, end=end)
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
     return result
 
+@router.get("/gateway/{gateway_name}/sensor/{sensor_name}/readings/latest", status_code=status.HTTP_200_OK, tags=["Sensor Reading"])
+def read_latest_sensor_readings(request: Request, gateway_name: str, sensor_name: str, limit: int = Query(10, ge=1, le=1000), session: Session = Depends(get_read_session)) -> list[schemas.ReadSensorReading]:
+    """
+    GET /gateway/{gateway_name}/sensor/{sensor_name}/readings/latest endpoint
+
+    Endpoint to return the latest readings of a specific sensor, newest first,
+    served from memory when possible. Strongly consistent reads skip the
+    in-process buffer, and only reads from the primary fill it.
+    """
+    strong = strong_consistency(request)
+    try:
+        return crud.read_latest_sensor_readings(
+            session=session, gateway_name=gateway_name, device_name=sensor_name, limit=limit,
+            use_buffer=not strong, fill_buffer=strong or get_read_engine() is get_engine()
+        )
+    except crud.EdgeGatewayNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
+    except crud.EdgeSensorNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
+
 @router.get("/gateway/{gateway_name}/sensor/{sensor_name}/reading/{reading_uuid}", status_code=status.HTTP_200_OK, tags=["Sensor Reading"])
-async def read_sensor_reading(gateway_name: str, sensor_name: str, reading_uuid: str, session: Session = Depends(get_session)) -> Optional[schemas.ReadSensorReading]:
+def read_sensor_reading(gateway_name: str, sensor_name: str, reading_uuid: str, session: Session = Depends(get_read_session)) -> Optional[schemas.ReadSensorReading]:
     """
     GET /gateway/{gateway_name}/sensor/{sensor_name}/reading/{reading_uuid} endpoint
 
     Endpoint to return a specific sensor reading for a specific sensor.
     """
     try:
-        return crud.read_sensor_reading(session=session, gateway_name=gateway_name, device_name=sensor_name, reading_uuid=reading_uuid)
+        return crud.read_sensor_reading(session=session, gateway_name=gateway_name, device_name=sensor_name, reading_uuid=reading_uuid, with_values_array=True)
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
     except crud.SensorReadingNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sensor reading not found")
-    except Exception as e:
-        print("\n\n\n\n", e, "\n\n\n\n")
+    except Exception:
+        logger.exception("Unexpected error in read_sensor_reading")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
-@router.post("/gateway/{gateway_name}/sensor/{sensor_name}/reading", status_code=status.HTTP_201_CREATED, tags=["Sensor Reading"])
-async def create_sensor_reading(gateway_name: str, sensor_name: str, reading: schemas.CreateSensorReading, session: Session = Depends(get_session)):
+@router.post("/gateway/{gateway_name}/sensor/{sensor_name}/reading", status_code=status.HTTP_201_CREATED, tags=["Sensor Reading"], dependencies=[Depends(limit_gateway_rate)])
+def create_sensor_reading(gateway_name: str, sensor_name: str, reading: schemas.CreateSensorReading, session: Session = Depends(get_session), gateway_uuid: Optional[str] = Depends(authenticate_gateway)):
     """
     POST /gateway/{gateway_name}/sensor/{sensor_name}/reading endpoint
 
@@ -272,35 +439,39 @@ async def create_sensor_reading(gateway_name: str, sensor_name: str, reading: sc
     """
     
     try:
-        crud.create_sensor_reading(session=session, gateway_name=gateway_name, device_name=sensor_name, fields=reading.model_dump())
+        crud.create_sensor_reading(session=session, gateway_name=gateway_name, device_name=sensor_name, fields=reading.model_dump(), gateway_uuid=gateway_uuid)
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
+    except crud.InvalidSensorReading as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.message)
     except crud.SensorReadingAlreadyExists:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Sensor reading already exists")
 
 @router.delete("/gateway/{gateway_name}/sensor/{sensor_name}/readings", status_code=status.HTTP_200_OK, tags=["Sensor Reading"])
-async def delete_sensor_readings(gateway_name: str, sensor_name: str, session: Session = Depends(get_session)):
+def delete_sensor_readings(gateway_name: str, sensor_name: str, include_archive: bool = False, session: Session = Depends(get_session)):
     """
     DELETE /gateway/{gateway_name}/sensor/{sensor_name}/readings endpoint
 
-    Endpoint to delete all sensor readings for a specific sensor.
+    Endpoint to delete all sensor readings for a specific sensor. Archived
+    readings are deleted as well only with include_archive=true.
     """
     
     try:
-        crud.delete_sensor_readings(session=session, gateway_name=gateway_name, device_name=sensor_name)
+        crud.delete_sensor_readings(session=session, gateway_name=gateway_name, device_name=sensor_name, include_archive=include_archive)
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
-    except:
+    except Exception:
+        logger.exception("Unexpected error in delete_sensor_readings")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
 
 # --- Inference Result ---
 
-@router.post("/gateway/{gateway_name}/sensor/{sensor_name}/reading/{reading_uuid}/prediction", status_code=status.HTTP_201_CREATED, tags=["Prediction Result"])
-async def create_prediction_result(gateway_name: str, sensor_name: str, reading_uuid: str, prediction_result: schemas.CreatePredictionResult, session: Session = Depends(get_session)):
+@router.post("/gateway/{gateway_name}/sensor/{sensor_name}/reading/{reading_uuid}/prediction", status_code=status.HTTP_201_CREATED, tags=["Prediction Result"], dependencies=[Depends(limit_gateway_rate)])
+def create_prediction_result(gateway_name: str, sensor_name: str, reading_uuid: str, prediction_result: schemas.CreatePredictionResult, session: Session = Depends(get_session), gateway_uuid: Optional[str] = Depends(authenticate_gateway)):
     """
     POST /gateway/{gateway_name}/sensor/{sensor_name}/reading/{reading_uuid}/prediction endpoint
 
@@ -308,7 +479,7 @@ async def create_prediction_result(gateway_name: str, sensor_name: str, reading_
     """
     
     try:
-        crud.create_prediction_result(session=session, gateway_name=gateway_name, device_name=sensor_name, reading_uuid=reading_uuid, fields=prediction_result.model_dump())
+        crud.create_prediction_result(session=session, gateway_name=gateway_name, device_name=sensor_name, reading_uuid=reading_uuid, fields=prediction_result.model_dump(), gateway_uuid=gateway_uuid)
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
@@ -319,8 +490,8 @@ async def create_prediction_result(gateway_name: str, sensor_name: str, reading_
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Prediction result already exists")
 
 # --- Inference Latency Benchmark ---
-@router.post("/gateway/{gateway_name}/sensor/{sensor_name}/inference/latency", status_code=status.HTTP_201_CREATED, tags=["Inference Latency Benchmark"])
-async def create_inference_latency_benchmark(gateway_name: str, sensor_name: str, benchmark: schemas.InferenceLatencyBenchmark, session: Session = Depends(get_session)):
+@router.post("/gateway/{gateway_name}/sensor/{sensor_name}/inference/latency", status_code=status.HTTP_201_CREATED, tags=["Inference Latency Benchmark"], dependencies=[Depends(limit_gateway_rate)])
+def create_inference_latency_benchmark(gateway_name: str, sensor_name: str, benchmark: schemas.InferenceLatencyBenchmark, session: Session = Depends(get_session), gateway_uuid: Optional[str] = Depends(authenticate_gateway)):
     """
     POST /gateway/{gateway_name}/sensor/{sensor_name}/inference/latency endpoint
 
@@ -328,11 +499,205 @@ async def create_inference_latency_benchmark(gateway_name: str, sensor_name: str
     """
     
     try:
-        crud.create_inference_latency_benchmark(session=session, gateway_name=gateway_name, device_name=sensor_name, fields=benchmark.model_dump())
+        crud.create_inference_latency_benchmark(session=session, gateway_name=gateway_name, device_name=sensor_name, fields=benchmark.model_dump(), gateway_uuid=gateway_uuid)
+    except crud.EdgeGatewayNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
+    except crud.EdgeSensorNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
+    except crud.InvalidInferenceLatencyBenchmark as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=e.message)
+    except Exception:
+        logger.exception("Unexpected error in create_inference_latency_benchmark")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
+
+# --- Rollups ---
+
+@router.get("/gateway/{gateway_name}/sensor/{sensor_name}/rollup", status_code=status.HTTP_200_OK, tags=["Rollup"])
+def read_sensor_activity_rollups(gateway_name: str, sensor_name: str, granularity: schemas.RollupGranularity = schemas.RollupGranularity.HOUR, start: Optional[schemas.LocalDatetime] = None, end: Optional[schemas.LocalDatetime] = None, session: Session = Depends(get_read_session)) -> list[schemas.ReadSensorActivityRollup]:
+    """
+    GET /gateway/{gateway_name}/sensor/{sensor_name}/rollup endpoint
+
+    Endpoint to return the hourly or daily reading and prediction counts of a specific sensor.
+    """
+
+    try:
+        return crud.read_sensor_activity_rollups(session=session, gateway_name=gateway_name, device_name=sensor_name, granularity=granularity, start=start, end=end)
+    except crud.EdgeGatewayNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
+    except crud.EdgeSensorNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
+
+@router.get("/inference/latency/rollup", status_code=status.HTTP_200_OK, tags=["Rollup"])
+def read_inference_latency_rollups(granularity: schemas.RollupGranularity = schemas.RollupGranularity.HOUR, sensor_name: Optional[str] = None, inference_layer: Optional[schemas.InferenceLayer] = None, start: Optional[schemas.LocalDatetime] = None, end: Optional[schemas.LocalDatetime] = None, session: Session = Depends(get_read_session)) -> list[schemas.ReadInferenceLatencyRollup]:
+    """
+    GET /inference/latency/rollup endpoint
+
+    Endpoint to return hourly or daily inference latency aggregates per sensor and inference layer.
+    """
+
+    return crud.read_inference_latency_rollups(session=session, granularity=granularity, sensor_name=sensor_name, inference_layer=inference_layer, start=start, end=end)
+
+@router.get("/inference/latency/percentiles", status_code=status.HTTP_200_OK, tags=["Rollup"])
+def read_inference_latency_percentiles(window_minutes: int = Query(default=5, ge=1), sensor_name: Optional[str] = None, inference_layer: Optional[schemas.InferenceLayer] = None) -> list[schemas.ReadInferenceLatencyPercentiles]:
+    """
+    GET /inference/latency/percentiles endpoint
+
+    Endpoint to return the inference latency percentiles per sensor and inference layer over the last minutes, from the in-memory histograms.
+    """
+
+    try:
+        return histograms.get_histograms().summaries(window_minutes=window_minutes, sensor_name=sensor_name, inference_layer=inference_layer)
+    except histograms.LatencyWindowTooLong as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
+
+
+# --- Replay ---
+
+def _replay_stream(session_factory: sessionmaker, sensors: dict[str, str], start: Optional[datetime], end: Optional[datetime], after: Optional[tuple], chunk_size: int):
+    # The request's session is closed once the endpoint returns, so the stream opens its own
+    with session_factory() as session:
+        lines = []
+        for row in crud.iter_replay_readings(session=session, sensor_uuids=list(sensors), start=start, end=end, after=after, chunk_size=chunk_size):
+            line = {
+                "uuid": row.uuid,
+                "sensor_name": sensors[row.sensor_uuid],
+                "registered_at": schemas.to_local(row.registered_at),
+            }
+            # The response has already started, so a reading that cannot be
+            # decoded is sent as its text with the error instead of failing the stream
+            try:
+                line["values"] = payloads.stored_values(row.values, row.values_array, row.values_shape)
+            except ValueError as e:
+                line["values"] = row.values
+                line["error"] = str(e)
+            lines.append(orjson.dumps(line, option=orjson.OPT_SERIALIZE_NUMPY))
+            if len(lines) >= chunk_size:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+@router.get("/replay/readings", status_code=status.HTTP_200_OK, tags=["Replay"])
+def replay_sensor_readings(request: Request, gateway_name: Optional[str] = None, sensor_name: Optional[list[str]] = Query(None), start: Optional[schemas.LocalDatetime] = None, end: Optional[schemas.LocalDatetime] = None, after_registered_at: Optional[schemas.LocalDatetime] = None, after_uuid: Optional[UUID] = None, chunk_size: int = Query(5000, ge=1, le=50000), session: Session = Depends(get_read_session)):
+    """
+    GET /replay/readings endpoint
+
+    Endpoint to stream the readings of the selected sensors (sensor_name may be
+    repeated; otherwise every sensor of gateway_name, or every sensor) registered
+    in [start, end), as newline-delimited JSON objects with the reading uuid,
+    sensor name, registration time and decoded values, ordered by registration
+    time. To resume an interrupted replay, pass the registered_at and uuid of the
+    last reading received as after_registered_at and after_uuid.
+    """
+    if (after_registered_at is None) != (after_uuid is None):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="after_registered_at and after_uuid must be given together")
+
+    try:
+        sensors = crud.read_replay_sensors(session=session, gateway_name=gateway_name, device_names=sensor_name)
     except crud.EdgeGatewayNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge gateway not found")
     except crud.EdgeSensorNotFound:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Edge sensor not found")
-    except Exception as e:
-        print(e)
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
\ No newline at end of file
+
+    after = (after_registered_at, str(after_uuid)) if after_uuid is not None else None
+    # The stream reads the database long after the endpoint returns, so it keeps the admission slot
+    slot = hold_slot(request)
+    return StreamingResponse(
+        slot.stream(_replay_stream(read_session_factory(request), sensors, start, end, after, chunk_size)),
+        media_type="application/x-ndjson",
+        background=BackgroundTask(slot.release)
+    )
+
+@router.post("/replay/predictions", status_code=status.HTTP_200_OK, tags=["Replay"])
+def upsert_replay_predictions(batch: schemas.ReplayPredictionBatch, session: Session = Depends(get_session)) -> schemas.ReplayPredictionBatchResult:
+    """
+    POST /replay/predictions endpoint
+
+    Endpoint to store a batch of prediction results computed over replayed
+    readings, replacing the readings' existing prediction results.
+    """
+
+    predictions = {str(item.sensor_reading_uuid): item.prediction for item in batch.predictions}
+    try:
+        inserted, replaced, unknown = crud.upsert_prediction_results(session=session, inference_layer=batch.inference_layer, predictions=predictions)
+    except Exception:
+        logger.exception("Unexpected error in upsert_replay_predictions")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
+    return schemas.ReplayPredictionBatchResult(inserted=inserted, replaced=replaced, unknown_reading_uuids=unknown)
+
+
+# --- Jobs ---
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED, tags=["Job"])
+def create_job(job: schemas.CreateJob, session: Session = Depends(get_session)) -> schemas.ReadJob:
+    """
+    POST /jobs endpoint
+
+    Endpoint to queue a background job. It runs on a job worker; poll
+    GET /jobs/{job_id} for its progress and outcome.
+    """
+    if job.kind not in jobs.JOB_KINDS:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Unknown job kind, expected one of: {', '.join(sorted(jobs.JOB_KINDS))}")
+
+    try:
+        return crud.create_job(session=session, kind=job.kind, params=job.params)
+    except Exception:
+        logger.exception("Unexpected error in create_job")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Something went wrong")
+
+@router.get("/jobs", status_code=status.HTTP_200_OK, tags=["Job"])
+def read_jobs(job_status: Optional[schemas.JobStatus] = Query(None, alias="status"), kind: Optional[str] = None, limit: int = Query(100, ge=1, le=1000), session: Session = Depends(get_session)) -> list[schemas.ReadJob]:
+    """
+    GET /jobs endpoint
+
+    Endpoint to return the most recent background jobs, newest first.
+    """
+
+    return crud.read_jobs(session=session, status=job_status, kind=kind, limit=limit)
+
+@router.get("/jobs/{job_id}", status_code=status.HTTP_200_OK, tags=["Job"])
+def read_job(job_id: int, session: Session = Depends(get_session)) -> schemas.ReadJob:
+    """
+    GET /jobs/{job_id} endpoint
+
+    Endpoint to return the status and progress of a background job.
+    """
+
+    try:
+        return crud.read_job(session=session, job_id=job_id)
+    except crud.JobNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+@router.post("/jobs/{job_id}/cancel", status_code=status.HTTP_200_OK, tags=["Job"])
+def cancel_job(job_id: int, session: Session = Depends(get_session)) -> schemas.ReadJob:
+    """
+    POST /jobs/{job_id}/cancel endpoint
+
+    Endpoint to cancel a background job. A queued job is cancelled right away;
+    a running job stops at its next progress report.
+    """
+
+    try:
+        return crud.cancel_job(session=session, job_id=job_id)
+    except crud.JobNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    except crud.JobAlreadyFinished:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job has already finished")
+
+@router.get("/jobs/{job_id}/download", status_code=status.HTTP_200_OK, tags=["Job"])
+def download_job_result(job_id: int, session: Session = Depends(get_session)):
+    """
+    GET /jobs/{job_id}/download endpoint
+
+    Endpoint to download the file produced by a succeeded export job.
+    """
+
+    try:
+        job = crud.read_job(session=session, job_id=job_id)
+    except crud.JobNotFound:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+
+    path = (job.result or {}).get("path")
+    if job.status != schemas.JobStatus.SUCCEEDED or not path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job has no file to download")
+    return FileResponse(path, media_type="text/csv", filename=os.path.basename(path))
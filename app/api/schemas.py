@@ -1,7 +1,33 @@
-from datetime import datetime
-from pydantic import BaseModel
-from typing import Optional
+from datetime import datetime, timezone
+from functools import lru_cache
+from pydantic import AfterValidator, BaseModel, Field, PlainSerializer, StrictFloat, StrictInt, computed_field, field_serializer
+from typing import Annotated, Optional, Union
 import enum
+import pytz
+from uuid import UUID
+
+from app.api import content
+from app.core.config import get_settings
+
+# --- Timestamps ---
+# The database stores timezone-aware timestamps. At the API edge they are
+# shown in TIMEZONE, and naive timestamps sent by clients are read in it.
+
+@lru_cache(maxsize=8)
+def _timezone(name: str):
+    return pytz.timezone(name)
+
+def from_local(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        return _timezone(get_settings().timezone).localize(value)
+    return value
+
+def to_local(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(_timezone(get_settings().timezone))
+
+LocalDatetime = Annotated[datetime, AfterValidator(from_local), PlainSerializer(to_local, return_type=datetime)]
 
 # --- Device Schemas ---
 class BaseDeviceSchema(BaseModel):
@@ -36,11 +62,18 @@ class ReadEdgeGateway(BaseDeviceSchema):
     uuid: str
     device_address: str
     url: str
-    registered_at: datetime
+    registered_at: LocalDatetime
 
     class Config:
         from_attributes = True
 
+class EdgeGatewayToken(BaseModel):
+    """
+    Schema for returning a newly issued edge gateway token.
+    """
+
+    token: str
+
 
 # --- Sensor Config Schemas ---
 class SensorConfig(BaseModel):
@@ -53,6 +86,22 @@ class SensorConfig(BaseModel):
     class Config:
         from_attributes = True
 
+class BulkSensorConfig(SensorConfig):
+    """
+    Schema for pushing a sensor configuration to many sensors of a gateway.
+    If sensor_names is omitted, every sensor of the gateway is configured.
+    """
+
+    sensor_names: Optional[list[str]] = None
+
+class BulkSensorConfigResult(BaseModel):
+    """
+    Schema for returning the outcome of a bulk sensor configuration push.
+    """
+
+    configured: list[str]
+    missing: list[str] = []
+
 # --- Edge Sensor Schemas ---
 
 class SensorState(str, enum.Enum):
@@ -68,6 +117,7 @@ class CreateEdgeSensor(BaseDeviceSchema):
     Schema for creating an edge sensor.
     """
     device_address: str
+    values_shape: Optional[list[int]] = None # expected shape of reading values, -1 matches any size
 
 class UpdateEdgeSensor(BaseDeviceSchema):
     """
@@ -75,6 +125,28 @@ class UpdateEdgeSensor(BaseDeviceSchema):
     """
 
     state:  Optional[SensorState] = None
+    values_shape: Optional[list[int]] = None
+
+class SensorStateTransition(BaseModel):
+    """
+    Schema for a compare-and-set sensor state transition.
+    """
+
+    expected_state: SensorState
+    state: SensorState
+
+class ReadSensorStateChange(BaseModel):
+    """
+    Schema for returning a sensor state change.
+    """
+
+    id: int
+    from_state: SensorState
+    to_state: SensorState
+    changed_at: LocalDatetime
+
+    class Config:
+        from_attributes = True
 
 class ReadEdgeSensor(BaseDeviceSchema):
     """
@@ -83,7 +155,8 @@ class ReadEdgeSensor(BaseDeviceSchema):
 
     uuid: str
     device_address: str
-    registered_at: datetime
+    values_shape: Optional[list[int]] = None
+    registered_at: LocalDatetime
 
     sensor_config : Optional[SensorConfig] = None
 
@@ -111,6 +184,14 @@ class InferenceLatencyBenchmark(BaseModel):
     class Config:
         from_attributes = True
 
+class PublishedInferenceLatencyBenchmark(InferenceLatencyBenchmark):
+    """
+    Schema for an inference latency benchmark published over MQTT. uuid is
+    its idempotency key; without one, it is derived from the message.
+    """
+
+    uuid: Optional[UUID] = None
+
 
 # --- Inference Result Schemas ---
 
@@ -123,6 +204,13 @@ class CreatePredictionResult(BaseModel):
     prediction: int
     inference_layer: InferenceLayer
 
+class PublishedPredictionResult(CreatePredictionResult):
+    """
+    Schema for a prediction result published over MQTT.
+    """
+
+    sensor_reading_uuid: UUID
+
 class ReadPredictionResult(BaseModel):
     """
     Schema for an prediction result.
@@ -135,6 +223,32 @@ class ReadPredictionResult(BaseModel):
     class Config:
         from_attributes = True
 
+class ReplayPrediction(BaseModel):
+    """
+    Schema for one prediction result of a replay batch.
+    """
+
+    sensor_reading_uuid: UUID
+    prediction: int
+
+class ReplayPredictionBatch(BaseModel):
+    """
+    Schema for a batch of prediction results computed over replayed readings.
+    Existing prediction results of those readings are replaced.
+    """
+
+    inference_layer: InferenceLayer = InferenceLayer.CLOUD
+    predictions: list[ReplayPrediction]
+
+class ReplayPredictionBatchResult(BaseModel):
+    """
+    Schema for returning the outcome of a replay prediction batch.
+    """
+
+    inserted: int
+    replaced: int
+    unknown_reading_uuids: list[str] = []
+
 
 class BaseSensorReading(BaseModel):
     """
@@ -148,16 +262,144 @@ class CreateSensorReading(BaseSensorReading):
     """
     Schema for creating a sensor reading.
     """
-    pass
+
+    # JSON encoded, or native in MessagePack / CBOR bodies. Strict, so that
+    # booleans and numeric strings are rejected rather than coerced
+    values: Union[str, list[list[Union[StrictFloat, StrictInt]]]]
 
 class ReadSensorReading(BaseSensorReading):
     """
     Schema for returning a sensor reading.
     """
 
-    registered_at: datetime
+    values_shape: Optional[list[int]] = None
+    registered_at: LocalDatetime
     prediction_result: Optional[ReadPredictionResult] = None
+    values_array: Optional[bytes] = Field(default=None, exclude=True) # only used to serialize values
+
+    @field_serializer("values")
+    def serialize_values(self, values: str):
+        return content.serialize_values(values, self.values_array, self.values_shape)
+
+    class Config:
+        from_attributes = True
+
+
+# --- Snapshot Schemas ---
+
+class SnapshotEdgeSensor(ReadEdgeSensor):
+    """
+    Schema for an edge sensor within a fleet snapshot.
+    """
+
+    state: SensorState
+    latest_reading: Optional[ReadSensorReading] = None
+
+class SnapshotEdgeGateway(ReadEdgeGateway):
+    """
+    Schema for an edge gateway within a fleet snapshot.
+    """
+
+    edge_sensors: list[SnapshotEdgeSensor] = []
+
+
+# --- Rollup Schemas ---
+
+class RollupGranularity(str, enum.Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+class ReadSensorActivityRollup(BaseModel):
+    """
+    Schema for returning a sensor activity rollup bucket.
+    """
+
+    granularity: RollupGranularity
+    bucket_start: LocalDatetime
+    reading_count: int
+    sensor_prediction_count: int
+    gateway_prediction_count: int
+    cloud_prediction_count: int
 
     class Config:
         from_attributes = True
 
+class ReadInferenceLatencyRollup(BaseModel):
+    """
+    Schema for returning an inference latency rollup bucket.
+    """
+
+    sensor_name: str
+    inference_layer: InferenceLayer
+    granularity: RollupGranularity
+    bucket_start: LocalDatetime
+    latency_count: int
+    latency_sum: int
+    latency_min: int
+    latency_max: int
+
+    @computed_field
+    @property
+    def latency_avg(self) -> float:
+        return self.latency_sum / self.latency_count if self.latency_count else 0.0
+
+    class Config:
+        from_attributes = True
+
+class ReadInferenceLatencyPercentiles(BaseModel):
+    """
+    Schema for returning the inference latency percentiles of a sensor and inference layer over a recent window.
+    """
+
+    sensor_name: str
+    inference_layer: InferenceLayer
+    window_minutes: int
+    latency_count: int
+    latency_min: int
+    latency_max: int
+    latency_avg: float
+    p50: int
+    p90: int
+    p95: int
+    p99: int
+    p999: int
+
+
+# --- Job Schemas ---
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class CreateJob(BaseModel):
+    """
+    Schema for submitting a background job.
+    kind is one of "purge", "export", "archive" or "rebuild_rollups".
+    """
+
+    kind: str
+    params: dict = {}
+
+class ReadJob(BaseModel):
+    """
+    Schema for returning a background job.
+    """
+
+    id: int
+    kind: str
+    params: dict
+    status: JobStatus
+    progress: float
+    progress_message: Optional[str] = None
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    created_at: LocalDatetime
+    started_at: Optional[LocalDatetime] = None
+    finished_at: Optional[LocalDatetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,153 @@
+"""
+Edge gateway authentication.
+
+Gateways authenticate ingest requests with "Authorization: Bearer <token>",
+using the token issued for them by POST /gateway/{gateway_name}/token and
+stored in edge_gateway_table.jwt_token. Tokens are JWTs signed with
+SECRET_KEY (HS256) whose subject is the gateway name; issuing a new token
+revokes the previous one.
+
+Verified tokens are cached (GATEWAY_AUTH_CACHE_SIZE tokens, for
+GATEWAY_AUTH_CACHE_TTL_S seconds), so an authenticated request usually costs
+a dictionary lookup: no signature check and no query. The cache of a process
+is invalidated when that process updates or deletes a gateway or issues it a
+new token; other processes notice once their cached entry expires.
+"""
+import base64
+import hashlib
+import hmac
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import orjson
+
+from app.core.config import get_settings
+
+_HEADER = {"alg": "HS256", "typ": "JWT"}
+
+
+class InvalidGatewayToken(Exception):
+    def __init__(self, message="Invalid edge gateway token."):
+        self.message = message
+        super().__init__(self.message)
+
+
+class AuthenticatedGateway(NamedTuple):
+    name: str
+    uuid: str
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _signature(secret_key: str, signing_input: str) -> str:
+    return _b64encode(hmac.new(secret_key.encode(), signing_input.encode(), hashlib.sha256).digest())
+
+def issue_token(secret_key: str, gateway_name: str) -> str:
+    """
+    Return a new signed token for a gateway.
+    """
+    claims = {"sub": gateway_name, "jti": uuid.uuid4().hex, "iat": int(time.time())}
+    signing_input = _b64encode(orjson.dumps(_HEADER)) + "." + _b64encode(orjson.dumps(claims))
+    return signing_input + "." + _signature(secret_key, signing_input)
+
+def verify_token(secret_key: str, token: str) -> dict:
+    """
+    Check the signature and expiry of a token and return its claims.
+    Raises InvalidGatewayToken.
+    """
+    try:
+        header, claims, signature = token.split(".")
+        if not hmac.compare_digest(signature, _signature(secret_key, header + "." + claims)):
+            raise InvalidGatewayToken("Edge gateway token signature does not match.")
+        if orjson.loads(_b64decode(header)).get("alg") != _HEADER["alg"]:
+            raise InvalidGatewayToken("Edge gateway token is not signed with HS256.")
+        claims = orjson.loads(_b64decode(claims))
+    except InvalidGatewayToken:
+        raise
+    except Exception:
+        raise InvalidGatewayToken("Edge gateway token is malformed.")
+    if not isinstance(claims, dict) or not isinstance(claims.get("sub"), str):
+        raise InvalidGatewayToken("Edge gateway token has no subject.")
+    if "exp" in claims and (not isinstance(claims["exp"], (int, float)) or claims["exp"] <= time.time()):
+        raise InvalidGatewayToken("Edge gateway token has expired.")
+    return claims
+
+
+class VerifiedTokenCache:
+    """
+    Tokens already verified against the database, least recently used
+    evicted first. Safe to use from the event loop and from worker threads.
+    """
+
+    def __init__(self, max_size: int, ttl_s: float):
+        self.max_size = max_size
+        self.ttl_s = ttl_s
+        self._tokens: OrderedDict[str, tuple[AuthenticatedGateway, float]] = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[AuthenticatedGateway]:
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            gateway, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._tokens[token]
+                return None
+            self._tokens.move_to_end(token)
+            return gateway
+
+    def generation(self) -> int:
+        """
+        Return a token to pass to put(), taken before querying the database.
+        """
+        with self._lock:
+            return self._generation
+
+    def put(self, token: str, gateway: AuthenticatedGateway, claims: dict, generation: int):
+        """
+        Cache a verified token, unless anything was invalidated since
+        generation was taken.
+        """
+        if self.max_size <= 0 or self.ttl_s <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_s
+        if "exp" in claims:
+            expires_at = min(expires_at, time.monotonic() + claims["exp"] - time.time())
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._tokens[token] = (gateway, expires_at)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+
+    def invalidate(self, gateway_name: Optional[str] = None):
+        """
+        Forget the tokens of a gateway, or every token.
+        """
+        with self._lock:
+            self._generation += 1
+            for token in [token for token, (gateway, _) in self._tokens.items() if gateway_name is None or gateway.name == gateway_name]:
+                del self._tokens[token]
+
+
+_cache: Optional[VerifiedTokenCache] = None
+
+def get_token_cache() -> VerifiedTokenCache:
+    """
+    Return the process-wide token cache, creating it from the settings on first use.
+    """
+    global _cache
+    if _cache is None:
+        settings = get_settings()
+        _cache = VerifiedTokenCache(settings.gateway_auth_cache_size, settings.gateway_auth_cache_ttl_s)
+    return _cache
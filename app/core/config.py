@@ -1,23 +1,235 @@
 import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Optional
+
 from dotenv import load_dotenv
 
-# Retrieve enviroment variables from .env file
-load_dotenv()
 
-SECRET_KEY: str = os.environ.get("SECRET_KEY")
-DATA_MICROSERVICE_HOST: str = os.environ.get("DATA_MICROSERVICE_HOST")
-DATA_MICROSERVICE_PORT: int = int(os.environ.get("DATA_MICROSERVICE_PORT"))
+def _env_str(name: str, default: Optional[str] = None) -> Optional[str]:
+    value = os.environ.get(name)
+    return value if value not in (None, "") else default
+
+def _env_int(name: str, default: Optional[int] = None) -> Optional[int]:
+    value = _env_str(name)
+    return int(value) if value is not None else default
+
+def _env_float(name: str, default: Optional[float] = None) -> Optional[float]:
+    value = _env_str(name)
+    return float(value) if value is not None else default
+
+def _env_bool(name: str, default: bool = False) -> bool:
+    value = _env_str(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+def _env_list(name: str, default: list) -> list:
+    value = _env_str(name)
+    if value is None:
+        return list(default)
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Typed service settings.
+
+    Built from the environment (and the .env file, if any) the first time
+    get_settings() is called, so importing this module has no side effects.
+    """
+
+    secret_key: Optional[str] = None
+    data_microservice_host: Optional[str] = None
+    data_microservice_port: int = 8000
+
+    database_user: Optional[str] = None
+    database_pass: Optional[str] = None
+    database_host: Optional[str] = None
+    database_port: Optional[str] = None
+    database_name: Optional[str] = None
+    database_url_override: Optional[str] = None
+    database_replica_host: Optional[str] = None
+    database_replica_port: Optional[str] = None
+    database_replica_url_override: Optional[str] = None
+    database_auto_migrate: bool = False
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+
+    cloud_api_url: Optional[str] = None
+
+    timezone: str = "Chile/Continental"
+
+    archive_dir: str = "archive"
+    archive_after_days: int = 30
+    archive_chunk_size: int = 10000
+    export_dir: str = "exports"
+
+    job_workers: int = 2
+    job_poll_interval_s: float = 1.0
+    job_stale_after_s: float = 300.0
+
+    latest_buffer_readings: int = 100
+    latest_buffer_max_bytes: int = 64 * 2**20
+    latest_buffer_ttl_s: float = 5.0
+
+    latency_histogram_window_minutes: int = 60
+    latency_histogram_flush_s: float = 5.0
+    latency_histogram_retention_hours: int = 24
+
+    mqtt_host: Optional[str] = None
+    mqtt_port: int = 1883
+    mqtt_username: Optional[str] = None
+    mqtt_password: Optional[str] = None
+    mqtt_tls: bool = False
+    mqtt_client_id: str = "esn-cloud-data-ms"
+    mqtt_topic_prefix: str = "esn"
+    mqtt_shared_group: Optional[str] = None
+    mqtt_qos: int = 1
+    mqtt_batch_size: int = 500
+    mqtt_batch_wait_ms: float = 50.0
+
+    gateway_auth_enabled: bool = False
+    admin_token: Optional[str] = None
+    gateway_auth_cache_size: int = 10000
+    gateway_auth_cache_ttl_s: float = 60.0
+
+    gateway_rate_limit_per_s: float = 100.0
+    gateway_rate_limit_burst: int = 200
+    max_concurrent_requests: Optional[int] = None
+    admission_queue_timeout_ms: float = 100.0
+
+    log_level: str = "INFO"
+    log_format: str = "json"
+    slow_query_ms: float = 200.0
+
+    profiling_enabled: bool = False
+    profiling_header: str = "X-Profile"
+    profiling_sample_rate: float = 0.0
+    profiling_slow_ms: float = 500.0
+    profiling_dump_dir: Optional[str] = None
+
+    origins: list = field(default_factory=lambda: ["*"])
+
+    @property
+    def database_url(self) -> str:
+        if self.database_url_override:
+            return self.database_url_override
+        return "postgresql://{0}:{1}@{2}:{3}/{4}".format(
+            self.database_user, self.database_pass, self.database_host, self.database_port, self.database_name
+        )
+
+    @property
+    def database_replica_url(self) -> Optional[str]:
+        # The replica shares the primary's credentials and database name
+        if self.database_replica_url_override:
+            return self.database_replica_url_override
+        if not self.database_replica_host:
+            return None
+        return "postgresql://{0}:{1}@{2}:{3}/{4}".format(
+            self.database_user, self.database_pass, self.database_replica_host,
+            self.database_replica_port or self.database_port, self.database_name
+        )
+
+    @property
+    def concurrency_limit(self) -> int:
+        # By default, admit as many requests as there are pooled connections
+        if self.max_concurrent_requests is not None:
+            return self.max_concurrent_requests
+        return self.database_pool_size + self.database_max_overflow
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        # Retrieve enviroment variables from .env file
+        load_dotenv()
+
+        return cls(
+            secret_key=_env_str("SECRET_KEY"),
+            data_microservice_host=_env_str("DATA_MICROSERVICE_HOST"),
+            data_microservice_port=_env_int("DATA_MICROSERVICE_PORT", 8000),
+            database_user=_env_str("DATABASE_USER"),
+            database_pass=_env_str("DATABASE_PASS"),
+            database_host=_env_str("DATABASE_HOST"),
+            database_port=_env_str("DATABASE_PORT"),
+            database_name=_env_str("DATABASE_NAME"),
+            database_url_override=_env_str("DATABASE_URL"),
+            database_replica_host=_env_str("DATABASE_REPLICA_HOST"),
+            database_replica_port=_env_str("DATABASE_REPLICA_PORT"),
+            database_replica_url_override=_env_str("DATABASE_REPLICA_URL"),
+            database_auto_migrate=_env_bool("DATABASE_AUTO_MIGRATE", False),
+            database_pool_size=_env_int("DATABASE_POOL_SIZE", 5),
+            database_max_overflow=_env_int("DATABASE_MAX_OVERFLOW", 10),
+            cloud_api_url=_env_str("CLOUD_API_URL"),
+            timezone=_env_str("TIMEZONE", "Chile/Continental"),
+            archive_dir=_env_str("ARCHIVE_DIR", "archive"),
+            archive_after_days=_env_int("ARCHIVE_AFTER_DAYS", 30),
+            archive_chunk_size=_env_int("ARCHIVE_CHUNK_SIZE", 10000),
+            export_dir=_env_str("EXPORT_DIR", "exports"),
+            job_workers=_env_int("JOB_WORKERS", 2),
+            job_poll_interval_s=_env_float("JOB_POLL_INTERVAL_S", 1.0),
+            job_stale_after_s=_env_float("JOB_STALE_AFTER_S", 300.0),
+            latest_buffer_readings=_env_int("LATEST_BUFFER_READINGS", 100),
+            latest_buffer_max_bytes=_env_int("LATEST_BUFFER_MAX_BYTES", 64 * 2**20),
+            latest_buffer_ttl_s=_env_float("LATEST_BUFFER_TTL_S", 5.0),
+            latency_histogram_window_minutes=_env_int("LATENCY_HISTOGRAM_WINDOW_MINUTES", 60),
+            latency_histogram_flush_s=_env_float("LATENCY_HISTOGRAM_FLUSH_S", 5.0),
+            latency_histogram_retention_hours=_env_int("LATENCY_HISTOGRAM_RETENTION_HOURS", 24),
+            mqtt_host=_env_str("MQTT_HOST"),
+            mqtt_port=_env_int("MQTT_PORT", 1883),
+            mqtt_username=_env_str("MQTT_USERNAME"),
+            mqtt_password=_env_str("MQTT_PASSWORD"),
+            mqtt_tls=_env_bool("MQTT_TLS", False),
+            mqtt_client_id=_env_str("MQTT_CLIENT_ID", "esn-cloud-data-ms"),
+            mqtt_topic_prefix=_env_str("MQTT_TOPIC_PREFIX", "esn"),
+            mqtt_shared_group=_env_str("MQTT_SHARED_GROUP"),
+            mqtt_qos=_env_int("MQTT_QOS", 1),
+            mqtt_batch_size=_env_int("MQTT_BATCH_SIZE", 500),
+            mqtt_batch_wait_ms=_env_float("MQTT_BATCH_WAIT_MS", 50.0),
+            gateway_auth_enabled=_env_bool("GATEWAY_AUTH_ENABLED", False),
+            admin_token=_env_str("ADMIN_TOKEN"),
+            gateway_auth_cache_size=_env_int("GATEWAY_AUTH_CACHE_SIZE", 10000),
+            gateway_auth_cache_ttl_s=_env_float("GATEWAY_AUTH_CACHE_TTL_S", 60.0),
+            gateway_rate_limit_per_s=_env_float("GATEWAY_RATE_LIMIT_PER_S", 100.0),
+            gateway_rate_limit_burst=_env_int("GATEWAY_RATE_LIMIT_BURST", 200),
+            max_concurrent_requests=_env_int("MAX_CONCURRENT_REQUESTS"),
+            admission_queue_timeout_ms=_env_float("ADMISSION_QUEUE_TIMEOUT_MS", 100.0),
+            log_level=_env_str("LOG_LEVEL", "INFO").upper(),
+            log_format=_env_str("LOG_FORMAT", "json").lower(),
+            slow_query_ms=_env_float("SLOW_QUERY_MS", 200.0),
+            profiling_enabled=_env_bool("PROFILING_ENABLED", False),
+            profiling_header=_env_str("PROFILING_HEADER", "X-Profile"),
+            profiling_sample_rate=_env_float("PROFILING_SAMPLE_RATE", 0.0),
+            profiling_slow_ms=_env_float("PROFILING_SLOW_MS", 500.0),
+            profiling_dump_dir=_env_str("PROFILING_DUMP_DIR"),
+            origins=_env_list("ORIGINS", ["*"]),
+        )
+
 
-DATABASE_USER: str = os.environ.get("DATABASE_USER")
-DATABASE_PASS: str = os.environ.get("DATABASE_PASS")
-DATABASE_HOST: str = os.environ.get("DATABASE_HOST")
-DATABASE_PORT: str = os.environ.get("DATABASE_PORT")
-DATABASE_NAME: str = os.environ.get("DATABASE_NAME")
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Return the process-wide settings, building them on first use.
+    """
+    return Settings.from_env()
 
-CLOUD_API_URL: str = os.environ.get("CLOUD_API_URL")
 
-TIMEZONE: str = os.environ.get("TIMEZONE", "Chile/Continental")
+# Module-level names kept for backwards compatibility; resolved lazily.
+_LEGACY_NAMES = {
+    "SECRET_KEY": "secret_key",
+    "DATA_MICROSERVICE_HOST": "data_microservice_host",
+    "DATA_MICROSERVICE_PORT": "data_microservice_port",
+    "DATABASE_USER": "database_user",
+    "DATABASE_PASS": "database_pass",
+    "DATABASE_HOST": "database_host",
+    "DATABASE_PORT": "database_port",
+    "DATABASE_NAME": "database_name",
+    "CLOUD_API_URL": "cloud_api_url",
+    "TIMEZONE": "timezone",
+    "ORIGINS": "origins",
+}
 
-ORIGINS: list = [
-    "*"
-]
+def __getattr__(name: str):
+    if name in _LEGACY_NAMES:
+        return getattr(get_settings(), _LEGACY_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
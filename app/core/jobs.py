@@ -0,0 +1,259 @@
+"""
+Background jobs.
+
+Jobs are rows of job_table. Submitting one only inserts a row; a pool of
+worker threads started with the application (JOB_WORKERS, default 2) claims
+queued jobs oldest first, runs them off the request path and records their
+progress and outcome. Each job kind has a concurrency limit that holds
+across every instance of the service.
+
+Cancellation is cooperative: a running job stops at its next progress
+report. A job interrupted by a shutdown goes back to the queue, and so do
+the jobs of a worker that died, once their heartbeat is older than
+JOB_STALE_AFTER_S. Every job kind must therefore be safe to run again.
+"""
+import logging
+import os
+import socket
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import Settings
+from app.db import SessionLocal, ReadSessionLocal
+from app.db import archive, crud, models, rollups
+from app.db.export import write_inference_latency_benchmarks
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+class JobInterrupted(Exception):
+    pass
+
+
+class JobContext:
+    """
+    What a running job sees of the runner: its parameters and a way to
+    report progress, which is also where cancellation takes effect.
+    """
+
+    def __init__(self, job_id: int, params: dict, settings: Settings, stopping: threading.Event):
+        self.job_id = job_id
+        self.params = params
+        self.settings = settings
+        self._stopping = stopping
+
+    def progress(self, fraction: float, message: Optional[str] = None):
+        """
+        Record the progress of the job, from 0 to 1. Raises JobCancelled if
+        the job was cancelled, or JobInterrupted if the service is stopping.
+        """
+        with SessionLocal() as session:
+            cancel_requested = crud.update_job_progress(session=session, job_id=self.job_id, progress=min(max(fraction, 0.0), 1.0), message=message)
+        if cancel_requested:
+            raise JobCancelled
+        if self._stopping.is_set():
+            raise JobInterrupted
+
+
+@dataclass(frozen=True)
+class JobKind:
+    """
+    A registered job kind.
+
+    Attributes:
+    handler: Callable, runs the job with a session and a JobContext and returns its result (a JSON-able dict, or None)
+    concurrency: int, maximum number of jobs of this kind running at once
+    read_only: bool, whether the handler only reads, and so gets a session on the read replica
+    """
+
+    handler: Callable[[Session, JobContext], Optional[dict]]
+    concurrency: int
+    read_only: bool = False
+
+
+JOB_KINDS: dict[str, JobKind] = {}
+
+def job_kind(name: str, concurrency: int = 1, read_only: bool = False):
+    """
+    Register the decorated function as the handler of a job kind.
+    """
+    def register(handler):
+        JOB_KINDS[name] = JobKind(handler=handler, concurrency=concurrency, read_only=read_only)
+        return handler
+    return register
+
+
+# --- Job kinds ---
+
+@job_kind("purge")
+def purge_readings(session: Session, context: JobContext) -> dict:
+    # Same clean-up as delete_readings.py, one sensor at a time
+    crud.delete_inference_latency_benchmarks(session=session)
+    session.commit()
+
+    sensors = [
+        (gateway.device_name, sensor.device_name)
+        for gateway in crud.read_edge_gateways(session=session)
+        for sensor in crud.read_edge_sensors(session=session, gateway_name=gateway.device_name)
+    ]
+    for done, (gateway_name, sensor_name) in enumerate(sensors):
+        context.progress(done / (len(sensors) + 1), f"Purging {gateway_name}/{sensor_name}")
+        crud.delete_prediction_results(session=session, gateway_name=gateway_name, device_name=sensor_name)
+        crud.delete_sensor_readings(session=session, gateway_name=gateway_name, device_name=sensor_name)
+
+    crud.delete_rollups(session=session)
+    return {"sensors": len(sensors)}
+
+@job_kind("export", concurrency=2, read_only=True)
+def export_inference_latency_benchmarks(session: Session, context: JobContext) -> dict:
+    total = session.execute(select(func.count()).select_from(models.InferenceLatencyBenchmark)).scalar()
+    os.makedirs(context.settings.export_dir, exist_ok=True)
+    path = os.path.join(context.settings.export_dir, f"inference_latency_benchmarks-{context.job_id}.csv")
+
+    # Written under a temporary name, so a file at path is always complete
+    partial_path = path + ".partial"
+    try:
+        with open(partial_path, mode="w", newline="") as file:
+            rows = write_inference_latency_benchmarks(
+                session=session, file=file,
+                progress=lambda written: context.progress(written / max(total, 1), f"Exported {written} rows")
+            )
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return {"path": path, "rows": rows}
+
+@job_kind("archive")
+def archive_old_rows(session: Session, context: JobContext) -> dict:
+    settings = context.settings
+    before = archive.hot_window_start()
+    if context.params.get("older_than_days") is not None:
+        before = models.tz_now() - timedelta(days=int(context.params["older_than_days"]))
+
+    readings = session.execute(select(func.count()).where(models.SensorReading.registered_at < before)).scalar()
+    benchmarks = session.execute(select(func.count()).where(models.InferenceLatencyBenchmark.registered_at < before)).scalar()
+    total = max(readings + benchmarks, 1)
+
+    archived_readings = archive.archive_sensor_readings(
+        session, before, settings.archive_chunk_size, settings.archive_dir,
+        progress=lambda count: context.progress(count / total, f"Archived {count} readings")
+    )
+    archived_benchmarks = archive.archive_inference_latency_benchmarks(
+        session, before, settings.archive_chunk_size, settings.archive_dir,
+        progress=lambda count: context.progress((archived_readings + count) / total, f"Archived {count} benchmarks")
+    )
+    return {"sensor_readings": archived_readings, "inference_latency_benchmarks": archived_benchmarks}
+
+@job_kind("rebuild_rollups")
+def rebuild_rollups(session: Session, context: JobContext) -> dict:
+    since = context.params.get("since")
+    start = rollups.rebuild_rollups(session=session, start=datetime.fromisoformat(since) if since else None)
+    return {"start": start.isoformat() if start else None}
+
+
+# --- Runner ---
+
+class JobRunner:
+    """
+    Pool of worker threads running queued jobs, plus a heartbeat thread
+    keeping the jobs they hold from being considered stale.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.limits = {name: kind.concurrency for name, kind in JOB_KINDS.items()}
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+        self._running: set[int] = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with SessionLocal() as session:
+            stale_before = models.tz_now() - timedelta(seconds=self.settings.job_stale_after_s)
+            requeued = crud.requeue_stale_jobs(session=session, stale_before=stale_before)
+        if requeued:
+            logger.warning("Recovered %d stale jobs", requeued)
+
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{index}", daemon=True)
+            for index in range(self.settings.job_workers)
+        ]
+        self._threads.append(threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Stop claiming jobs and wait for the running ones to reach their next
+        progress report, where they are put back in the queue.
+        """
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while not self._stopping.is_set():
+            try:
+                with SessionLocal() as session:
+                    job = crud.claim_job(session=session, worker_id=self.worker_id, limits=self.limits)
+                    claimed = (job.id, job.kind, dict(job.params)) if job else None
+            except Exception:
+                logger.exception("Failed to claim a job")
+                claimed = None
+            if claimed is None:
+                self._stopping.wait(self.settings.job_poll_interval_s)
+                continue
+            self._run(*claimed)
+
+    def _run(self, job_id: int, kind: str, params: dict):
+        with self._lock:
+            self._running.add(job_id)
+        context = JobContext(job_id=job_id, params=params, settings=self.settings, stopping=self._stopping)
+        logger.info("Job %d (%s) started", job_id, kind, extra={"job_id": job_id, "job_kind": kind})
+
+        status, result, error = models.JobStatus.SUCCEEDED, None, None
+        job = JOB_KINDS[kind]
+        try:
+            # Progress and the outcome are still recorded on the primary
+            with (ReadSessionLocal if job.read_only else SessionLocal)() as session:
+                result = job.handler(session, context)
+        except JobCancelled:
+            status = models.JobStatus.CANCELLED
+        except JobInterrupted:
+            status = models.JobStatus.QUEUED
+        except Exception as e:
+            logger.exception("Job %d (%s) failed", job_id, kind, extra={"job_id": job_id, "job_kind": kind})
+            status, error = models.JobStatus.FAILED, f"{type(e).__name__}: {e}"
+
+        try:
+            with SessionLocal() as session:
+                crud.finish_job(session=session, job_id=job_id, status=status, result=result, error=error)
+        except Exception:
+            # Left running; it will be requeued once its heartbeat is stale
+            logger.exception("Failed to record the outcome of job %d", job_id)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+        logger.info("Job %d (%s) %s", job_id, kind, status.value, extra={"job_id": job_id, "job_kind": kind})
+
+    def _heartbeat(self):
+        interval = max(self.settings.job_stale_after_s / 3, 1.0)
+        while not self._stopping.wait(interval):
+            with self._lock:
+                job_ids = list(self._running)
+            try:
+                with SessionLocal() as session:
+                    crud.heartbeat_jobs(session=session, job_ids=job_ids)
+            except Exception:
+                logger.exception("Failed to record the job heartbeat")
@@ -0,0 +1,213 @@
+"""
+Structured, non-blocking logging.
+
+Records are put on an in-memory queue by a QueueHandler and written to
+stdout by a QueueListener thread, so code running on the event loop never
+waits on I/O. Every record carries the id of the request it was emitted for
+(taken from the X-Request-ID header or generated), and is rendered as one
+JSON object per line (or plain text with LOG_FORMAT=text).
+
+Also provides the request logging middleware (one line per request with
+its status and duration) and the slow-query log, which records every SQL
+statement slower than SLOW_QUERY_MS with its parameters and duration.
+"""
+import contextvars
+import copy
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+import orjson
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+from app.core.config import Settings
+
+REQUEST_ID_HEADER = "X-Request-ID"
+MAX_LOGGED_PARAMETERS_LENGTH = 1000
+
+request_id_var: contextvars.ContextVar = contextvars.ContextVar("request_id", default=None)
+
+logger = logging.getLogger("app.request")
+slow_query_logger = logging.getLogger("app.sql.slow")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_slow_query_ms: Optional[float] = None
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Attach the current request id to each record, in the emitting context.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+class RenderingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that renders the message and traceback in the emitting
+    thread, but keeps the record's extra fields for the formatter.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """
+    Render records as single-line JSON objects, including extra= fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+def configure_logging(settings: Settings):
+    """
+    Route the root logger through a queue to a background writer thread.
+    Idempotent; returns the running listener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    if settings.log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    queue_handler = RenderingQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(settings.log_level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def stop_logging():
+    """
+    Flush pending records and stop the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+# --- Slow query log ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._slow_query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_slow_query_started", None)
+    if started is None:
+        return
+    duration_ms = (time.perf_counter() - started) * 1000
+    if duration_ms >= _slow_query_ms:
+        slow_query_logger.warning(
+            "Slow query (%.1f ms)", duration_ms,
+            extra={
+                "sql": " ".join(statement.split()),
+                "parameters": repr(parameters)[:MAX_LOGGED_PARAMETERS_LENGTH],
+                "executemany": executemany,
+                "duration_ms": round(duration_ms, 2),
+            }
+        )
+
+def install_slow_query_log(threshold_ms: float):
+    """
+    Log every SQL statement slower than threshold_ms. A threshold of zero or
+    less disables the log. Idempotent.
+    """
+    global _slow_query_ms
+    if threshold_ms <= 0:
+        return
+    first_install = _slow_query_ms is None
+    _slow_query_ms = threshold_ms
+    if first_install:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- Request logging ---
+
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware assigning a request id to every request and logging its
+    method, path, status and duration once the response has been sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.header = REQUEST_ID_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == self.header:
+                request_id = value.decode("latin-1")[:100]
+                break
+        token = request_id_var.set(request_id or uuid.uuid4().hex)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)[REQUEST_ID_HEADER] = request_id_var.get()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            logger.info(
+                "%s %s %d", scope["method"], scope["path"], status_code,
+                extra={
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status_code": status_code,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                }
+            )
+            request_id_var.reset(token)
@@ -0,0 +1,262 @@
+"""
+MQTT ingest bridge.
+
+Gateways can publish readings, prediction results and latency benchmarks to
+an MQTT broker instead of calling the HTTP API, one message per item:
+
+    {MQTT_TOPIC_PREFIX}/{gateway}/{sensor}/reading     body of POST .../reading
+    {MQTT_TOPIC_PREFIX}/{gateway}/{sensor}/prediction  body of POST .../prediction, plus sensor_reading_uuid
+    {MQTT_TOPIC_PREFIX}/{gateway}/{sensor}/latency     body of POST .../inference/latency
+
+Payloads are JSON, MessagePack or CBOR (as in app.api.content), told apart by
+the MQTT 5 content type or else by their first byte. The bridge collects
+messages into batches of up to MQTT_BATCH_SIZE (waiting at most
+MQTT_BATCH_WAIT_MS for a batch to fill) and stores each batch through the
+bulk crud writers. QoS 1 and 2 messages are acknowledged only once their
+batch is committed; the client keeps a persistent session, so messages that
+were not acknowledged when the bridge stopped are delivered again. Messages
+that can never be stored (malformed, unknown sensor, duplicate) are logged
+and acknowledged.
+
+Delivering a message again must not store it twice. Readings and prediction
+results are keyed by their reading uuid; latency benchmarks by their uuid,
+or, without one, by a uuid derived from the topic and the benchmark fields.
+"""
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+from pydantic import BaseModel
+
+from app.api import content, schemas
+from app.core.config import Settings
+from app.db import SessionLocal
+from app.db import crud
+
+logger = logging.getLogger(__name__)
+
+READING = "reading"
+PREDICTION = "prediction"
+LATENCY = "latency"
+
+MESSAGE_SCHEMAS: dict[str, type[BaseModel]] = {
+    READING: schemas.CreateSensorReading,
+    PREDICTION: schemas.PublishedPredictionResult,
+    LATENCY: schemas.PublishedInferenceLatencyBenchmark,
+}
+
+# Namespace of the uuids derived for latency benchmarks published without one
+LATENCY_KEY_NAMESPACE = uuid.UUID("5d1f4a52-8c3e-4d7b-9a41-3f6b2c8e0d17")
+# Seconds the network thread waits for room in a full queue before dropping a message
+ENQUEUE_TIMEOUT_S = 1.0
+
+# Seconds to wait before writing a batch again after a database error
+RETRY_DELAYS = (0.5, 1, 2, 5, 10)
+
+
+def parse_topic(topic: str, prefix: str) -> Optional[tuple[str, str, str]]:
+    """
+    Split a topic into (gateway name, sensor name, kind), or return None if
+    it is not an ingest topic.
+    """
+    parts = topic.split("/")
+    if len(parts) != 4 or parts[0] != prefix or parts[3] not in MESSAGE_SCHEMAS:
+        return None
+    return parts[1], parts[2], parts[3]
+
+def latency_key(gateway_name: str, sensor_name: str, benchmark: schemas.InferenceLatencyBenchmark) -> str:
+    """
+    Return the idempotency key of a latency benchmark published without a
+    uuid, the same for every delivery of the message.
+    """
+    name = f"{gateway_name}/{sensor_name}/{benchmark.inference_layer.value}/{benchmark.send_timestamp}/{benchmark.recv_timestamp}/{benchmark.inference_latency}"
+    return str(uuid.uuid5(LATENCY_KEY_NAMESPACE, name))
+
+def payload_codec(message: mqtt.MQTTMessage) -> content.Codec:
+    content_type = getattr(message.properties, "ContentType", None) if message.properties else None
+    if content_type:
+        return content.request_codec(content_type)
+    first = message.payload[:1]
+    if first in (b"{", b" ", b"\n", b"\r", b"\t"):
+        return content.JSON
+    # CBOR maps are major type 5 (0xa0-0xbf)
+    if first and 0xa0 <= first[0] <= 0xbf and "application/cbor" in content.CODECS:
+        return content.CODECS["application/cbor"]
+    return content.MSGPACK
+
+
+class MqttBridge:
+    """
+    MQTT subscriber feeding a writer thread that stores messages in batches.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.prefix = settings.mqtt_topic_prefix
+        self.batch_size = settings.mqtt_batch_size
+        self.batch_wait = settings.mqtt_batch_wait_ms / 1000
+        # Bounded, so a slow database cannot make the bridge run out of memory
+        self._messages: queue.Queue = queue.Queue(maxsize=settings.mqtt_batch_size * 4)
+        self._stopping = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+
+        self.client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=settings.mqtt_client_id,
+            clean_session=False,
+            manual_ack=True,
+        )
+        if settings.mqtt_username:
+            self.client.username_pw_set(settings.mqtt_username, settings.mqtt_password)
+        if settings.mqtt_tls:
+            self.client.tls_set()
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+
+    @property
+    def topic(self) -> str:
+        topic = f"{self.prefix}/+/+/+"
+        if self.settings.mqtt_shared_group:
+            return f"$share/{self.settings.mqtt_shared_group}/{topic}"
+        return topic
+
+    def start(self):
+        self._writer = threading.Thread(target=self._write, name="mqtt-writer", daemon=True)
+        self._writer.start()
+        self.client.connect_async(self.settings.mqtt_host, self.settings.mqtt_port)
+        self.client.loop_start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Finish storing the current batch and disconnect. Messages still
+        queued are left unacknowledged, to be delivered again.
+        """
+        self._stopping.set()
+        if self._writer is not None:
+            self._writer.join(timeout)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    # --- Network thread ---
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error("MQTT connection refused: %s", reason_code)
+            return
+        logger.info("Connected to MQTT broker %s:%s, subscribing to %s", self.settings.mqtt_host, self.settings.mqtt_port, self.topic)
+        client.subscribe(self.topic, qos=self.settings.mqtt_qos)
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        if not self._stopping.is_set():
+            logger.warning("Disconnected from MQTT broker: %s", reason_code)
+
+    def _on_message(self, client, userdata, message: mqtt.MQTTMessage):
+        # Waiting longer would hold up the keepalives and acknowledgements of
+        # the network thread. A dropped QoS 1/2 message is not acknowledged,
+        # so the broker delivers it again after the next reconnect
+        try:
+            self._messages.put(message, timeout=ENQUEUE_TIMEOUT_S)
+        except queue.Full:
+            logger.warning("Dropped MQTT message on %s: the writer is behind", message.topic)
+
+    # --- Writer thread ---
+
+    def _write(self):
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._store(batch)
+
+    def _next_batch(self) -> list[mqtt.MQTTMessage]:
+        try:
+            batch = [self._messages.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._messages.get(timeout=remaining) if remaining > 0 else self._messages.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _store(self, batch: list[mqtt.MQTTMessage]):
+        items = defaultdict(list)
+        for message in batch:
+            item = self._decode(message)
+            if item is None:
+                self._ack(message)
+            else:
+                items[item[0]].append((message, *item[1:]))
+
+        # Readings first, so predictions can refer to readings of the same batch
+        for kind, store in ((READING, self._store_readings), (PREDICTION, self._store_predictions), (LATENCY, self._store_latencies)):
+            if not items[kind]:
+                continue
+            errors = self._retry(store, items[kind])
+            if errors is None:
+                return
+            for (message, *_), error in zip(items[kind], errors):
+                if isinstance(error, (crud.SensorReadingAlreadyExists, crud.PredictionResultAlreadyExists, crud.InferenceLatencyBenchmarkAlreadyExists)):
+                    # Expected when a message is delivered again after a restart
+                    logger.debug("Skipped MQTT message on %s: %s", message.topic, error.message)
+                elif error is not None:
+                    logger.warning("Rejected MQTT message on %s: %s", message.topic, error.message)
+                self._ack(message)
+
+    def _decode(self, message: mqtt.MQTTMessage) -> Optional[tuple]:
+        parsed = parse_topic(message.topic, self.prefix)
+        if parsed is None:
+            logger.warning("Ignored MQTT message on unexpected topic %s", message.topic)
+            return None
+        gateway_name, sensor_name, kind = parsed
+        try:
+            body = MESSAGE_SCHEMAS[kind].model_validate(payload_codec(message).decode(message.payload))
+        except Exception as e:
+            # Decoder errors of the binary formats are not all ValueErrors
+            logger.warning("Rejected malformed MQTT message on %s: %s", message.topic, e)
+            return None
+        return kind, gateway_name, sensor_name, body
+
+    def _retry(self, store, items: list[tuple]) -> Optional[list]:
+        # Keep the batch until it is stored: the broker will not resend it while connected
+        attempt = 0
+        while True:
+            try:
+                with SessionLocal() as session:
+                    return store(session, items)
+            except Exception:
+                delay = RETRY_DELAYS[min(attempt, len(RETRY_DELAYS) - 1)]
+                logger.exception("Failed to store %d MQTT messages, retrying in %ss", len(items), delay)
+            attempt += 1
+            if self._stopping.wait(delay):
+                return None
+
+    def _store_readings(self, session, items: list[tuple]) -> list:
+        return crud.create_sensor_readings(session=session, readings=[
+            (gateway_name, sensor_name, body.model_dump()) for _, gateway_name, sensor_name, body in items
+        ])
+
+    def _store_predictions(self, session, items: list[tuple]) -> list:
+        return crud.create_prediction_results(session=session, predictions=[
+            (gateway_name, sensor_name, str(body.sensor_reading_uuid), body.model_dump(exclude={"sensor_reading_uuid"}))
+            for _, gateway_name, sensor_name, body in items
+        ])
+
+    def _store_latencies(self, session, items: list[tuple]) -> list:
+        return crud.create_inference_latency_benchmarks(session=session, benchmarks=[
+            (gateway_name, sensor_name, {**body.model_dump(), "uuid": str(body.uuid or latency_key(gateway_name, sensor_name, body))})
+            for _, gateway_name, sensor_name, body in items
+        ])
+
+    def _ack(self, message: mqtt.MQTTMessage):
+        if message.qos > 0:
+            self.client.ack(message.mid, message.qos)
@@ -0,0 +1,98 @@
+"""
+Decoding and validation of sensor reading values.
+
+Readings carry their values as a JSON encoded list[list[float]], or as native
+arrays in MessagePack and CBOR bodies. They are parsed once on ingest into a
+2-D float64 array, validated, and stored next to the JSON text as raw
+little-endian bytes plus their shape, so consumers can rebuild the array with
+np.frombuffer instead of parsing the JSON again.
+"""
+from typing import Optional, Union
+
+import numpy as np
+import orjson
+
+VALUES_DTYPE = np.dtype("<f8")
+VALUES_NDIM = 2
+
+# Element types accepted in decoded values. bool is left out on purpose: it is
+# an int subclass, so numpy would silently read true as 1.0
+_NUMBER_TYPES = (int, float)
+
+
+class InvalidReadingValues(ValueError):
+    def __init__(self, message="Invalid sensor reading values."):
+        self.message = message
+        super().__init__(self.message)
+
+
+def decode_values(values: Union[str, bytes, list]) -> np.ndarray:
+    """
+    Parse reading values (JSON text or already decoded nested lists) into a
+    2-D float64 array, rejecting malformed, ragged, empty, non-numeric or
+    non-finite input.
+    """
+    if isinstance(values, (str, bytes)):
+        try:
+            values = orjson.loads(values)
+        except orjson.JSONDecodeError:
+            raise InvalidReadingValues("Sensor reading values are not valid JSON.")
+
+    try:
+        array = np.asarray(values, dtype=VALUES_DTYPE)
+    except (TypeError, ValueError):
+        raise InvalidReadingValues("Sensor reading values must be a rectangular list of lists of numbers.")
+
+    if array.ndim != VALUES_NDIM:
+        raise InvalidReadingValues(f"Sensor reading values must be {VALUES_NDIM}-dimensional, got {array.ndim} dimensions.")
+    # numpy also converts booleans and numeric strings, so check the elements themselves
+    if isinstance(values, list) and not all(type(value) in _NUMBER_TYPES for row in values for value in row):
+        raise InvalidReadingValues("Sensor reading values must be a rectangular list of lists of numbers.")
+    if array.size == 0:
+        raise InvalidReadingValues("Sensor reading values are empty.")
+    if not np.isfinite(array).all():
+        raise InvalidReadingValues("Sensor reading values must be finite numbers.")
+
+    return array
+
+def validate_shape(array: np.ndarray, expected_shape: Optional[list[int]]):
+    """
+    Check an array against the expected shape of a sensor, where -1 matches
+    any size. Sensors without an expected shape accept any 2-D array.
+    """
+    if expected_shape is None:
+        return
+
+    matches = len(expected_shape) == array.ndim and all(
+        expected in (-1, actual) for expected, actual in zip(expected_shape, array.shape)
+    )
+    if not matches:
+        raise InvalidReadingValues(
+            f"Sensor reading values have shape {list(array.shape)}, expected {list(expected_shape)}."
+        )
+
+def values_text(values: Union[str, bytes, list], array: np.ndarray) -> str:
+    """
+    Return the JSON text stored for reading values: the text as received, or
+    the decoded array encoded once when the values arrived as native arrays.
+    """
+    if isinstance(values, str):
+        return values
+    if isinstance(values, bytes):
+        return values.decode()
+    return orjson.dumps(array, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+
+def encode_array(array: np.ndarray) -> bytes:
+    return np.ascontiguousarray(array, dtype=VALUES_DTYPE).tobytes()
+
+def decode_array(blob: bytes, shape: list[int]) -> np.ndarray:
+    return np.frombuffer(blob, dtype=VALUES_DTYPE).reshape(shape)
+
+def stored_values(values: str, values_array: Optional[bytes], values_shape: Optional[list[int]]) -> np.ndarray:
+    """
+    Return the decoded values of a stored reading, reusing the stored array
+    when there is one and parsing the JSON text only for older rows.
+    """
+    if values_array is not None and values_shape is not None:
+        return decode_array(values_array, values_shape)
+    return decode_values(values)
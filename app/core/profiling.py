@@ -0,0 +1,280 @@
+"""
+Opt-in per-request profiling.
+
+When PROFILING_ENABLED is set, requests carrying the profiling header (or
+picked by PROFILING_SAMPLE_RATE) get a breakdown of where their time went:
+every SQL statement with its duration (through SQLAlchemy cursor events),
+the number of ORM instances loaded, the time between the endpoint returning
+and the response starting (response serialization) and the total time. The
+breakdown is logged and returned in a Server-Timing header. Requests slower
+than PROFILING_SLOW_MS also get a profiler report written to
+PROFILING_DUMP_DIR: pyinstrument HTML if pyinstrument is installed,
+otherwise a cProfile dump readable with pstats or snakeviz. The report
+covers the endpoint itself, profiled in the thread it runs in.
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import logging
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+
+from app.core.config import Settings
+
+logger = logging.getLogger(__name__)
+
+_current_profile: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=None)
+_installed = False
+
+
+@dataclass
+class RequestProfile:
+    """
+    Timings collected for a single profiled request. Times are perf_counter values.
+    """
+
+    method: str
+    path: str
+    started: float = field(default_factory=time.perf_counter)
+    statements: list = field(default_factory=list)
+    orm_loads: int = 0
+    endpoint_finished: Optional[float] = None
+    response_started: Optional[float] = None
+    finished: Optional[float] = None
+    report: Optional["_ProfilerReport"] = None
+
+    @property
+    def sql_ms(self) -> float:
+        return sum(duration for _, duration in self.statements) * 1000
+
+    @property
+    def serialization_ms(self) -> Optional[float]:
+        if self.endpoint_finished is None or self.response_started is None:
+            return None
+        return (self.response_started - self.endpoint_finished) * 1000
+
+    @property
+    def total_ms(self) -> float:
+        end = self.finished or self.response_started or time.perf_counter()
+        return (end - self.started) * 1000
+
+    def server_timing(self) -> str:
+        timings = [
+            f'sql;dur={self.sql_ms:.2f};desc="{len(self.statements)} statements"',
+            f'orm;desc="{self.orm_loads} loads"',
+        ]
+        if self.serialization_ms is not None:
+            timings.append(f"serialize;dur={self.serialization_ms:.2f}")
+        timings.append(f"total;dur={self.total_ms:.2f}")
+        return ", ".join(timings)
+
+    def summary(self, slowest: int = 5) -> dict:
+        statements = sorted(self.statements, key=lambda item: item[1], reverse=True)[:slowest]
+        return {
+            "method": self.method,
+            "path": self.path,
+            "total_ms": round(self.total_ms, 2),
+            "sql_ms": round(self.sql_ms, 2),
+            "sql_statements": len(self.statements),
+            "orm_loads": self.orm_loads,
+            "serialization_ms": round(self.serialization_ms, 2) if self.serialization_ms is not None else None,
+            "slowest_statements": [
+                {"ms": round(duration * 1000, 2), "sql": " ".join(statement.split())}
+                for statement, duration in statements
+            ],
+        }
+
+
+def current_profile() -> Optional[RequestProfile]:
+    return _current_profile.get()
+
+
+# --- SQLAlchemy instrumentation ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        context._profiling_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current_profile.get()
+    started = getattr(context, "_profiling_started", None)
+    if profile is not None and started is not None:
+        profile.statements.append((statement, time.perf_counter() - started))
+
+def _on_load(target, context):
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.orm_loads += 1
+
+def install():
+    """
+    Register the SQLAlchemy listeners feeding request profiles. Idempotent.
+    """
+    global _installed
+    if _installed:
+        return
+
+    from app.db import Base
+
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Base, "load", _on_load, propagate=True)
+    _installed = True
+
+
+# --- Endpoint instrumentation ---
+
+def timed_endpoint(endpoint):
+    """
+    Wrap an endpoint so profiled requests record when it returned, and get
+    their profiler report from the thread the endpoint runs in. The wrapper
+    keeps the endpoint signature, and whether it is a coroutine function,
+    for FastAPI.
+    """
+    def started(async_mode: bool):
+        profile = _current_profile.get()
+        if profile is not None and profile.report is not None:
+            profile.report.start(async_mode)
+
+    def finished():
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.endpoint_finished = time.perf_counter()
+            if profile.report is not None:
+                profile.report.stop()
+
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            started(async_mode=True)
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                finished()
+
+        return async_wrapper
+
+    # Plain endpoints run in the threadpool, with a copy of the request context
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        started(async_mode=False)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            finished()
+
+    return wrapper
+
+
+# --- Middleware ---
+
+class _ProfilerReport:
+    """
+    Wraps pyinstrument when available, cProfile otherwise. Both profile the
+    thread they are started in. cProfile can only profile one request at a
+    time, so concurrent requests get timings only.
+    """
+
+    _cprofile_lock = threading.Lock()
+
+    def __init__(self):
+        self._pyinstrument = None
+        self._cprofile = None
+        self._running = False
+
+    def start(self, async_mode: bool):
+        try:
+            from pyinstrument import Profiler
+            self._pyinstrument = Profiler(async_mode="enabled" if async_mode else "disabled")
+            self._pyinstrument.start()
+        except ImportError:
+            if _ProfilerReport._cprofile_lock.acquire(blocking=False):
+                self._cprofile = cProfile.Profile()
+                self._cprofile.enable()
+        self._running = True
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        if self._pyinstrument is not None:
+            self._pyinstrument.stop()
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            _ProfilerReport._cprofile_lock.release()
+
+    def dump(self, directory: str, profile: RequestProfile) -> Optional[str]:
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", profile.path).strip("_") or "root"
+        basename = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{profile.method}-{slug}"
+        os.makedirs(directory, exist_ok=True)
+        if self._pyinstrument is not None:
+            path = os.path.join(directory, basename + ".html")
+            with open(path, "w") as file:
+                file.write(self._pyinstrument.output_html())
+            return path
+        if self._cprofile is not None:
+            path = os.path.join(directory, basename + ".prof")
+            self._cprofile.dump_stats(path)
+            return path
+        return None
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests that ask for it or are sampled.
+    """
+
+    def __init__(self, app, settings: Settings):
+        self.app = app
+        self.header = settings.profiling_header.lower().encode()
+        self.sample_rate = settings.profiling_sample_rate
+        self.slow_ms = settings.profiling_slow_ms
+        self.dump_dir = settings.profiling_dump_dir
+        install()
+
+    def _should_profile(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == self.header:
+                return value.strip().lower() not in (b"", b"0", b"false")
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(method=scope["method"], path=scope["path"])
+        if self.dump_dir:
+            profile.report = _ProfilerReport()
+        token = _current_profile.set(profile)
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                profile.response_started = time.perf_counter()
+                MutableHeaders(scope=message).append("Server-Timing", profile.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            profile.finished = time.perf_counter()
+            _current_profile.reset(token)
+
+            slow = profile.total_ms >= self.slow_ms
+            summary = profile.summary()
+            if profile.report is not None:
+                # Stopped here if the request never reached its endpoint
+                profile.report.stop()
+                if slow:
+                    summary["report"] = profile.report.dump(self.dump_dir, profile)
+            logger.log(logging.WARNING if slow else logging.INFO, "Request profile: %s", summary, extra={"profile": summary})
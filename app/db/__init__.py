@@ -1,9 +1,67 @@
-from app.core.config import DATABASE_USER, DATABASE_PASS, DATABASE_HOST, DATABASE_PORT, DATABASE_NAME
+from typing import Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+from app.core.config import get_settings
+
 # --- Init DB ---
-db_url = "postgresql://{0}:{1}@{2}:{3}/{4}".format(DATABASE_USER, DATABASE_PASS, DATABASE_HOST, DATABASE_PORT, DATABASE_NAME)
-engine = create_engine(db_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The engines are created on demand (init_engine / get_engine) rather than at
+# import time, so importing models or crud never opens a connection pool.
+# SessionLocal always talks to the primary. ReadSessionLocal talks to the read
+# replica when one is configured (DATABASE_REPLICA_URL / DATABASE_REPLICA_HOST)
+# and to the primary otherwise; it must only be used for reads.
 Base = declarative_base()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False)
+
+_engine: Optional[Engine] = None
+_replica_engine: Optional[Engine] = None
+
+
+def init_engine(db_url: Optional[str] = None, replica_url: Optional[str] = None, **engine_kwargs) -> Engine:
+    """
+    Create the database engines and bind the session factories to them.
+    Calling it again returns the primary engine that already exists.
+    """
+    global _engine, _replica_engine
+    if _engine is None:
+        settings = get_settings()
+        engine_kwargs.setdefault("pool_size", settings.database_pool_size)
+        engine_kwargs.setdefault("max_overflow", settings.database_max_overflow)
+        _engine = create_engine(db_url or settings.database_url, **engine_kwargs)
+        SessionLocal.configure(bind=_engine)
+
+        replica_url = replica_url or settings.database_replica_url
+        if replica_url:
+            _replica_engine = create_engine(replica_url, **engine_kwargs)
+        ReadSessionLocal.configure(bind=_replica_engine or _engine)
+    return _engine
+
+def get_engine() -> Engine:
+    """
+    Return the primary database engine, creating it if needed.
+    """
+    return init_engine()
+
+def get_read_engine() -> Engine:
+    """
+    Return the read replica engine, or the primary if there is no replica.
+    """
+    engine = init_engine()
+    return _replica_engine or engine
+
+def dispose_engine():
+    """
+    Close every pooled connection and forget the engines.
+    """
+    global _engine, _replica_engine
+    if _replica_engine is not None:
+        _replica_engine.dispose()
+        _replica_engine = None
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+    SessionLocal.configure(bind=None)
+    ReadSessionLocal.configure(bind=None)
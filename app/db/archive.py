@@ -0,0 +1,280 @@
+"""
+Cold-tier archival of old readings, predictions and benchmarks.
+
+Rows older than the hot window are written to zstd-compressed Parquet files
+on local disk and then deleted from the database, one chunk at a time:
+
+    {archive_dir}/readings/gateway=<name>/sensor=<name>/day=YYYY-MM-DD/part-<id>.parquet
+    {archive_dir}/benchmarks/gateway=<name>/sensor=<name>/day=YYYY-MM-DD/part-<id>.parquet
+
+Days are UTC days. Predictions are stored in the same row as the reading they
+belong to. The readings of a chunk are locked while it is archived, so no
+prediction can be added to them meanwhile, and the predictions written are
+those returned by their DELETE. A chunk is committed only after its files have
+been written, so an interrupted run may leave a chunk both archived and in the
+database; readers deduplicate by uuid.
+
+pyarrow is imported on first use, so importing this module stays cheap.
+"""
+import os
+import shutil
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Optional
+from urllib.parse import quote
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from app.core.config import get_settings
+from app.db import latest, models
+
+READINGS = "readings"
+BENCHMARKS = "benchmarks"
+UNKNOWN_GATEWAY = "_unknown"
+
+
+def _reading_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("uuid", pa.string()),
+        ("values", pa.string()),
+        ("values_shape", pa.list_(pa.int32())),
+        ("registered_at", pa.timestamp("us", tz="UTC")),
+        ("prediction_uuid", pa.string()),
+        ("prediction", pa.int64()),
+        ("inference_layer", pa.int8()),
+        ("prediction_registered_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+def _benchmark_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ("uuid", pa.string()),
+        ("sensor_name", pa.string()),
+        ("inference_layer", pa.int8()),
+        ("send_timestamp", pa.int64()),
+        ("recv_timestamp", pa.int64()),
+        ("inference_latency", pa.int64()),
+        ("registered_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+def as_utc(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """
+    Convert a timestamp to an aware UTC one. Naive timestamps, as found in
+    files archived before timestamps became timezone-aware, are taken as UTC.
+    """
+    if timestamp is None:
+        return None
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+def hot_window_start() -> datetime:
+    """
+    Return the timestamp before which rows are moved to the archive.
+    """
+    return models.tz_now() - timedelta(days=get_settings().archive_after_days)
+
+def sensor_directory(kind: str, gateway_name: str, sensor_name: str, archive_dir: Optional[str] = None) -> str:
+    return os.path.join(
+        archive_dir or get_settings().archive_dir,
+        kind,
+        f"gateway={quote(gateway_name, safe='')}",
+        f"sensor={quote(sensor_name, safe='')}",
+    )
+
+def _write_partition(kind: str, gateway_name: str, sensor_name: str, day: date, rows: list[dict], schema, archive_dir: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    directory = os.path.join(sensor_directory(kind, gateway_name, sensor_name, archive_dir), f"day={day.isoformat()}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+
+    table = pa.Table.from_pylist(rows, schema=schema)
+    pq.write_table(table, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+
+def _write_chunk(kind: str, rows: list[dict], schema, archive_dir: str):
+    partitions = defaultdict(list)
+    for row in rows:
+        gateway_name = row.pop("gateway_name")
+        sensor_name = row.pop("partition_sensor_name")
+        partitions[(gateway_name, sensor_name, as_utc(row["registered_at"]).date())].append(row)
+
+    for (gateway_name, sensor_name, day), partition in partitions.items():
+        _write_partition(kind, gateway_name, sensor_name, day, partition, schema, archive_dir)
+
+
+def archive_sensor_readings(session: Session, before: datetime, chunk_size: int, archive_dir: str, progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Move readings registered before the given timestamp, with their
+    predictions, to the archive. Returns the number of archived readings.
+    progress, if given, is called with the running count after each chunk.
+    """
+    reading = models.SensorReading
+    prediction = models.PredictionResult
+    schema = _reading_schema()
+    archived = 0
+
+    while True:
+        # Locking the readings blocks new predictions of them (their foreign
+        # key check) until the chunk is committed
+        query = select(
+            reading.uuid,
+            reading.values,
+            reading.values_shape,
+            reading.registered_at,
+            models.EdgeSensor.device_name.label("partition_sensor_name"),
+            models.EdgeGateway.device_name.label("gateway_name")
+        ).join(
+            models.EdgeSensor, reading.sensor_uuid == models.EdgeSensor.uuid
+        ).join(
+            models.EdgeGateway, models.EdgeSensor.gateway_uuid == models.EdgeGateway.uuid
+        ).where(
+            reading.registered_at < before
+        ).order_by(reading.registered_at).limit(chunk_size).with_for_update(of=reading)
+
+        rows = [row._asdict() for row in session.execute(query)]
+        if not rows:
+            break
+
+        reading_uuids = [row["uuid"] for row in rows]
+        predictions = {
+            deleted.sensor_reading_uuid: deleted for deleted in session.execute(
+                delete(prediction).where(prediction.sensor_reading_uuid.in_(reading_uuids)).returning(
+                    prediction.sensor_reading_uuid,
+                    prediction.uuid,
+                    prediction.prediction,
+                    prediction.inference_layer,
+                    prediction.registered_at
+                )
+            )
+        }
+        for row in rows:
+            deleted = predictions.get(row["uuid"])
+            row["prediction_uuid"] = deleted.uuid if deleted else None
+            row["prediction"] = deleted.prediction if deleted else None
+            row["inference_layer"] = deleted.inference_layer.value if deleted else None
+            row["prediction_registered_at"] = deleted.registered_at if deleted else None
+        session.execute(delete(reading).where(reading.uuid.in_(reading_uuids)))
+        _write_chunk(READINGS, rows, schema, archive_dir)
+        session.commit()
+        latest.get_buffer().invalidate()
+        archived += len(reading_uuids)
+        if progress is not None:
+            progress(archived)
+
+    return archived
+
+def archive_inference_latency_benchmarks(session: Session, before: datetime, chunk_size: int, archive_dir: str, progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Move benchmarks registered before the given timestamp to the archive.
+    Returns the number of archived benchmarks. progress, if given, is called
+    with the running count after each chunk.
+    """
+    benchmark = models.InferenceLatencyBenchmark
+    schema = _benchmark_schema()
+    archived = 0
+
+    while True:
+        query = select(
+            benchmark.uuid,
+            benchmark.sensor_name,
+            benchmark.inference_layer,
+            benchmark.send_timestamp,
+            benchmark.recv_timestamp,
+            benchmark.inference_latency,
+            benchmark.registered_at,
+            benchmark.sensor_name.label("partition_sensor_name"),
+            models.EdgeGateway.device_name.label("gateway_name")
+        ).outerjoin(
+            models.EdgeSensor, benchmark.sensor_name == models.EdgeSensor.device_name
+        ).outerjoin(
+            models.EdgeGateway, models.EdgeSensor.gateway_uuid == models.EdgeGateway.uuid
+        ).where(
+            benchmark.registered_at < before
+        ).order_by(benchmark.registered_at).limit(chunk_size)
+
+        rows = [row._asdict() for row in session.execute(query)]
+        if not rows:
+            break
+
+        benchmark_uuids = [row["uuid"] for row in rows]
+        for row in rows:
+            row["inference_layer"] = row["inference_layer"].value
+            row["gateway_name"] = row["gateway_name"] or UNKNOWN_GATEWAY
+        _write_chunk(BENCHMARKS, rows, schema, archive_dir)
+
+        session.execute(delete(benchmark).where(benchmark.uuid.in_(benchmark_uuids)))
+        session.commit()
+        archived += len(benchmark_uuids)
+        if progress is not None:
+            progress(archived)
+
+    return archived
+
+def archive(session: Session, before: Optional[datetime] = None, chunk_size: Optional[int] = None, archive_dir: Optional[str] = None) -> dict:
+    """
+    Archive readings, predictions and benchmarks older than the hot window
+    (or registered before the given timestamp). Returns the archived counts.
+    """
+    settings = get_settings()
+    before = before or hot_window_start()
+    chunk_size = chunk_size or settings.archive_chunk_size
+    archive_dir = archive_dir or settings.archive_dir
+
+    return {
+        "sensor_readings": archive_sensor_readings(session, before, chunk_size, archive_dir),
+        "inference_latency_benchmarks": archive_inference_latency_benchmarks(session, before, chunk_size, archive_dir),
+    }
+
+
+def has_archived_readings(gateway_name: str, sensor_name: str) -> bool:
+    return os.path.isdir(sensor_directory(READINGS, gateway_name, sensor_name))
+
+def read_archived_readings(gateway_name: str, sensor_name: str, start: Optional[datetime] = None, end: Optional[datetime] = None, limit: Optional[int] = None) -> list[dict]:
+    """
+    Return the first limit (or all) archived readings of a sensor registered
+    in [start, end), ordered by registration time, as dicts following the
+    reading Parquet schema. Only the day partitions needed are read.
+    """
+    import pyarrow.parquet as pq
+
+    start, end = as_utc(start), as_utc(end)
+    directory = sensor_directory(READINGS, gateway_name, sensor_name)
+    if not os.path.isdir(directory):
+        return []
+
+    rows = []
+    for partition in sorted(os.listdir(directory)):
+        day = date.fromisoformat(partition.removeprefix("day="))
+        if start is not None and day < start.date():
+            continue
+        if end is not None and day > end.date():
+            continue
+        # Partitions are read in day order, so later days cannot make the cut
+        if limit is not None and len(rows) >= limit:
+            break
+        partition_directory = os.path.join(directory, partition)
+        for filename in sorted(os.listdir(partition_directory)):
+            if not filename.endswith(".parquet"):
+                continue
+            for row in pq.read_table(os.path.join(partition_directory, filename)).to_pylist():
+                row["registered_at"] = as_utc(row["registered_at"])
+                if start is not None and row["registered_at"] < start:
+                    continue
+                if end is not None and row["registered_at"] >= end:
+                    continue
+                rows.append(row)
+    rows.sort(key=lambda row: (row["registered_at"], row["uuid"]))
+    return rows if limit is None else rows[:limit]
+
+def delete_archived_readings(gateway_name: str, sensor_name: str):
+    """
+    Remove every archived reading of a sensor.
+    """
+    shutil.rmtree(sensor_directory(READINGS, gateway_name, sensor_name), ignore_errors=True)
@@ -1,7 +1,24 @@
-from app.db import models
-
-from sqlalchemy.orm import Session
-from sqlalchemy import select, update
+from app.core import auth, payloads
+from app.db import archive, histograms, latest, models, rollups
+
+import heapq
+import uuid as uuid_lib
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterator, NamedTuple, Optional
+from sqlalchemy.orm import Session, selectinload, joinedload, undefer
+from sqlalchemy import select, update, insert, delete, literal, func, tuple_, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+
+# Rows fetched per round trip by the streaming bulk readers
+BULK_READ_CHUNK_SIZE = 1000
+# Rows written per statement by the bulk writers
+BULK_WRITE_CHUNK_SIZE = 1000
+# Arbitrary constant used as the advisory lock key while claiming a job, so
+# that the per-kind running counts cannot change under the claiming worker.
+_JOB_CLAIM_LOCK_KEY = 7_361_205
 
 # --- Exception classes ---
 class EdgeGatewayNotFound(Exception):
@@ -39,6 +56,11 @@ class SensorReadingNotFound(Exception):
         self.message = message
         super().__init__(self.message)
 
+class SensorReadingAlreadyExists(Exception):
+    def __init__(self, message="Sensor reading already exists."):
+        self.message = message
+        super().__init__(self.message)
+
 class PredictionResultNotFound(Exception):
     def __init__(self, message="Prediction result not found."):
         self.message = message
@@ -49,6 +71,81 @@ class PredictionResultAlreadyExists(Exception):
         self.message = message
         super().__init__(self.message)
 
+class InvalidSensorReading(Exception):
+    def __init__(self, message="Invalid sensor reading."):
+        self.message = message
+        super().__init__(self.message)
+
+class InvalidInferenceLatencyBenchmark(Exception):
+    def __init__(self, message="Invalid inference latency benchmark."):
+        self.message = message
+        super().__init__(self.message)
+
+class InferenceLatencyBenchmarkAlreadyExists(Exception):
+    def __init__(self, message="Inference latency benchmark already exists."):
+        self.message = message
+        super().__init__(self.message)
+
+class JobNotFound(Exception):
+    def __init__(self, message="Job not found."):
+        self.message = message
+        super().__init__(self.message)
+
+class JobAlreadyFinished(Exception):
+    def __init__(self, message="Job has already finished."):
+        self.message = message
+        super().__init__(self.message)
+
+class SensorStateConflict(Exception):
+    def __init__(self, message="Edge sensor is not in the expected state.", current_state=None):
+        self.message = message
+        self.current_state = current_state
+        super().__init__(self.message)
+
+# --- Row records for bulk reads ---
+# Plain tuples built from Core rows: no identity map, no change tracking and
+# no lazy loading. They carry the attributes the read schemas need.
+class PredictionResultRow(NamedTuple):
+    prediction: int
+    inference_layer: models.InferenceLayer
+
+class SensorReadingRow(NamedTuple):
+    uuid: str
+    values: str
+    values_shape: Optional[list[int]]
+    registered_at: datetime
+    prediction_result: Optional[PredictionResultRow]
+    values_array: Optional[bytes] = None
+
+def _read_sensors_by_name(session: Session, names: set[tuple[str, str]]) -> dict[tuple[str, str], Row]:
+    # (gateway name, sensor name) -> row (uuid, values_shape), in one query
+    if not names:
+        return {}
+    gateway = models.EdgeGateway
+    sensor = models.EdgeSensor
+    query = select(
+        gateway.device_name.label("gateway_name"),
+        sensor.device_name,
+        sensor.uuid,
+        sensor.values_shape
+    ).join(
+        gateway, gateway.uuid == sensor.gateway_uuid
+    ).where(
+        tuple_(gateway.device_name, sensor.device_name).in_(list(names))
+    )
+    return {(row.gateway_name, row.device_name): row for row in session.execute(query)}
+
+def _is_uuid(value) -> bool:
+    try:
+        uuid_lib.UUID(str(value))
+    except ValueError:
+        return False
+    return True
+
+def _chunks(items: list, size: int) -> Iterator[list]:
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
 # --- CRUD methods for EdgeGateway ---
 
 def read_edge_gateways(session: Session, paginate=False, page=0, page_size=10) -> list[models.EdgeGateway]:
@@ -70,6 +167,18 @@ def read_edge_gateway(session: Session, device_name) -> models.EdgeGateway:
 
     return result
 
+def read_edge_gateway_by_token(session: Session, token: str) -> models.EdgeGateway:
+    query = select(models.EdgeGateway).where(
+        models.EdgeGateway.jwt_token == token
+    )
+    result = session.execute(query).scalars().first()
+
+    # Check if a gateway holds the token
+    if not result:
+        raise EdgeGatewayNotFound
+
+    return result
+
 def create_edge_gateway(session: Session, fields: dict):
     device_name = fields["device_name"]
     
@@ -98,12 +207,29 @@ def update_edge_gateway(session: Session, device_name: str, fields: dict):
     ).values(fields)
     session.execute(query)
     session.commit()
+    auth.get_token_cache().invalidate(gateway_name=device_name)
+
+def update_edge_gateway_token(session: Session, device_name: str, token: str):
+    """
+    Replace the token of an edge gateway, revoking the previous one.
+    """
+    # Check if the edge gateway exists
+    read_edge_gateway(session=session, device_name=device_name)
+
+    query = update(models.EdgeGateway).where(
+        models.EdgeGateway.device_name == device_name
+    ).values(jwt_token=token)
+    session.execute(query)
+    session.commit()
+    auth.get_token_cache().invalidate(gateway_name=device_name)
 
 def delete_edge_gateway(session: Session, device_name: str):
     # Check if the edge gateway exists and get the gateway
     gateway = read_edge_gateway(session=session, device_name=device_name)
     session.delete(gateway)
     session.commit()
+    latest.get_buffer().invalidate(gateway_name=device_name)
+    auth.get_token_cache().invalidate(gateway_name=device_name)
 
 # --- CRUD methods for EdgeSensor ---
 
@@ -120,12 +246,14 @@ def read_edge_sensors(session: Session, gateway_name: str, paginate=False, page=
 
     return result.scalars().all()
 
-def read_edge_sensor(session: Session, gateway_name: str, device_name: str) -> models.EdgeSensor:
-    # Check if the edge gateway exists and get the gateway
-    gateway = read_edge_gateway(session=session, device_name=gateway_name)
+def read_edge_sensor(session: Session, gateway_name: str, device_name: str, gateway_uuid: Optional[str] = None) -> models.EdgeSensor:
+    # Check if the edge gateway exists and get the gateway, unless the caller
+    # already resolved it (an authenticated gateway)
+    if gateway_uuid is None:
+        gateway_uuid = read_edge_gateway(session=session, device_name=gateway_name).uuid
 
     query = select(models.EdgeSensor).where(
-        models.EdgeSensor.gateway_uuid == gateway.uuid,
+        models.EdgeSensor.gateway_uuid == gateway_uuid,
         models.EdgeSensor.device_name == device_name
     )
     result = session.execute(query).scalars().first()
@@ -181,6 +309,105 @@ def delete_edge_sensor(session: Session, gateway_name: str, device_name: str):
 
     session.delete(sensor)
     session.commit()
+    latest.get_buffer().invalidate(gateway_name=gateway_name, device_name=device_name)
+
+def transition_edge_sensor_state(session: Session, gateway_name: str, device_name: str, expected_state: models.SensorState, new_state: models.SensorState):
+    """
+    Compare-and-set the state of an edge sensor.
+
+    The sensor is moved to new_state only if it is currently in expected_state.
+    The conditional UPDATE and the insert into the state change log run as a
+    single statement, so concurrent writers never overwrite each other blindly.
+    Returns the logged state change row.
+    """
+    state_type = models.SensorStateChange.from_state.type
+
+    updated = update(models.EdgeSensor).where(
+        models.EdgeSensor.gateway_uuid == models.EdgeGateway.uuid,
+        models.EdgeGateway.device_name == gateway_name,
+        models.EdgeSensor.device_name == device_name,
+        models.EdgeSensor.state == expected_state
+    ).values(state=new_state).returning(models.EdgeSensor.uuid).cte("updated_sensor")
+
+    query = insert(models.SensorStateChange).from_select(
+        ["sensor_uuid", "from_state", "to_state", "changed_at"],
+        select(
+            updated.c.uuid,
+            literal(expected_state, state_type),
+            literal(new_state, state_type),
+            func.now()
+        )
+    ).returning(
+        models.SensorStateChange.id,
+        models.SensorStateChange.sensor_uuid,
+        models.SensorStateChange.from_state,
+        models.SensorStateChange.to_state,
+        models.SensorStateChange.changed_at
+    )
+    result = session.execute(query).first()
+
+    if not result:
+        # Nothing matched: find out whether the sensor is missing or in another state
+        sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+        raise SensorStateConflict(current_state=sensor.state)
+
+    session.commit()
+    return result
+
+def read_sensor_state_changes(session: Session, gateway_name: str, device_name: str, limit: int = 100, before_id: Optional[int] = None) -> list[models.SensorStateChange]:
+    # Check if the edge sensor exists and get the sensor
+    sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+
+    query = select(models.SensorStateChange).where(
+        models.SensorStateChange.sensor_uuid == sensor.uuid
+    )
+    if before_id is not None:
+        query = query.where(models.SensorStateChange.id < before_id)
+    query = query.order_by(models.SensorStateChange.id.desc()).limit(limit)
+    result = session.execute(query)
+    return result.scalars().all()
+
+# --- Fleet snapshot ---
+
+def read_fleet_snapshot(session: Session, gateway_name: Optional[str] = None) -> tuple[list[models.EdgeGateway], dict[str, models.SensorReading]]:
+    """
+    Load every gateway (or only gateway_name) with its sensors and their
+    configuration, plus the latest reading (and prediction) of each sensor.
+
+    Runs a fixed number of queries regardless of fleet size. Returns the
+    gateways and a dict mapping sensor uuid to its latest reading.
+    """
+    query = select(models.EdgeGateway).options(
+        selectinload(models.EdgeGateway.edge_sensors).selectinload(models.EdgeSensor.sensor_config)
+    )
+    if gateway_name is not None:
+        query = query.where(models.EdgeGateway.device_name == gateway_name)
+    gateways = session.execute(query).scalars().all()
+
+    # Check if the edge gateway exists
+    if gateway_name is not None and not gateways:
+        raise EdgeGatewayNotFound
+
+    sensor_uuids = [sensor.uuid for gateway in gateways for sensor in gateway.edge_sensors]
+    if not sensor_uuids:
+        return gateways, {}
+
+    # One index probe per sensor on (sensor_uuid, registered_at)
+    latest_reading = select(models.SensorReading.uuid).where(
+        models.SensorReading.sensor_uuid == models.EdgeSensor.uuid
+    ).order_by(models.SensorReading.registered_at.desc()).limit(1).scalar_subquery()
+
+    query = select(models.SensorReading).options(
+        joinedload(models.SensorReading.prediction_result),
+        undefer(models.SensorReading.values_array)
+    ).where(
+        models.SensorReading.uuid.in_(
+            select(latest_reading).where(models.EdgeSensor.uuid.in_(sensor_uuids))
+        )
+    )
+    readings = session.execute(query).scalars().all()
+
+    return gateways, {reading.sensor_uuid: reading for reading in readings}
 
 # --- CRUD methods for SensorConfig ---
 def create_sensor_config(session: Session, gateway_name: str, device_name: str, fields: dict):
@@ -219,6 +446,48 @@ def update_sensor_config(session: Session, gateway_name: str, device_name: str,
     session.execute(query)
     session.commit()
 
+def upsert_sensor_configs(session: Session, gateway_name: str, fields: dict, device_names: Optional[list[str]] = None) -> list[str]:
+    """
+    Create or update the configuration of many sensors of a gateway at once.
+
+    Applies fields to the sensors in device_names, or to every sensor of the
+    gateway if device_names is None, with a single
+    INSERT ... SELECT ... ON CONFLICT (edge_sensor_uuid) DO UPDATE statement.
+    Returns the names of the sensors that were configured.
+    """
+    config_columns = models.SensorConfig.__table__.c
+
+    sensors = select(
+        func.gen_random_uuid(),
+        models.EdgeSensor.uuid,
+        func.now(),
+        *[literal(value, config_columns[name].type) for name, value in fields.items()]
+    ).join(
+        models.EdgeGateway, models.EdgeSensor.gateway_uuid == models.EdgeGateway.uuid
+    ).where(
+        models.EdgeGateway.device_name == gateway_name
+    )
+    if device_names is not None:
+        sensors = sensors.where(models.EdgeSensor.device_name.in_(device_names))
+
+    upsert = pg_insert(models.SensorConfig).from_select(["uuid", "edge_sensor_uuid", "registered_at", *fields], sensors)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[models.SensorConfig.edge_sensor_uuid],
+        set_={name: upsert.excluded[name] for name in fields}
+    ).returning(models.SensorConfig.edge_sensor_uuid).cte("upserted_config")
+
+    query = select(models.EdgeSensor.device_name).join(
+        upsert, upsert.c.edge_sensor_uuid == models.EdgeSensor.uuid
+    )
+    result = session.execute(query).scalars().all()
+
+    # Nothing matched: check if the edge gateway exists
+    if not result:
+        read_edge_gateway(session=session, device_name=gateway_name)
+
+    session.commit()
+    return result
+
 def delete_sensor_config(session: Session, gateway_name: str, device_name: str):
     # Check if the edge sensor exists
     sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
@@ -233,71 +502,316 @@ def delete_sensor_config(session: Session, gateway_name: str, device_name: str):
 
 
 # --- CRUD methods for SensorReading ---
-def read_sensor_reading(session: Session, gateway_name: str, device_name: str, reading_uuid: str) -> models.SensorReading:
+def read_sensor_reading(session: Session, gateway_name: str, device_name: str, reading_uuid: str, gateway_uuid: Optional[str] = None, with_values_array: bool = False) -> models.SensorReading:
     # Check if the edge gateway exists
-    read_edge_gateway(session=session, device_name=gateway_name)
+    if gateway_uuid is None:
+        read_edge_gateway(session=session, device_name=gateway_name)
 
     # Check if the edge sensor exists 
-    read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+    read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name, gateway_uuid=gateway_uuid)
 
     query = select(models.SensorReading).where(
         models.SensorReading.uuid == reading_uuid
     )
+    if with_values_array:
+        query = query.options(undefer(models.SensorReading.values_array))
     result = session.execute(query).scalars().first()
     if not result:
         raise SensorReadingNotFound
     return result
 
 
-def read_sensor_readings(session: Session, gateway_name: str, device_name: str, paginate=False, page=0, page_size=10) -> list[models.SensorReading]:
+def read_sensor_readings(session: Session, gateway_name: str, device_name: str, paginate=False, page=0, page_size=10, start: Optional[datetime] = None, end: Optional[datetime] = None) -> list[SensorReadingRow]:
+    """
+    Return the readings of a sensor registered in [start, end), ordered by
+    registration time, as SensorReadingRow records.
+
+    If the range reaches back past the hot window and the sensor has archived
+    readings, those are merged in before paginating; a page then reads at most
+    page + page_size readings from each source.
+    """
     # Check if the edge gateway exists
     read_edge_gateway(session=session, device_name=gateway_name)
     
     # Check if the edge sensor exists and get the sensor
     sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
-    query = select(models.SensorReading).where(
-        models.SensorReading.sensor_uuid == sensor.uuid
-    )
+    query = _sensor_reading_rows_query(sensor.uuid, start=start, end=end)
+
+    reaches_archive = start is None or archive.as_utc(start) < archive.hot_window_start()
+    if not (reaches_archive and archive.has_archived_readings(gateway_name, device_name)):
+        if paginate:
+            query = query.offset(page).limit(page_size)
+        return [_sensor_reading_row(row) for row in session.execute(query)]
+
+    # Both sources come ordered by registration time, so only the first
+    # page + page_size of each can end up in the page
+    limit = page + page_size if paginate else None
+    stored = [_sensor_reading_row(row) for row in session.execute(query.limit(limit))]
+    archived = [
+        _archived_sensor_reading_row(row)
+        for row in archive.read_archived_readings(gateway_name, device_name, start=start, end=end, limit=limit)
+    ]
+
+    result, seen = [], set()
+    for reading in heapq.merge(stored, archived, key=lambda reading: (archive.as_utc(reading.registered_at), reading.uuid)):
+        if reading.uuid not in seen:
+            seen.add(reading.uuid)
+            result.append(reading)
     if paginate:
-        query = query.offset(page).limit(page_size)
-    result = session.execute(query)
-    return result.scalars().all()
+        result = result[page:page + page_size]
+    return result
+
+def iter_sensor_readings(session: Session, sensor_uuid: str, start: Optional[datetime] = None, end: Optional[datetime] = None, chunk_size: int = BULK_READ_CHUNK_SIZE) -> Iterator[SensorReadingRow]:
+    """
+    Stream the database readings of a sensor in registration order, fetching
+    chunk_size rows per round trip through a server-side cursor.
+    """
+    query = _sensor_reading_rows_query(sensor_uuid, start=start, end=end)
+    result = session.execute(query.execution_options(yield_per=chunk_size))
+    for row in result:
+        yield _sensor_reading_row(row)
+
+def read_latest_sensor_readings(session: Session, gateway_name: str, device_name: str, limit: int = 10, use_buffer: bool = True, fill_buffer: bool = True) -> list[SensorReadingRow]:
+    """
+    Return the latest limit readings of a sensor, newest first, from the
+    in-process buffer when it holds them, or with one index scan otherwise.
+    With use_buffer unset the buffer is not read; with fill_buffer unset it is
+    not filled from the query, which must be done only for sessions that may
+    lag behind the primary.
+    """
+    buffer = latest.get_buffer()
+    result = buffer.get(gateway_name, device_name, limit) if use_buffer else None
+    if result is not None:
+        return result
+
+    generation = buffer.generation()
+    sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+    reading = models.SensorReading
+    query = _sensor_reading_rows_query(sensor.uuid).order_by(None).order_by(
+        reading.registered_at.desc(), reading.uuid.desc()
+    ).limit(max(limit, buffer.capacity))
+    result = [_sensor_reading_row(row) for row in session.execute(query)]
+
+    if fill_buffer:
+        buffer.fill(gateway_name, device_name, result, generation)
+    return result[:limit]
+
+def _sensor_reading_rows_query(sensor_uuid: str, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    reading = models.SensorReading
+    prediction = models.PredictionResult
+    query = select(
+        reading.uuid,
+        reading.values,
+        reading.values_shape,
+        reading.registered_at,
+        prediction.prediction,
+        prediction.inference_layer,
+        reading.values_array
+    ).outerjoin(
+        prediction, prediction.sensor_reading_uuid == reading.uuid
+    ).where(
+        reading.sensor_uuid == sensor_uuid
+    ).order_by(reading.registered_at, reading.uuid)
+    if start is not None:
+        query = query.where(reading.registered_at >= start)
+    if end is not None:
+        query = query.where(reading.registered_at < end)
+    return query
+
+def _sensor_reading_row(row: Row) -> SensorReadingRow:
+    uuid, values, values_shape, registered_at, prediction, inference_layer, values_array = row
+    prediction_result = None
+    if inference_layer is not None:
+        prediction_result = PredictionResultRow(prediction, inference_layer)
+    return SensorReadingRow(uuid, values, values_shape, registered_at, prediction_result, values_array)
+
+def _archived_sensor_reading_row(row: dict) -> SensorReadingRow:
+    prediction_result = None
+    if row["prediction_uuid"] is not None:
+        prediction_result = PredictionResultRow(row["prediction"], models.InferenceLayer(row["inference_layer"]))
+    return SensorReadingRow(row["uuid"], row["values"], row.get("values_shape"), archive.as_utc(row["registered_at"]), prediction_result)
+
+def create_sensor_reading(session: Session, gateway_name: str, device_name: str, fields: dict, gateway_uuid: Optional[str] = None):
+    # Decode the values before touching the database, so bad payloads are rejected early
+    try:
+        values = payloads.decode_values(fields["values"])
+    except payloads.InvalidReadingValues as e:
+        raise InvalidSensorReading(e.message)
 
-def create_sensor_reading(session: Session, gateway_name: str, device_name: str, fields: dict):
     # Check if the edge gateway exists
-    read_edge_gateway(session=session, device_name=gateway_name)
+    if gateway_uuid is None:
+        read_edge_gateway(session=session, device_name=gateway_name)
 
     # Check if the edge sensor exists and get the sensor
-    sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
-
-    db_instance = models.SensorReading(sensor_uuid=sensor.uuid, **fields)
+    sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name, gateway_uuid=gateway_uuid)
+
+    # Check if the values match the layout expected for the sensor
+    try:
+        payloads.validate_shape(values, sensor.values_shape)
+    except payloads.InvalidReadingValues as e:
+        raise InvalidSensorReading(e.message)
+
+    # registered_at is set by the database, in the same transaction as the rollup update
+    values_array = payloads.encode_array(values)
+    db_instance = models.SensorReading(
+        sensor_uuid=sensor.uuid,
+        values_shape=list(values.shape),
+        values_array=values_array,
+        **{**fields, "values": payloads.values_text(fields["values"], values)}
+    )
     session.add(db_instance)
-    session.commit()
-    session.refresh(db_instance)
+    rollups.record_readings(session=session, sensor_uuid=sensor.uuid)
+    try:
+        # The insert returns registered_at (eager_defaults), so the buffered
+        # row is taken before commit expires it, without a refresh
+        session.flush()
+        row = SensorReadingRow(db_instance.uuid, db_instance.values, db_instance.values_shape, db_instance.registered_at, None, values_array)
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise SensorReadingAlreadyExists
+    latest.get_buffer().record_reading(gateway_name, device_name, row)
     
-def delete_sensor_readings(session: Session, gateway_name: str, device_name: str):
+def create_sensor_readings(session: Session, readings: list[tuple[str, str, dict]]) -> list[Optional[Exception]]:
+    """
+    Store many readings, given as (gateway name, sensor name, fields), with
+    the same validation as create_sensor_reading, one insert per
+    BULK_WRITE_CHUNK_SIZE readings, and commit.
+
+    Returns, for each reading, None if it was stored, or the exception
+    create_sensor_reading would have raised; those readings are skipped.
+    """
+    errors: list[Optional[Exception]] = [None] * len(readings)
+    sensors = _read_sensors_by_name(session, {(gateway_name, device_name) for gateway_name, device_name, _ in readings})
+
+    rows, keys = [], {}
+    for index, (gateway_name, device_name, fields) in enumerate(readings):
+        sensor = sensors.get((gateway_name, device_name))
+        if sensor is None:
+            errors[index] = EdgeSensorNotFound()
+            continue
+        if not _is_uuid(fields["uuid"]):
+            errors[index] = InvalidSensorReading("Sensor reading uuid is not a valid UUID.")
+            continue
+        if str(fields["uuid"]) in keys:
+            errors[index] = SensorReadingAlreadyExists()
+            continue
+        try:
+            values = payloads.decode_values(fields["values"])
+            payloads.validate_shape(values, sensor.values_shape)
+        except payloads.InvalidReadingValues as e:
+            errors[index] = InvalidSensorReading(e.message)
+            continue
+        values_array = payloads.encode_array(values)
+        rows.append({
+            **fields,
+            "values": payloads.values_text(fields["values"], values),
+            "values_shape": list(values.shape),
+            "values_array": values_array,
+            "sensor_uuid": sensor.uuid,
+        })
+        keys[str(fields["uuid"])] = index, gateway_name, device_name, values_array
+
+    reading = models.SensorReading
+    stored = []
+    for chunk in _chunks(rows, BULK_WRITE_CHUNK_SIZE):
+        query = pg_insert(reading).values(chunk).on_conflict_do_nothing(
+            index_elements=[reading.uuid]
+        ).returning(reading.uuid, reading.values, reading.values_shape, reading.registered_at, reading.sensor_uuid)
+        stored.extend(session.execute(query).all())
+
+    counts = defaultdict(int)
+    for row in stored:
+        counts[row.sensor_uuid] += 1
+    for sensor_uuid, count in counts.items():
+        rollups.record_readings(session=session, sensor_uuid=sensor_uuid, count=count)
+    session.commit()
+
+    # Readings that were not inserted already existed
+    inserted = {row.uuid for row in stored}
+    for reading_uuid, (index, _, _, _) in keys.items():
+        if reading_uuid not in inserted:
+            errors[index] = SensorReadingAlreadyExists()
+
+    buffer = latest.get_buffer()
+    for row in stored:
+        _, gateway_name, device_name, values_array = keys[row.uuid]
+        buffer.record_reading(gateway_name, device_name, SensorReadingRow(row.uuid, row.values, row.values_shape, row.registered_at, None, values_array))
+    return errors
+
+def backfill_sensor_reading_arrays(session: Session, chunk_size: int = BULK_WRITE_CHUNK_SIZE) -> tuple[int, int]:
+    """
+    Decode the values of readings stored before values_array and
+    values_shape existed (migration 2) and store them, chunk_size readings
+    per transaction. Readings whose values cannot be decoded are left as
+    they are.
+
+    Returns the number of readings backfilled and of readings skipped.
+    """
+    reading = models.SensorReading
+    backfilled = skipped = 0
+    last_uuid = None
+    while True:
+        query = select(reading.uuid, reading.values).where(
+            reading.values_array.is_(None)
+        ).order_by(reading.uuid).limit(chunk_size)
+        if last_uuid is not None:
+            query = query.where(reading.uuid > last_uuid)
+        rows = session.execute(query).all()
+        if not rows:
+            return backfilled, skipped
+        last_uuid = rows[-1].uuid
+
+        updates = []
+        for row in rows:
+            try:
+                values = payloads.decode_values(row.values)
+            except payloads.InvalidReadingValues:
+                skipped += 1
+                continue
+            updates.append({"uuid": row.uuid, "values_shape": list(values.shape), "values_array": payloads.encode_array(values)})
+        if updates:
+            session.execute(update(reading), updates)
+        session.commit()
+        backfilled += len(updates)
+
+def delete_sensor_readings(session: Session, gateway_name: str, device_name: str, include_archive: bool = False):
     # check if the edge gateway exists
     read_edge_gateway(session=session, device_name=gateway_name)
 
     # Check if the edge sensor exists
-    read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
-    
-    readings = read_sensor_readings(session=session, gateway_name=gateway_name, device_name=device_name)
-    for reading in readings:
-        session.delete(reading)
+    sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+
+    # Two statements however many readings there are. Prediction results are
+    # detached from the deleted readings, as the ORM did when deleting them one by one
+    readings = select(models.SensorReading.uuid).where(models.SensorReading.sensor_uuid == sensor.uuid)
+    session.execute(
+        update(models.PredictionResult).where(models.PredictionResult.sensor_reading_uuid.in_(readings))
+        .values(sensor_reading_uuid=None).execution_options(synchronize_session=False)
+    )
+    session.execute(
+        delete(models.SensorReading).where(models.SensorReading.sensor_uuid == sensor.uuid)
+        .execution_options(synchronize_session=False)
+    )
     session.commit()
+    latest.get_buffer().invalidate(gateway_name=gateway_name, device_name=device_name)
+
+    # Archived readings are only deleted when asked for, so that purges keep the cold archive
+    if include_archive:
+        archive.delete_archived_readings(gateway_name=gateway_name, sensor_name=device_name)
 
 # --- CRUD methods for PredictionResult ---
 
-def create_prediction_result(session: Session, gateway_name: str, device_name: str, reading_uuid: str, fields: dict):
+def create_prediction_result(session: Session, gateway_name: str, device_name: str, reading_uuid: str, fields: dict, gateway_uuid: Optional[str] = None):
     # Check if the edge gateway exists
-    read_edge_gateway(session=session, device_name=gateway_name)
+    if gateway_uuid is None:
+        read_edge_gateway(session=session, device_name=gateway_name)
 
-    # Check if the edge sensor exists
-    read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+    # Check if the edge sensor exists and get the sensor
+    sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name, gateway_uuid=gateway_uuid)
 
     # Check if the sensor reading exists and get the reading
-    reading = read_sensor_reading(session=session, gateway_name=gateway_name, device_name=device_name, reading_uuid=reading_uuid)
+    reading = read_sensor_reading(session=session, gateway_name=gateway_name, device_name=device_name, reading_uuid=reading_uuid, gateway_uuid=gateway_uuid)
 
     # Check if the prediction result already exists
     if reading.prediction_result:
@@ -305,46 +819,510 @@ def create_prediction_result(session: Session, gateway_name: str, device_name: s
 
     db_instance = models.PredictionResult(sensor_reading_uuid=reading_uuid, **fields)
     session.add(db_instance)
+    rollups.record_predictions(session=session, sensor_uuid=sensor.uuid, inference_layer=db_instance.inference_layer)
+    session.commit()
+    latest.get_buffer().record_prediction(reading_uuid, PredictionResultRow(fields["prediction"], models.InferenceLayer(fields["inference_layer"])))
+
+def create_prediction_results(session: Session, predictions: list[tuple[str, str, str, dict]]) -> list[Optional[Exception]]:
+    """
+    Store many prediction results, given as (gateway name, sensor name,
+    reading uuid, fields), with one insert per BULK_WRITE_CHUNK_SIZE
+    results, and commit.
+
+    Returns, for each prediction result, None if it was stored, or the
+    exception create_prediction_result would have raised; those are skipped.
+    """
+    errors: list[Optional[Exception]] = [None] * len(predictions)
+    reading_uuids = {reading_uuid for _, _, reading_uuid, _ in predictions if _is_uuid(reading_uuid)}
+
+    # reading uuid -> (sensor uuid, gateway name, sensor name)
+    readings = {}
+    for chunk in _chunks(sorted(reading_uuids), BULK_WRITE_CHUNK_SIZE):
+        query = select(
+            models.SensorReading.uuid,
+            models.SensorReading.sensor_uuid,
+            models.EdgeGateway.device_name.label("gateway_name"),
+            models.EdgeSensor.device_name
+        ).join(
+            models.EdgeSensor, models.EdgeSensor.uuid == models.SensorReading.sensor_uuid
+        ).join(
+            models.EdgeGateway, models.EdgeGateway.uuid == models.EdgeSensor.gateway_uuid
+        ).where(models.SensorReading.uuid.in_(chunk))
+        readings.update({row.uuid: (row.sensor_uuid, row.gateway_name, row.device_name) for row in session.execute(query)})
+
+    rows, indexes = [], {}
+    for index, (gateway_name, device_name, reading_uuid, fields) in enumerate(predictions):
+        found = readings.get(str(reading_uuid))
+        if found is None or found[1:] != (gateway_name, device_name):
+            errors[index] = SensorReadingNotFound()
+            continue
+        if str(reading_uuid) in indexes:
+            errors[index] = PredictionResultAlreadyExists()
+            continue
+        rows.append({
+            **fields,
+            "uuid": func.gen_random_uuid(),
+            "inference_layer": models.InferenceLayer(fields["inference_layer"]),
+            "sensor_reading_uuid": str(reading_uuid),
+        })
+        indexes[str(reading_uuid)] = index
+
+    prediction = models.PredictionResult
+    stored = []
+    for chunk in _chunks(rows, BULK_WRITE_CHUNK_SIZE):
+        query = pg_insert(prediction).values(chunk).on_conflict_do_nothing(
+            index_elements=[prediction.sensor_reading_uuid]
+        ).returning(prediction.sensor_reading_uuid, prediction.prediction, prediction.inference_layer, prediction.registered_at)
+        stored.extend(session.execute(query).all())
+
+    rollups.record_prediction_changes(
+        session=session,
+        added=[(readings[row.sensor_reading_uuid][0], row.inference_layer, row.registered_at) for row in stored]
+    )
     session.commit()
 
+    inserted = {row.sensor_reading_uuid for row in stored}
+    for reading_uuid, index in indexes.items():
+        if reading_uuid not in inserted:
+            errors[index] = PredictionResultAlreadyExists()
+
+    buffer = latest.get_buffer()
+    for row in stored:
+        buffer.record_prediction(row.sensor_reading_uuid, PredictionResultRow(row.prediction, row.inference_layer))
+    return errors
+
 def delete_prediction_results(session: Session, gateway_name: str, device_name: str):
     # Check if the edge gateway exists
     read_edge_gateway(session=session, device_name=gateway_name)
 
     # Check if the edge sensor exists
-    read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+    sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
 
-    readings = read_sensor_readings(session=session, gateway_name=gateway_name, device_name=device_name)
-    for reading in readings:
-        if reading.prediction_result:
-            session.delete(reading.prediction_result)
+    readings = select(models.SensorReading.uuid).where(models.SensorReading.sensor_uuid == sensor.uuid)
+    session.execute(
+        delete(models.PredictionResult).where(models.PredictionResult.sensor_reading_uuid.in_(readings))
+        .execution_options(synchronize_session=False)
+    )
     session.commit()
+    latest.get_buffer().invalidate(gateway_name=gateway_name, device_name=device_name)
 
 # --- CRUD methods for InferenceLatencyBenchmark ---
-def create_inference_latency_benchmark(session: Session, gateway_name: str, device_name: str, fields: dict):
+def _validate_inference_latency_benchmark(fields: dict):
+    """
+    Checks shared by the single and the batch path. Raises InvalidInferenceLatencyBenchmark.
+    """
+    if fields.get("send_timestamp") is None:
+        raise InvalidInferenceLatencyBenchmark("Inference latency benchmark has no send_timestamp.")
+
+def create_inference_latency_benchmark(session: Session, gateway_name: str, device_name: str, fields: dict, gateway_uuid: Optional[str] = None):
     # Check if the edge gateway exists
-    read_edge_gateway(session=session, device_name=gateway_name)
+    if gateway_uuid is None:
+        read_edge_gateway(session=session, device_name=gateway_name)
 
     # Check if the edge sensor exists
-    read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+    read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name, gateway_uuid=gateway_uuid)
+
+    _validate_inference_latency_benchmark(fields)
     
     db_instance = models.InferenceLatencyBenchmark(**fields)
     session.add(db_instance)
+    rollups.record_latencies(
+        session=session,
+        sensor_name=db_instance.sensor_name,
+        inference_layer=db_instance.inference_layer,
+        timestamp=None,
+        latencies=[db_instance.inference_latency]
+    )
     session.commit()
-
-def read_inference_latency_benchmarks(session: Session, paginate=False, page=0, page_size=10) -> list[models.InferenceLatencyBenchmark]:
-    query = select(models.InferenceLatencyBenchmark)
+    histograms.get_histograms().record(fields["sensor_name"], fields["inference_layer"], [fields["inference_latency"]])
+
+def create_inference_latency_benchmarks(session: Session, benchmarks: list[tuple[str, str, dict]]) -> list[Optional[Exception]]:
+    """
+    Store many inference latency benchmarks, given as (gateway name, sensor
+    name, fields), with one insert per BULK_WRITE_CHUNK_SIZE benchmarks, and
+    commit. The benchmarks must be for the sensor they are stored under.
+
+    A benchmark whose fields carry a uuid is stored at most once: one stored
+    before, or earlier in the same call, is skipped, and its latency is not
+    counted again in the rollups and histograms.
+
+    Returns, for each benchmark, None if it was stored, or the exception
+    create_inference_latency_benchmark would have raised; those are skipped.
+    """
+    errors: list[Optional[Exception]] = [None] * len(benchmarks)
+    sensors = _read_sensors_by_name(session, {(gateway_name, device_name) for gateway_name, device_name, _ in benchmarks})
+
+    rows, keys = [], {}
+    for index, (gateway_name, device_name, fields) in enumerate(benchmarks):
+        if (gateway_name, device_name) not in sensors:
+            errors[index] = EdgeSensorNotFound()
+            continue
+        try:
+            _validate_inference_latency_benchmark(fields)
+            if fields.get("sensor_name") != device_name:
+                raise InvalidInferenceLatencyBenchmark(f"Inference latency benchmark is for sensor {fields.get('sensor_name')!r}, not {device_name!r}.")
+        except InvalidInferenceLatencyBenchmark as e:
+            errors[index] = e
+            continue
+        key = str(fields["uuid"]) if fields.get("uuid") is not None else str(uuid_lib.uuid4())
+        if key in keys:
+            errors[index] = InferenceLatencyBenchmarkAlreadyExists()
+            continue
+        keys[key] = index
+        rows.append({**fields, "uuid": key, "inference_layer": models.InferenceLayer(fields["inference_layer"])})
+
+    benchmark = models.InferenceLatencyBenchmark
+    stored = []
+    for chunk in _chunks(rows, BULK_WRITE_CHUNK_SIZE):
+        query = pg_insert(benchmark).values(chunk).on_conflict_do_nothing(
+            index_elements=[benchmark.uuid]
+        ).returning(benchmark.uuid, benchmark.sensor_name, benchmark.inference_layer, benchmark.inference_latency)
+        stored.extend(session.execute(query).all())
+
+    # Benchmarks that were not inserted already existed
+    inserted = {row.uuid for row in stored}
+    for key, index in keys.items():
+        if key not in inserted:
+            errors[index] = InferenceLatencyBenchmarkAlreadyExists()
+
+    latencies = defaultdict(list)
+    for row in stored:
+        latencies[(row.sensor_name, row.inference_layer)].append(row.inference_latency)
+    for (sensor_name, inference_layer), values in latencies.items():
+        rollups.record_latencies(session=session, sensor_name=sensor_name, inference_layer=inference_layer, timestamp=None, latencies=values)
+    session.commit()
+    for (sensor_name, inference_layer), values in latencies.items():
+        histograms.get_histograms().record(sensor_name, inference_layer, values)
+    return errors
+
+def read_inference_latency_benchmarks(session: Session, paginate=False, page=0, page_size=10) -> list[Row]:
+    """
+    Return inference latency benchmarks as Core rows, oldest first.
+    """
+    query = _inference_latency_benchmark_rows_query()
     if paginate:
         query = query.offset(page).limit(page_size)
     result = session.execute(query)
-    return result.scalars().all()
+    return result.all()
+
+def iter_inference_latency_benchmarks(session: Session, chunk_size: int = BULK_READ_CHUNK_SIZE) -> Iterator[Row]:
+    """
+    Stream every inference latency benchmark as a Core row, oldest first,
+    fetching chunk_size rows per round trip through a server-side cursor.
+    """
+    query = _inference_latency_benchmark_rows_query()
+    yield from session.execute(query.execution_options(yield_per=chunk_size))
+
+def _inference_latency_benchmark_rows_query():
+    benchmark = models.InferenceLatencyBenchmark
+    return select(
+        benchmark.uuid,
+        benchmark.sensor_name,
+        benchmark.inference_layer,
+        benchmark.send_timestamp,
+        benchmark.recv_timestamp,
+        benchmark.inference_latency,
+        benchmark.registered_at
+    ).order_by(benchmark.registered_at, benchmark.uuid)
 
 
 def delete_inference_latency_benchmarks(session: Session):
-    query = select(models.InferenceLatencyBenchmark)
-    result = session.execute(query)
-    benchmarks = result.scalars().all()
-    for benchmark in benchmarks:
-        session.delete(benchmark)
+    session.execute(delete(models.InferenceLatencyBenchmark).execution_options(synchronize_session=False))
 
     
+
+
+# --- Replay of sensor readings ---
+
+def read_replay_sensors(session: Session, gateway_name: Optional[str] = None, device_names: Optional[list[str]] = None) -> dict[str, str]:
+    """
+    Return {sensor uuid: sensor name} for the sensors selected for a replay:
+    the named ones, those of a gateway, or every sensor.
+    """
+    query = select(models.EdgeSensor.uuid, models.EdgeSensor.device_name)
+    if gateway_name is not None:
+        gateway = read_edge_gateway(session=session, device_name=gateway_name)
+        query = query.where(models.EdgeSensor.gateway_uuid == gateway.uuid)
+    if device_names:
+        query = query.where(models.EdgeSensor.device_name.in_(device_names))
+
+    sensors = dict(session.execute(query).all())
+    if device_names and len(sensors) < len(set(device_names)):
+        raise EdgeSensorNotFound
+    return sensors
+
+def iter_replay_readings(session: Session, sensor_uuids: list[str], start: Optional[datetime] = None, end: Optional[datetime] = None, after: Optional[tuple[datetime, str]] = None, chunk_size: int = BULK_READ_CHUNK_SIZE) -> Iterator[Row]:
+    """
+    Stream the readings of several sensors registered in [start, end) as Core
+    rows (uuid, sensor_uuid, registered_at, values, values_shape,
+    values_array), ordered by (registered_at, uuid).
+
+    after is the (registered_at, uuid) of the last reading already consumed,
+    so an interrupted replay resumes where it stopped. Archived readings are
+    not replayed.
+    """
+    if not sensor_uuids:
+        return
+
+    reading = models.SensorReading
+    query = select(
+        reading.uuid,
+        reading.sensor_uuid,
+        reading.registered_at,
+        reading.values,
+        reading.values_shape,
+        reading.values_array
+    ).where(
+        reading.sensor_uuid.in_(sensor_uuids)
+    ).order_by(reading.registered_at, reading.uuid)
+    if start is not None:
+        query = query.where(reading.registered_at >= start)
+    if end is not None:
+        query = query.where(reading.registered_at < end)
+    if after is not None:
+        query = query.where(tuple_(reading.registered_at, reading.uuid) > tuple_(*after))
+    yield from session.execute(query.execution_options(yield_per=chunk_size))
+
+def upsert_prediction_results(session: Session, inference_layer: models.InferenceLayer, predictions: dict[str, int]) -> tuple[int, int, list[str]]:
+    """
+    Insert or replace the prediction results of many sensor readings, with
+    one upsert per BULK_WRITE_CHUNK_SIZE readings, and commit.
+
+    predictions maps sensor reading uuids to predictions. Returns the number
+    of inserted and replaced prediction results, and the uuids of the
+    readings that do not exist (those are skipped).
+    """
+    reading = models.SensorReading
+    prediction = models.PredictionResult
+    inserted = replaced = 0
+    unknown, written = [], []
+
+    reading_uuids = sorted(predictions)
+    for offset in range(0, len(reading_uuids), BULK_WRITE_CHUNK_SIZE):
+        chunk = reading_uuids[offset:offset + BULK_WRITE_CHUNK_SIZE]
+
+        # Lock the readings (in a stable order) so no prediction is written for them in between
+        query = select(
+            reading.uuid,
+            reading.sensor_uuid,
+            prediction.inference_layer,
+            prediction.registered_at
+        ).outerjoin(
+            prediction, prediction.sensor_reading_uuid == reading.uuid
+        ).where(
+            reading.uuid.in_(chunk)
+        ).order_by(reading.uuid).with_for_update(of=reading)
+        existing = session.execute(query).all()
+
+        found = {row.uuid for row in existing}
+        unknown.extend(reading_uuid for reading_uuid in chunk if reading_uuid not in found)
+        if not existing:
+            continue
+
+        # The transaction's now(), which the rollups also bucket by
+        registered_at = session.execute(select(func.now())).scalar()
+        query = pg_insert(prediction).values([
+            {
+                "uuid": func.gen_random_uuid(),
+                "prediction": predictions[row.uuid],
+                "inference_layer": inference_layer,
+                "registered_at": registered_at,
+                "sensor_reading_uuid": row.uuid,
+            }
+            for row in existing
+        ])
+        query = query.on_conflict_do_update(
+            index_elements=[prediction.sensor_reading_uuid],
+            set_={
+                "prediction": query.excluded.prediction,
+                "inference_layer": query.excluded.inference_layer,
+                "registered_at": query.excluded.registered_at,
+            }
+        )
+        session.execute(query)
+
+        previous = [(row.sensor_uuid, row.inference_layer, row.registered_at) for row in existing if row.inference_layer is not None]
+        rollups.record_prediction_changes(
+            session=session,
+            added=[(row.sensor_uuid, inference_layer, registered_at) for row in existing],
+            replaced=previous
+        )
+        replaced += len(previous)
+        inserted += len(existing) - len(previous)
+        written.extend(row.uuid for row in existing)
+
+    session.commit()
+    buffer = latest.get_buffer()
+    for reading_uuid in written:
+        buffer.record_prediction(reading_uuid, PredictionResultRow(predictions[reading_uuid], models.InferenceLayer(inference_layer)))
+    return inserted, replaced, unknown
+
+
+# --- Read methods for rollups ---
+
+def read_sensor_activity_rollups(session: Session, gateway_name: str, device_name: str, granularity: models.RollupGranularity, start: Optional[datetime] = None, end: Optional[datetime] = None) -> list[models.SensorActivityRollup]:
+    # Check if the edge sensor exists and get the sensor
+    sensor = read_edge_sensor(session=session, gateway_name=gateway_name, device_name=device_name)
+
+    query = select(models.SensorActivityRollup).where(
+        models.SensorActivityRollup.sensor_uuid == sensor.uuid,
+        models.SensorActivityRollup.granularity == granularity
+    )
+    if start is not None:
+        query = query.where(models.SensorActivityRollup.bucket_start >= start)
+    if end is not None:
+        query = query.where(models.SensorActivityRollup.bucket_start < end)
+    query = query.order_by(models.SensorActivityRollup.bucket_start)
+    result = session.execute(query)
+    return result.scalars().all()
+
+def read_inference_latency_rollups(session: Session, granularity: models.RollupGranularity, sensor_name: Optional[str] = None, inference_layer: Optional[models.InferenceLayer] = None, start: Optional[datetime] = None, end: Optional[datetime] = None) -> list[models.InferenceLatencyRollup]:
+    query = select(models.InferenceLatencyRollup).where(
+        models.InferenceLatencyRollup.granularity == granularity
+    )
+    if sensor_name is not None:
+        query = query.where(models.InferenceLatencyRollup.sensor_name == sensor_name)
+    if inference_layer is not None:
+        query = query.where(models.InferenceLatencyRollup.inference_layer == inference_layer)
+    if start is not None:
+        query = query.where(models.InferenceLatencyRollup.bucket_start >= start)
+    if end is not None:
+        query = query.where(models.InferenceLatencyRollup.bucket_start < end)
+    query = query.order_by(
+        models.InferenceLatencyRollup.sensor_name,
+        models.InferenceLatencyRollup.inference_layer,
+        models.InferenceLatencyRollup.bucket_start
+    )
+    result = session.execute(query)
+    return result.scalars().all()
+
+def delete_rollups(session: Session):
+    session.execute(delete(models.SensorActivityRollup))
+    session.execute(delete(models.InferenceLatencyRollup))
+    session.commit()
+
+
+# --- CRUD methods for Job ---
+
+def create_job(session: Session, kind: str, params: dict) -> models.Job:
+    job = models.Job(kind=kind, params=params, status=models.JobStatus.QUEUED)
+    session.add(job)
+    session.commit()
+    return job
+
+def read_job(session: Session, job_id: int) -> models.Job:
+    job = session.get(models.Job, job_id)
+    if not job:
+        raise JobNotFound
+    return job
+
+def read_jobs(session: Session, status: Optional[models.JobStatus] = None, kind: Optional[str] = None, limit: int = 100) -> list[models.Job]:
+    query = select(models.Job)
+    if status is not None:
+        query = query.where(models.Job.status == status)
+    if kind is not None:
+        query = query.where(models.Job.kind == kind)
+    query = query.order_by(models.Job.id.desc()).limit(limit)
+    result = session.execute(query)
+    return result.scalars().all()
+
+def cancel_job(session: Session, job_id: int) -> models.Job:
+    """
+    Cancel a queued job right away, or ask a running one to stop at its next
+    progress report.
+    """
+    job = session.get(models.Job, job_id, with_for_update=True)
+    if not job:
+        raise JobNotFound
+    if job.status not in (models.JobStatus.QUEUED, models.JobStatus.RUNNING):
+        session.rollback()
+        raise JobAlreadyFinished
+
+    job.cancel_requested = True
+    if job.status == models.JobStatus.QUEUED:
+        job.status = models.JobStatus.CANCELLED
+        job.finished_at = func.now()
+    session.commit()
+    return job
+
+def claim_job(session: Session, worker_id: str, limits: dict[str, int]) -> Optional[models.Job]:
+    """
+    Mark the oldest queued job whose kind is below its concurrency limit
+    (counted across every worker) as running, and return it.
+    """
+    session.execute(select(func.pg_advisory_xact_lock(_JOB_CLAIM_LOCK_KEY)))
+    running = dict(session.execute(
+        select(models.Job.kind, func.count()).where(
+            models.Job.status == models.JobStatus.RUNNING
+        ).group_by(models.Job.kind)
+    ).all())
+    kinds = [kind for kind, limit in limits.items() if running.get(kind, 0) < limit]
+
+    job = None
+    if kinds:
+        query = select(models.Job).where(
+            models.Job.status == models.JobStatus.QUEUED,
+            models.Job.kind.in_(kinds)
+        ).order_by(models.Job.id).limit(1).with_for_update(skip_locked=True)
+        job = session.execute(query).scalars().first()
+    if job is None:
+        session.rollback()
+        return None
+
+    job.status = models.JobStatus.RUNNING
+    job.worker_id = worker_id
+    job.started_at = func.now()
+    job.heartbeat_at = func.now()
+    session.commit()
+    return job
+
+def update_job_progress(session: Session, job_id: int, progress: float, message: Optional[str] = None) -> bool:
+    """
+    Record the progress of a running job. Returns whether it was asked to stop.
+    """
+    query = update(models.Job).where(
+        models.Job.id == job_id
+    ).values(
+        progress=progress,
+        progress_message=message,
+        heartbeat_at=func.now()
+    ).returning(models.Job.cancel_requested)
+    cancel_requested = session.execute(query).scalar()
+    session.commit()
+    return bool(cancel_requested)
+
+def heartbeat_jobs(session: Session, job_ids: list[int]):
+    if not job_ids:
+        return
+    session.execute(update(models.Job).where(models.Job.id.in_(job_ids)).values(heartbeat_at=func.now()))
+    session.commit()
+
+def finish_job(session: Session, job_id: int, status: models.JobStatus, result: Optional[dict] = None, error: Optional[str] = None):
+    values = {"status": status, "result": result, "error": error, "finished_at": func.now()}
+    if status == models.JobStatus.SUCCEEDED:
+        values["progress"] = 1.0
+    if status == models.JobStatus.QUEUED:
+        # Put back in the queue, to be picked up again from the start
+        values.update(worker_id=None, started_at=None, heartbeat_at=None, finished_at=None, progress=0.0, progress_message=None)
+    session.execute(update(models.Job).where(models.Job.id == job_id).values(**values))
+    session.commit()
+
+def requeue_stale_jobs(session: Session, stale_before: datetime) -> int:
+    """
+    Put back in the queue the running jobs whose worker has not reported in
+    since stale_before, or cancel them if that had been asked for. Returns
+    the number of jobs requeued or cancelled.
+    """
+    stale = and_(models.Job.status == models.JobStatus.RUNNING, models.Job.heartbeat_at < stale_before)
+    cancelled = session.execute(
+        update(models.Job).where(stale, models.Job.cancel_requested.is_(True)).values(
+            status=models.JobStatus.CANCELLED, finished_at=func.now()
+        )
+    ).rowcount
+    requeued = session.execute(
+        update(models.Job).where(stale).values(
+            status=models.JobStatus.QUEUED, worker_id=None, started_at=None, heartbeat_at=None, progress=0.0, progress_message=None
+        )
+    ).rowcount
+    session.commit()
+    return cancelled + requeued
@@ -0,0 +1,30 @@
+"""
+CSV export of the inference latency benchmarks, shared by
+export_latency_data.py and the export background job.
+"""
+import csv
+from typing import Callable, Optional, TextIO
+
+from sqlalchemy.orm import Session
+
+from app.db import crud
+
+HEADER = ["sensor_name", "inference_layer", "inference_latency", "registered_at"]
+
+
+def write_inference_latency_benchmarks(session: Session, file: TextIO, progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Write every inference latency benchmark to file as CSV, streaming the rows
+    from the database. progress, if given, is called with the running count
+    every crud.BULK_READ_CHUNK_SIZE rows. Returns the number of rows written.
+    """
+    writer = csv.writer(file)
+    writer.writerow(HEADER)
+
+    written = 0
+    for bench in crud.iter_inference_latency_benchmarks(session=session):
+        writer.writerow([bench.sensor_name, bench.inference_layer, bench.inference_latency, bench.registered_at])
+        written += 1
+        if progress is not None and written % crud.BULK_READ_CHUNK_SIZE == 0:
+            progress(written)
+    return written
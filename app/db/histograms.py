@@ -0,0 +1,378 @@
+"""
+Streaming inference latency histograms.
+
+Every process keeps, per sensor name and inference layer, one histogram of
+inference latencies per UTC minute for the last
+LATENCY_HISTOGRAM_WINDOW_MINUTES minutes (default 60). crud records each
+committed benchmark, so percentiles over any window up to that length are
+computed in memory, without a query.
+
+Histograms are log-linear, as in HdrHistogram: values below 128 get a bucket
+each, larger values one of 64 buckets per power of two, so a percentile is
+reported within 1/64 (about 1.6%) of the exact value. Histograms merge by
+adding their counts, which makes merging the histograms of several processes
+exact.
+
+HistogramSync, started with the application, writes the minutes this process
+changed to inference_latency_histogram_table every LATENCY_HISTOGRAM_FLUSH_S
+seconds (each row holds one process's histogram of one minute, compressed),
+and loads the rows written by other processes, including earlier runs of
+this one, to merge them into the percentiles. Other processes' benchmarks
+thus show up to about two flush intervals late.
+"""
+import logging
+import math
+import os
+import socket
+import struct
+import threading
+import uuid
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.core.config import Settings, get_settings
+from app.db import SessionLocal
+from app.db import models
+
+logger = logging.getLogger(__name__)
+
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+
+PERCENTILES = {"p50": 50.0, "p90": 90.0, "p95": 95.0, "p99": 99.0, "p999": 99.9}
+
+# count, sum, min and max, ahead of the compressed (index delta, count) pairs
+_HEADER = struct.Struct("<QQQQ")
+
+# Rows are loaded again from a little before the last one seen, since a row
+# can be committed after rows with a later updated_at
+_LOAD_OVERLAP = timedelta(seconds=30)
+
+
+class LatencyWindowTooLong(Exception):
+    def __init__(self, message="Window is longer than the latency histograms keep."):
+        self.message = message
+        super().__init__(self.message)
+
+
+def _bucket_index(value: int) -> int:
+    if value < SUB_BUCKET_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return (shift << (SUB_BUCKET_BITS - 1)) + (value >> shift)
+
+def _highest_equivalent_value(index: int) -> int:
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift = (index >> (SUB_BUCKET_BITS - 1)) - 1
+    sub_bucket = index - (shift << (SUB_BUCKET_BITS - 1))
+    return ((sub_bucket + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of non-negative integer latencies.
+
+    Attributes:
+    counts: dict, number of values per bucket index, for the buckets that have any
+    count: int, number of values recorded
+    total: int, sum of the values recorded
+    min: int, smallest value recorded (0 when empty)
+    max: int, largest value recorded (0 when empty)
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        index = _bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.min = value if self.count == 0 else min(self.min, value)
+        self.max = max(self.max, value)
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: "LatencyHistogram"):
+        if other.count == 0:
+            return
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.min = other.min if self.count == 0 else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, percentile: float) -> int:
+        """
+        Return the value below which percentile percent of the values fall,
+        as the highest value of its bucket (capped by the largest value).
+        """
+        if self.count == 0:
+            return 0
+        rank = max(math.ceil(percentile / 100 * self.count), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(max(_highest_equivalent_value(index), self.min), self.max)
+        return self.max
+
+    def serialize(self) -> bytes:
+        indices = np.array(sorted(self.counts), dtype=np.int64)
+        counts = np.array([self.counts[index] for index in indices], dtype="<u8")
+        deltas = np.diff(indices, prepend=0).astype("<u4")
+        return _HEADER.pack(self.count, self.total, self.min, self.max) + zlib.compress(deltas.tobytes() + counts.tobytes())
+
+    @classmethod
+    def deserialize(cls, data: bytes) -> "LatencyHistogram":
+        histogram = cls()
+        histogram.count, histogram.total, histogram.min, histogram.max = _HEADER.unpack_from(data)
+        pairs = zlib.decompress(data[_HEADER.size:])
+        size = len(pairs) // 12
+        indices = np.cumsum(np.frombuffer(pairs, dtype="<u4", count=size), dtype=np.int64)
+        counts = np.frombuffer(pairs, dtype="<u8", offset=size * 4)
+        histogram.counts = dict(zip(indices.tolist(), counts.tolist()))
+        return histogram
+
+
+def _minute(timestamp: datetime) -> datetime:
+    return timestamp.astimezone(timezone.utc).replace(second=0, microsecond=0)
+
+
+class LatencyHistograms:
+    """
+    Per-minute latency histograms of every sensor and inference layer: those
+    recorded by this process and those loaded from other processes. Safe to
+    use from the event loop and from worker threads.
+    """
+
+    def __init__(self, window_minutes: int):
+        self.window_minutes = window_minutes
+        self._local: dict[tuple[str, models.InferenceLayer, datetime], LatencyHistogram] = {}
+        self._remote: dict[tuple[str, models.InferenceLayer, datetime], dict[str, LatencyHistogram]] = defaultdict(dict)
+        self._dirty: set[tuple[str, models.InferenceLayer, datetime]] = set()
+        self._lock = threading.Lock()
+
+    def record(self, sensor_name: str, inference_layer: models.InferenceLayer, latencies: Iterable[int], timestamp: Optional[datetime] = None):
+        """
+        Add committed latencies to the histogram of the current minute (or
+        of the minute of timestamp).
+        """
+        key = (sensor_name, models.InferenceLayer(inference_layer), _minute(timestamp or datetime.now(timezone.utc)))
+        with self._lock:
+            histogram = self._local.get(key)
+            if histogram is None:
+                histogram = self._local[key] = LatencyHistogram()
+            for latency in latencies:
+                histogram.record(latency)
+            self._dirty.add(key)
+
+    def summaries(self, window_minutes: int, sensor_name: Optional[str] = None, inference_layer: Optional[models.InferenceLayer] = None) -> list[dict]:
+        """
+        Return the latency count, min, max, average and percentiles of every
+        sensor and inference layer over the last window_minutes minutes (the
+        current one included), ordered by sensor name and inference layer.
+        """
+        if window_minutes > self.window_minutes:
+            raise LatencyWindowTooLong(f"Window is longer than the latency histograms keep ({self.window_minutes} minutes).")
+        start = _minute(datetime.now(timezone.utc)) - timedelta(minutes=window_minutes - 1)
+
+        merged: dict[tuple[str, models.InferenceLayer], LatencyHistogram] = defaultdict(LatencyHistogram)
+        with self._lock:
+            sources = [(key, [histogram]) for key, histogram in self._local.items()]
+            sources += [(key, list(histograms.values())) for key, histograms in self._remote.items()]
+            for (name, layer, minute), histograms in sources:
+                if minute < start or (sensor_name is not None and name != sensor_name) or (inference_layer is not None and layer != inference_layer):
+                    continue
+                for histogram in histograms:
+                    merged[(name, layer)].merge(histogram)
+
+        return [
+            {
+                "sensor_name": name,
+                "inference_layer": layer,
+                "window_minutes": window_minutes,
+                "latency_count": histogram.count,
+                "latency_min": histogram.min,
+                "latency_max": histogram.max,
+                "latency_avg": histogram.total / histogram.count,
+                **{label: histogram.percentile(percentile) for label, percentile in PERCENTILES.items()},
+            }
+            for (name, layer), histogram in sorted(merged.items(), key=lambda item: (item[0][0], item[0][1].value))
+        ]
+
+    def take_dirty(self) -> list[tuple[tuple[str, models.InferenceLayer, datetime], bytes, int]]:
+        """
+        Return the minutes recorded since the last call, each as (key,
+        serialized histogram, count), and mark them clean.
+        """
+        with self._lock:
+            dirty = [(key, self._local[key].serialize(), self._local[key].count) for key in self._dirty]
+            self._dirty.clear()
+        return dirty
+
+    def mark_dirty(self, keys: Iterable[tuple[str, models.InferenceLayer, datetime]]):
+        """
+        Mark minutes as changed again, after failing to persist them.
+        """
+        with self._lock:
+            self._dirty.update(key for key in keys if key in self._local)
+
+    def load_remote(self, rows: Iterable):
+        """
+        Set the histograms other processes persisted, replacing those loaded
+        before for the same process and minute.
+        """
+        with self._lock:
+            for row in rows:
+                key = (row.sensor_name, models.InferenceLayer(row.inference_layer), _minute(row.bucket_start))
+                self._remote[key][row.worker_id] = LatencyHistogram.deserialize(row.counts)
+
+    def prune(self):
+        """
+        Drop the minutes that fell out of the window, except those not
+        persisted yet.
+        """
+        start = _minute(datetime.now(timezone.utc)) - timedelta(minutes=self.window_minutes - 1)
+        with self._lock:
+            for key in [key for key in self._local if key[2] < start and key not in self._dirty]:
+                del self._local[key]
+            for key in [key for key in self._remote if key[2] < start]:
+                del self._remote[key]
+
+
+_histograms: Optional[LatencyHistograms] = None
+
+def get_histograms() -> LatencyHistograms:
+    """
+    Return the process-wide histograms, creating them from the settings on first use.
+    """
+    global _histograms
+    if _histograms is None:
+        _histograms = LatencyHistograms(get_settings().latency_histogram_window_minutes)
+    return _histograms
+
+
+# --- Persistence ---
+
+def save_histograms(session: Session, worker_id: str, histograms: list[tuple[tuple[str, models.InferenceLayer, datetime], bytes, int]]):
+    """
+    Insert or replace the rows of a process for the given minutes, and commit.
+    """
+    if not histograms:
+        return
+    table = models.InferenceLatencyHistogram
+    query = pg_insert(table).values([
+        {
+            "sensor_name": sensor_name,
+            "inference_layer": inference_layer,
+            "bucket_start": bucket_start,
+            "worker_id": worker_id,
+            "counts": counts,
+            "latency_count": count,
+        }
+        for (sensor_name, inference_layer, bucket_start), counts, count in histograms
+    ])
+    query = query.on_conflict_do_update(
+        index_elements=[table.sensor_name, table.inference_layer, table.bucket_start, table.worker_id],
+        set_={"counts": query.excluded.counts, "latency_count": query.excluded.latency_count, "updated_at": func.now()}
+    )
+    session.execute(query)
+    session.commit()
+
+def load_histograms(session: Session, worker_id: str, start: datetime, updated_after: Optional[datetime] = None) -> list:
+    """
+    Return the rows of every other process for the minutes from start,
+    only those updated after updated_after if given.
+    """
+    table = models.InferenceLatencyHistogram
+    query = select(
+        table.worker_id, table.sensor_name, table.inference_layer, table.bucket_start, table.counts, table.updated_at
+    ).where(table.bucket_start >= start, table.worker_id != worker_id)
+    if updated_after is not None:
+        query = query.where(table.updated_at > updated_after)
+    return session.execute(query).all()
+
+def delete_histograms(session: Session, before: datetime) -> int:
+    """
+    Delete the rows of the minutes before a cut-off, and commit.
+    """
+    table = models.InferenceLatencyHistogram
+    result = session.execute(delete(table).where(table.bucket_start < before))
+    session.commit()
+    return result.rowcount
+
+
+class HistogramSync:
+    """
+    Thread persisting the histograms of this process and loading those of
+    the other processes.
+    """
+
+    def __init__(self, settings: Settings, histograms: Optional[LatencyHistograms] = None):
+        self.settings = settings
+        self.histograms = histograms or get_histograms()
+        # A pid alone repeats across container restarts
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._updated_after: Optional[datetime] = None
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sync_loop, name="latency-histogram-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Stop syncing, persisting the minutes recorded since the last sync.
+        """
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        dirty = self.histograms.take_dirty()
+        try:
+            with SessionLocal() as session:
+                save_histograms(session=session, worker_id=self.worker_id, histograms=dirty)
+        except Exception:
+            self.histograms.mark_dirty(key for key, _, _ in dirty)
+            raise
+
+    def sync(self):
+        self.flush()
+        window_start = _minute(datetime.now(timezone.utc)) - timedelta(minutes=self.histograms.window_minutes - 1)
+        with SessionLocal() as session:
+            updated_after = self._updated_after - _LOAD_OVERLAP if self._updated_after else None
+            rows = load_histograms(session=session, worker_id=self.worker_id, start=window_start, updated_after=updated_after)
+            delete_histograms(session=session, before=models.tz_now() - timedelta(hours=self.settings.latency_histogram_retention_hours))
+        self.histograms.load_remote(rows)
+        if rows:
+            latest = max(row.updated_at for row in rows)
+            self._updated_after = max(self._updated_after, latest) if self._updated_after else latest
+        self.histograms.prune()
+
+    def _sync_loop(self):
+        while True:
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Failed to sync the latency histograms")
+            if self._stopping.wait(self.settings.latency_histogram_flush_s):
+                return
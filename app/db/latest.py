@@ -0,0 +1,218 @@
+"""
+In-process buffer of the latest readings of each sensor.
+
+Each sensor gets a bounded buffer (LATEST_BUFFER_READINGS readings, newest
+kept) keyed by gateway and sensor name, so that "latest N readings" needs
+neither a query nor a name lookup when the buffer can answer it. Buffers are
+fed by crud after every committed reading or prediction result, and filled
+from the database on a miss. The least recently used buffers are evicted
+once their estimated size passes LATEST_BUFFER_MAX_BYTES, and a single buffer
+past it drops its oldest readings.
+
+A buffer only sees the writes of its own process. With several workers or
+instances, a buffer is refilled from the database LATEST_BUFFER_TTL_S after
+it was filled (0 keeps it until it is evicted or invalidated, which is only
+correct with a single process writing readings). A prediction committed while
+its sensor's buffer is being filled may also only show once it is refilled.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app.core.config import get_settings
+
+# Rough per-reading overhead on top of the JSON text of its values
+_READING_OVERHEAD_BYTES = 400
+
+
+class _SensorBuffer:
+    """
+    Latest readings of one sensor, oldest first.
+
+    Attributes:
+    readings: list, SensorReadingRow records ordered by (registered_at, uuid)
+    complete: bool, whether the buffer holds the latest min(capacity, total) readings of the sensor,
+        rather than only those recorded since it was created
+    expires_at: Optional[float], monotonic time after which the buffer must be refilled
+    size: int, estimated memory used by the readings, in bytes
+    """
+
+    def __init__(self, complete: bool, expires_at: Optional[float]):
+        self.readings: list = []
+        self.complete = complete
+        self.expires_at = expires_at
+        self.size = 0
+
+
+class LatestReadingsBuffer:
+    """
+    Per-sensor buffers of the latest readings with a global LRU size cap.
+    Safe to use from the event loop and from job worker threads.
+    """
+
+    def __init__(self, capacity: int, max_bytes: int, ttl_s: float):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.size = 0
+        self._sensors: OrderedDict[tuple[str, str], _SensorBuffer] = OrderedDict()
+        self._locations: dict[str, tuple[str, str]] = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def get(self, gateway_name: str, device_name: str, limit: int) -> Optional[list]:
+        """
+        Return the latest limit readings of a sensor, newest first, or None if
+        the buffer cannot tell them.
+        """
+        with self._lock:
+            key = (gateway_name, device_name)
+            buffer = self._sensors.get(key)
+            if buffer is None or limit > self.capacity:
+                return None
+            if buffer.expires_at is not None and buffer.expires_at <= time.monotonic():
+                self._drop(key)
+                return None
+            if limit > len(buffer.readings) and not buffer.complete:
+                return None
+            self._sensors.move_to_end(key)
+            return buffer.readings[::-1][:limit]
+
+    def generation(self) -> int:
+        """
+        Return a token to pass to fill(), taken before querying the database.
+        """
+        with self._lock:
+            return self._generation
+
+    def fill(self, gateway_name: str, device_name: str, readings: list, generation: int):
+        """
+        Replace the buffer of a sensor with its latest readings loaded from the
+        database (newest first, at least capacity of them unless the sensor has
+        fewer). Readings recorded meanwhile are kept; the fill is dropped if
+        anything was invalidated since generation was taken.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            key = (gateway_name, device_name)
+            previous = self._drop(key)
+            buffer = _SensorBuffer(complete=True, expires_at=self._expires_at())
+            self._sensors[key] = buffer
+            # Recorded readings go first: the query may predate their latest prediction
+            for reading in previous.readings if previous else []:
+                self._insert(key, buffer, reading)
+            for reading in reversed(readings[:self.capacity]):
+                self._insert(key, buffer, reading)
+            self._evict()
+
+    def record_reading(self, gateway_name: str, device_name: str, reading):
+        """
+        Add a committed reading to the buffer of its sensor.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            key = (gateway_name, device_name)
+            buffer = self._sensors.get(key)
+            if buffer is None:
+                # Readings from before this one are older, so the buffer can
+                # answer for as many readings as it has seen
+                buffer = _SensorBuffer(complete=False, expires_at=self._expires_at())
+                self._sensors[key] = buffer
+            self._sensors.move_to_end(key)
+            self._insert(key, buffer, reading)
+            self._evict()
+
+    def record_prediction(self, reading_uuid: str, prediction_result: Any):
+        """
+        Attach a committed prediction result to a buffered reading, if the
+        reading is buffered.
+        """
+        with self._lock:
+            key = self._locations.get(reading_uuid)
+            if key is None:
+                return
+            buffer = self._sensors[key]
+            for index, reading in enumerate(buffer.readings):
+                if reading.uuid == reading_uuid:
+                    buffer.readings[index] = reading._replace(prediction_result=prediction_result)
+                    break
+
+    def invalidate(self, gateway_name: Optional[str] = None, device_name: Optional[str] = None):
+        """
+        Forget the buffer of a sensor, of every sensor of a gateway, or of
+        every sensor.
+        """
+        with self._lock:
+            self._generation += 1
+            for key in list(self._sensors):
+                if gateway_name is not None and key[0] != gateway_name:
+                    continue
+                if device_name is not None and key[1] != device_name:
+                    continue
+                self._drop(key)
+
+    def _expires_at(self) -> Optional[float]:
+        return time.monotonic() + self.ttl_s if self.ttl_s > 0 else None
+
+    def _insert(self, key: tuple[str, str], buffer: _SensorBuffer, reading):
+        if reading.uuid in self._locations:
+            return
+        position = bisect.bisect(buffer.readings, (reading.registered_at, reading.uuid), key=lambda item: (item.registered_at, item.uuid))
+        buffer.readings.insert(position, reading)
+        self._locations[reading.uuid] = key
+        self._resize(buffer, _reading_size(reading))
+        if len(buffer.readings) > self.capacity:
+            self._drop_oldest(buffer)
+            buffer.complete = True
+        # Evicting other sensors cannot make room for a buffer bigger than the cap
+        while buffer.size > self.max_bytes:
+            self._drop_oldest(buffer)
+            buffer.complete = False
+
+    def _drop_oldest(self, buffer: _SensorBuffer):
+        dropped = buffer.readings.pop(0)
+        del self._locations[dropped.uuid]
+        self._resize(buffer, -_reading_size(dropped))
+
+    def _resize(self, buffer: _SensorBuffer, delta: int):
+        buffer.size += delta
+        self.size += delta
+
+    def _drop(self, key: tuple[str, str]) -> Optional[_SensorBuffer]:
+        buffer = self._sensors.pop(key, None)
+        if buffer is not None:
+            for reading in buffer.readings:
+                del self._locations[reading.uuid]
+            self.size -= buffer.size
+        return buffer
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._sensors) > 1:
+            self._drop(next(iter(self._sensors)))
+
+
+def _reading_size(reading) -> int:
+    return len(reading.values) + len(reading.values_array or b"") + _READING_OVERHEAD_BYTES
+
+
+_buffer: Optional[LatestReadingsBuffer] = None
+
+def get_buffer() -> LatestReadingsBuffer:
+    """
+    Return the process-wide buffer, creating it from the settings on first use.
+    """
+    global _buffer
+    if _buffer is None:
+        settings = get_settings()
+        _buffer = LatestReadingsBuffer(settings.latest_buffer_readings, settings.latest_buffer_max_bytes, settings.latest_buffer_ttl_s)
+    return _buffer
@@ -0,0 +1,168 @@
+"""
+Non-destructive schema management.
+
+upgrade() creates any missing table and then applies, in order, every
+migration that has not been recorded in schema_migration_table yet. A fresh
+database gets the current schema from the models directly, so its migrations
+are only recorded, never executed. Migration statements must therefore be
+safe to run against tables that create_all() may have just created.
+"""
+from dataclasses import dataclass
+
+from sqlalchemy import Column, Integer, MetaData, Table, Text, DateTime, func, insert, inspect, select, text
+from sqlalchemy.engine import Engine
+
+from app.db import Base
+from app.db import models
+
+# Arbitrary constant used as the advisory lock key while upgrading, so that
+# several workers starting at once do not race each other.
+_UPGRADE_LOCK_KEY = 7_361_204
+
+_metadata = MetaData()
+
+schema_migration_table = Table(
+    "schema_migration_table",
+    _metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", Text, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False, server_default=func.now()),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    A schema change for databases created by an older version of the service.
+
+    Attributes:
+    version: int, unique and increasing migration number
+    description: str, short human readable summary
+    statements: tuple[str, ...], SQL statements executed in order
+    """
+
+    version: int
+    description: str
+    statements: tuple
+
+
+# Timestamp columns moved from naive timestamp to timestamptz by migration 4,
+# as (table, column, has a now() default)
+_TIMESTAMP_COLUMNS = (
+    ("edge_gateway_table", "registered_at", True),
+    ("edge_sensor_table", "registered_at", True),
+    ("sensor_config_table", "registered_at", True),
+    ("sensor_reading_table", "registered_at", True),
+    ("prediction_result_table", "registered_at", True),
+    ("inference_latency_benchmark_table", "registered_at", True),
+    ("sensor_state_change_table", "changed_at", True),
+    ("sensor_activity_rollup_table", "bucket_start", False),
+    ("inference_latency_rollup_table", "bucket_start", False),
+    ("job_table", "created_at", True),
+    ("job_table", "started_at", False),
+    ("job_table", "heartbeat_at", False),
+    ("job_table", "finished_at", False),
+)
+
+def _timestamptz_statements(columns: tuple = _TIMESTAMP_COLUMNS) -> tuple:
+    # Naive values were converted to the session time zone when they were
+    # written, so they are read back in it. The conversion is an identity for
+    # columns create_all() has just created as timestamptz.
+    statements = []
+    for table, column, has_default in columns:
+        statements.append(
+            f"ALTER TABLE {table} ALTER COLUMN {column} TYPE TIMESTAMP WITH TIME ZONE "
+            f"USING {column} AT TIME ZONE current_setting('TimeZone')"
+        )
+        if has_default:
+            statements.append(f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT now()")
+    return tuple(statements)
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(
+        version=1,
+        description="Index sensor readings by sensor and time",
+        statements=(
+            "CREATE INDEX IF NOT EXISTS ix_sensor_reading_sensor_uuid_registered_at "
+            "ON sensor_reading_table (sensor_uuid, registered_at)",
+        ),
+    ),
+    Migration(
+        version=2,
+        description="Store decoded reading values and expected sensor reading shapes",
+        statements=(
+            "ALTER TABLE edge_sensor_table ADD COLUMN IF NOT EXISTS values_shape INTEGER[]",
+            "ALTER TABLE sensor_reading_table ADD COLUMN IF NOT EXISTS values_shape INTEGER[]",
+            "ALTER TABLE sensor_reading_table ADD COLUMN IF NOT EXISTS values_array BYTEA",
+        ),
+    ),
+    Migration(
+        version=3,
+        description="Allow at most one prediction result per sensor reading",
+        statements=(
+            # Keep only the latest prediction of readings that somehow got several
+            "DELETE FROM prediction_result_table p USING prediction_result_table q "
+            "WHERE p.sensor_reading_uuid = q.sensor_reading_uuid "
+            "AND (p.registered_at, p.uuid) < (q.registered_at, q.uuid)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_prediction_result_sensor_reading_uuid "
+            "ON prediction_result_table (sensor_reading_uuid)",
+        ),
+    ),
+    Migration(
+        version=4,
+        description="Store timestamps as timestamptz generated by the database",
+        statements=_timestamptz_statements(),
+    ),
+    Migration(
+        version=5,
+        description="Index inference latency benchmarks in read order",
+        statements=(
+            "CREATE INDEX IF NOT EXISTS ix_inference_latency_benchmark_registered_at_uuid "
+            "ON inference_latency_benchmark_table (registered_at, uuid)",
+        ),
+    ),
+    Migration(
+        version=6,
+        description="Store migration timestamps as timestamptz",
+        statements=_timestamptz_statements((("schema_migration_table", "applied_at", True),)),
+    ),
+]
+
+
+def pending_migrations(engine: Engine) -> list[Migration]:
+    """
+    Return the migrations that have not been applied yet.
+    """
+    with engine.connect() as connection:
+        if not inspect(connection).has_table(schema_migration_table.name):
+            return list(MIGRATIONS)
+        applied = set(connection.execute(select(schema_migration_table.c.version)).scalars())
+    return [migration for migration in MIGRATIONS if migration.version not in applied]
+
+def upgrade(engine: Engine) -> list[Migration]:
+    """
+    Create missing tables and apply pending migrations in a single transaction.
+
+    Returns the migrations recorded by this call.
+    """
+    recorded = []
+    with engine.begin() as connection:
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _UPGRADE_LOCK_KEY})
+
+        fresh = not inspect(connection).has_table(models.EdgeGateway.__tablename__)
+        _metadata.create_all(bind=connection, checkfirst=True)
+        Base.metadata.create_all(bind=connection, checkfirst=True)
+
+        applied = set(connection.execute(select(schema_migration_table.c.version)).scalars())
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if migration.version in applied:
+                continue
+            if not fresh:
+                for statement in migration.statements:
+                    connection.execute(text(statement))
+            connection.execute(
+                insert(schema_migration_table).values(version=migration.version, description=migration.description)
+            )
+            recorded.append(migration)
+    return recorded
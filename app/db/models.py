@@ -1,21 +1,21 @@
 import uuid
 import enum
-import pytz
 from app.db import Base
 
 
-from sqlalchemy import Boolean, ForeignKey, Column, BigInteger
-from sqlalchemy.orm import relationship
-from sqlalchemy.types import String, DateTime, Text, Float, Enum, Integer
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Boolean, ForeignKey, Column, BigInteger, Index, func
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.types import String, DateTime, Text, Float, Enum, Integer, LargeBinary
+from sqlalchemy.dialects.postgresql import UUID, ARRAY, JSONB
 
-from datetime import datetime
-from app.core.config import TIMEZONE
+from datetime import datetime, timezone
 
 
+# Timestamps are stored as timestamptz and generated by the database
+# (server_default=now(), read back through RETURNING). tz_now() is only for
+# cut-offs computed in Python; conversion to TIMEZONE happens at the API edge.
 def tz_now():
-    tz = pytz.timezone(TIMEZONE)
-    return datetime.now(tz)
+    return datetime.now(timezone.utc)
 
 class SensorState(str, enum.Enum):
     INITIAL = "initial"
@@ -30,6 +30,17 @@ class InferenceLayer(int, enum.Enum):
     GATEWAY = 1
     SENSOR = 0
 
+class RollupGranularity(str, enum.Enum):
+    HOUR = "hour"
+    DAY = "day"
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
     
 class EdgeGateway(Base):
     """
@@ -41,19 +52,19 @@ class EdgeGateway(Base):
     device_name: String, name of the edge gateway
     device_address: String, address of the edge gateway
     url: Text, URL of the edge gateway
-    registered_at: DateTime, timestamp when the edge gateway was registered in the database.
+    registered_at: DateTime(timezone=True), timestamp when the edge gateway was registered in the database.
     edge_sensors: relationship to the EdgeSensor
     """
 
     __tablename__ = "edge_gateway_table"
+    __mapper_args__ = {"eager_defaults": True}
 
     uuid = Column(UUID(as_uuid=False), primary_key=True, default=uuid.uuid4)
     jwt_token = Column(String(1000), unique=True, nullable=True)
     device_name = Column(String(50), unique=True)
     device_address = Column(String(17), unique=True)
     url = Column(Text, nullable=False, unique=True)
-    registered_at = Column(DateTime, default=tz_now)    
-    
+    registered_at = Column(DateTime(timezone=True), server_default=func.now())
     edge_sensors = relationship("EdgeSensor", backref="edge_gateway")
 
 
@@ -66,19 +77,21 @@ class EdgeSensor(Base):
     device_name: String, name of the edge sensor
     device_address: String, address of the edge sensor
     working_state: Boolean, working state of the edge sensor
-    registered_at: DateTime, timestamp when the edge sensor was registered in the database.
+    values_shape: ARRAY(Integer), expected shape of the reading values, -1 matching any size, or null to accept any shape
+    registered_at: DateTime(timezone=True), timestamp when the edge sensor was registered in the database.
     gateway_uuid: UUID, foreign key to the edge_gateway_table.
     sensor_readings: relationship to the SensorReading
     """
 
     __tablename__ = "edge_sensor_table"
+    __mapper_args__ = {"eager_defaults": True}
 
     uuid = Column(UUID(as_uuid=False), primary_key=True, default=uuid.uuid4)
     device_name = Column(String(50), nullable=False, unique=True)
     device_address = Column(String(50), nullable=False, unique=True)
     state = Column(Enum(SensorState), nullable=False, default=SensorState.INITIAL)
-    registered_at = Column(DateTime, default=tz_now)
-
+    values_shape = Column(ARRAY(Integer), nullable=True)
+    registered_at = Column(DateTime(timezone=True), server_default=func.now())
     gateway_uuid = Column(UUID(as_uuid=False), ForeignKey("edge_gateway_table.uuid"))
     sensor_readings = relationship("SensorReading", backref="edge_sensor")
     sensor_config = relationship("SensorConfig", uselist=False, backref="edge_sensor")
@@ -99,11 +112,11 @@ class SensorConfig(Base):
     """
 
     __tablename__ = "sensor_config_table"
+    __mapper_args__ = {"eager_defaults": True}
 
     uuid = Column(UUID(as_uuid=False), primary_key=True, default=uuid.uuid4)
     sleep_interval_ms = Column(Integer, nullable=False)
-    registered_at = Column(DateTime, default=tz_now) 
-
+    registered_at = Column(DateTime(timezone=True), server_default=func.now())
     edge_sensor_uuid = Column(UUID(as_uuid=False), ForeignKey("edge_sensor_table.uuid"), unique=True)
     edge_sensor = relationship("EdgeSensor", back_populates="sensor_config")
 
@@ -117,17 +130,24 @@ class SensorReading(Base):
     Attributes:
     uuid: UUID, primary key
     values: Text, sensor reading values
-    registered_at: DateTime, timestamp when the sensor reading was stored in the database.
+    values_shape: ARRAY(Integer), shape of the decoded reading values
+    values_array: LargeBinary, decoded reading values as little-endian float64 bytes (deferred)
+    registered_at: DateTime(timezone=True), timestamp when the sensor reading was stored in the database.
     sensor_uuid: UUID, foreign key to the edge_sensor_table.
     prediction_result: relationship to the PredictionResult
     """
 
     __tablename__ = "sensor_reading_table"
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ix_sensor_reading_sensor_uuid_registered_at", "sensor_uuid", "registered_at"),
+    )
 
     uuid = Column(UUID(as_uuid=False), primary_key=True, default=uuid.uuid4)
     values = Column(Text, nullable=False)
-    registered_at = Column(DateTime, default=tz_now)
-
+    values_shape = Column(ARRAY(Integer), nullable=True)
+    values_array = deferred(Column(LargeBinary, nullable=True))
+    registered_at = Column(DateTime(timezone=True), server_default=func.now())
     sensor_uuid = Column(UUID(as_uuid=False), ForeignKey("edge_sensor_table.uuid"))
     prediction_result = relationship("PredictionResult", uselist=False, back_populates="sensor_reading")
 
@@ -140,17 +160,20 @@ class PredictionResult(Base):
     uuid: UUID, primary key
     prediction: Integer, prediction result
     inference_layer: Enum(InferenceLayer), prediction layer of the prediction result: "sensor", "edge" or "cloud"
-    sensor_reading_uuid: UUID, foreign key to the sensor_reading_table.
+    sensor_reading_uuid: UUID, foreign key to the sensor_reading_table, unique: a reading has at most one prediction result.
     sensor_reading: relationship to the SensorReading table.
     """
 
     __tablename__ = "prediction_result_table"
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ux_prediction_result_sensor_reading_uuid", "sensor_reading_uuid", unique=True),
+    )
 
     uuid = Column(UUID(as_uuid=False), primary_key=True, default=uuid.uuid4)
     prediction = Column(Integer, nullable=False)
     inference_layer = Column(Enum(InferenceLayer), nullable=False)
-    registered_at = Column(DateTime, default=tz_now) 
-
+    registered_at = Column(DateTime(timezone=True), server_default=func.now())
     sensor_reading_uuid = Column(UUID(as_uuid=False), ForeignKey("sensor_reading_table.uuid"))
     sensor_reading = relationship("SensorReading", back_populates="prediction_result")
 
@@ -168,6 +191,10 @@ class InferenceLatencyBenchmark(Base):
     """
 
     __tablename__ = "inference_latency_benchmark_table"
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ix_inference_latency_benchmark_registered_at_uuid", "registered_at", "uuid"),
+    )
 
     uuid = Column(UUID(as_uuid=False), primary_key=True, default=uuid.uuid4)
     sensor_name = Column(String(50), nullable=False)
@@ -175,4 +202,151 @@ class InferenceLatencyBenchmark(Base):
     send_timestamp = Column(BigInteger, nullable=False)
     recv_timestamp = Column(BigInteger, nullable=False)
     inference_latency = Column(BigInteger, nullable=False)
-    registered_at = Column(DateTime, default=tz_now) 
+    registered_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SensorStateChange(Base):
+    """
+    Sensor state change table, an append-only log of sensor state transitions
+
+    Attributes:
+    id: BigInteger, primary key, increasing with every change
+    sensor_uuid: UUID, foreign key to the edge_sensor_table.
+    from_state: Enum(SensorState), state before the transition
+    to_state: Enum(SensorState), state after the transition
+    changed_at: DateTime(timezone=True), timestamp when the transition was applied.
+    """
+
+    __tablename__ = "sensor_state_change_table"
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ix_sensor_state_change_sensor_uuid_id", "sensor_uuid", "id"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    sensor_uuid = Column(UUID(as_uuid=False), ForeignKey("edge_sensor_table.uuid", ondelete="CASCADE"), nullable=False)
+    from_state = Column(Enum(SensorState), nullable=False)
+    to_state = Column(Enum(SensorState), nullable=False)
+    changed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SensorActivityRollup(Base):
+    """
+    Sensor activity rollup table, maintained incrementally on ingest
+
+    Attributes:
+    sensor_uuid: UUID, foreign key to the edge_sensor_table, part of the primary key.
+    granularity: Enum(RollupGranularity), bucket width, part of the primary key.
+    bucket_start: DateTime(timezone=True), start of the bucket (buckets are aligned to UTC), part of the primary key.
+    reading_count: BigInteger, number of sensor readings registered in the bucket
+    sensor_prediction_count: BigInteger, number of predictions made at the sensor layer
+    gateway_prediction_count: BigInteger, number of predictions made at the gateway layer
+    cloud_prediction_count: BigInteger, number of predictions made at the cloud layer
+    """
+
+    __tablename__ = "sensor_activity_rollup_table"
+
+    sensor_uuid = Column(UUID(as_uuid=False), ForeignKey("edge_sensor_table.uuid", ondelete="CASCADE"), primary_key=True)
+    granularity = Column(Enum(RollupGranularity), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    reading_count = Column(BigInteger, nullable=False, default=0)
+    sensor_prediction_count = Column(BigInteger, nullable=False, default=0)
+    gateway_prediction_count = Column(BigInteger, nullable=False, default=0)
+    cloud_prediction_count = Column(BigInteger, nullable=False, default=0)
+
+class InferenceLatencyRollup(Base):
+    """
+    Inference latency rollup table, maintained incrementally on ingest
+
+    Attributes:
+    sensor_name: String, name of the sensor the benchmarks belong to, part of the primary key.
+    inference_layer: Enum(InferenceLayer), layer that made the predictions, part of the primary key.
+    granularity: Enum(RollupGranularity), bucket width, part of the primary key.
+    bucket_start: DateTime(timezone=True), start of the bucket (buckets are aligned to UTC), part of the primary key.
+    latency_count: BigInteger, number of benchmarks in the bucket
+    latency_sum: BigInteger, sum of the inference latencies in the bucket
+    latency_min: BigInteger, smallest inference latency in the bucket
+    latency_max: BigInteger, largest inference latency in the bucket
+    """
+
+    __tablename__ = "inference_latency_rollup_table"
+
+    sensor_name = Column(String(50), primary_key=True)
+    inference_layer = Column(Enum(InferenceLayer), primary_key=True)
+    granularity = Column(Enum(RollupGranularity), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    latency_count = Column(BigInteger, nullable=False)
+    latency_sum = Column(BigInteger, nullable=False)
+    latency_min = Column(BigInteger, nullable=False)
+    latency_max = Column(BigInteger, nullable=False)
+
+class InferenceLatencyHistogram(Base):
+    """
+    Inference latency histogram table, one minute of latencies as recorded by one process (see app.db.histograms)
+
+    Attributes:
+    sensor_name: String, name of the sensor the benchmarks belong to, part of the primary key.
+    inference_layer: Enum(InferenceLayer), layer that made the predictions, part of the primary key.
+    bucket_start: DateTime(timezone=True), start of the minute (aligned to UTC), part of the primary key.
+    worker_id: String, process that recorded the benchmarks, part of the primary key.
+    counts: LargeBinary, serialized histogram of the latencies
+    latency_count: BigInteger, number of benchmarks in the histogram
+    updated_at: DateTime(timezone=True), last time the process wrote the row.
+    """
+
+    __tablename__ = "inference_latency_histogram_table"
+    __table_args__ = (
+        Index("ix_inference_latency_histogram_bucket_start", "bucket_start"),
+        Index("ix_inference_latency_histogram_updated_at", "updated_at"),
+    )
+
+    sensor_name = Column(String(50), primary_key=True)
+    inference_layer = Column(Enum(InferenceLayer), primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    worker_id = Column(String(100), primary_key=True)
+    counts = Column(LargeBinary, nullable=False)
+    latency_count = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class Job(Base):
+    """
+    Background job table, the queue the job workers claim work from
+
+    Attributes:
+    id: BigInteger, primary key, increasing with every submitted job
+    kind: String, job kind, one of the kinds registered in app.core.jobs
+    params: JSONB, parameters of the job
+    status: Enum(JobStatus), "queued", "running", "succeeded", "failed" or "cancelled"
+    progress: Float, fraction of the work done, between 0 and 1
+    progress_message: Text, short description of the current step
+    result: JSONB, outcome of a succeeded job
+    error: Text, error message of a failed job
+    cancel_requested: Boolean, set to ask a running job to stop
+    worker_id: String, worker running (or that ran) the job
+    created_at: DateTime(timezone=True), timestamp when the job was submitted.
+    started_at: DateTime(timezone=True), timestamp when a worker claimed the job.
+    heartbeat_at: DateTime(timezone=True), last time the worker running the job reported being alive.
+    finished_at: DateTime(timezone=True), timestamp when the job succeeded, failed or was cancelled.
+    """
+
+    __tablename__ = "job_table"
+    __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index("ix_job_status_id", "status", "id"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    kind = Column(String(50), nullable=False)
+    params = Column(JSONB, nullable=False, default=dict)
+    status = Column(Enum(JobStatus), nullable=False, default=JobStatus.QUEUED)
+    progress = Column(Float, nullable=False, default=0.0)
+    progress_message = Column(Text, nullable=True)
+    result = Column(JSONB, nullable=True)
+    error = Column(Text, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    worker_id = Column(String(100), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
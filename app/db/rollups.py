@@ -0,0 +1,243 @@
+"""
+Hourly and daily rollups of sensor activity and inference latency.
+
+The record_* functions add a single event to the matching hour and day
+buckets with one upsert each; they are called by crud inside the same
+transaction as the insert they account for, so the rollups never drift from
+the raw tables. rebuild_rollups() recomputes the buckets from the raw tables,
+for backfilling existing data or repairing the rollups after a manual purge.
+
+Buckets are aligned to UTC hours and days. By default events are bucketed at
+the transaction's now(), which is also what the rows they account for get as
+their server-generated timestamp.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import DateTime, Integer, cast, column, delete, func, literal, select, union_all, values
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.db import models
+
+GRANULARITIES = (models.RollupGranularity.HOUR, models.RollupGranularity.DAY)
+
+PREDICTION_COUNT_COLUMNS = {
+    models.InferenceLayer.SENSOR: "sensor_prediction_count",
+    models.InferenceLayer.GATEWAY: "gateway_prediction_count",
+    models.InferenceLayer.CLOUD: "cloud_prediction_count",
+}
+
+
+def _truncate(granularity: models.RollupGranularity, timestamp):
+    # Truncated in UTC, whatever the session time zone
+    return func.date_trunc(granularity.value, timestamp, "UTC")
+
+def _bucket_start(granularity: models.RollupGranularity, timestamp: Optional[datetime] = None):
+    if timestamp is None:
+        return _truncate(granularity, func.now())
+    return _truncate(granularity, literal(timestamp, DateTime(timezone=True)))
+
+def _increment_activity(session: Session, sensor_uuid: str, timestamp: Optional[datetime], counters: dict):
+    rollup = models.SensorActivityRollup
+    rows = [
+        {
+            "sensor_uuid": sensor_uuid,
+            "granularity": granularity,
+            "bucket_start": _bucket_start(granularity, timestamp),
+            "reading_count": 0,
+            "sensor_prediction_count": 0,
+            "gateway_prediction_count": 0,
+            "cloud_prediction_count": 0,
+            **counters,
+        }
+        for granularity in GRANULARITIES
+    ]
+    query = pg_insert(rollup).values(rows)
+    query = query.on_conflict_do_update(
+        index_elements=[rollup.sensor_uuid, rollup.granularity, rollup.bucket_start],
+        set_={name: getattr(rollup, name) + query.excluded[name] for name in counters}
+    )
+    session.execute(query)
+
+def record_readings(session: Session, sensor_uuid: str, timestamp: Optional[datetime] = None, count: int = 1):
+    """
+    Account for count readings of a sensor registered at timestamp (by default, now()).
+    """
+    _increment_activity(session, sensor_uuid, timestamp, {"reading_count": count})
+
+def record_predictions(session: Session, sensor_uuid: str, inference_layer: models.InferenceLayer, timestamp: Optional[datetime] = None, count: int = 1):
+    """
+    Account for count predictions made at inference_layer for a sensor at timestamp (by default, now()).
+    """
+    _increment_activity(session, sensor_uuid, timestamp, {PREDICTION_COUNT_COLUMNS[inference_layer]: count})
+
+def record_prediction_changes(session: Session, added: list[tuple], replaced: list[tuple] = ()):
+    """
+    Account for a batch of predictions with a single upsert. Both lists hold
+    (sensor_uuid, inference_layer, timestamp) tuples: added predictions are
+    counted in their buckets, and the predictions they replaced are taken
+    out of theirs.
+    """
+    rows = [(sensor_uuid, layer.name, timestamp, 1) for sensor_uuid, layer, timestamp in added if sensor_uuid is not None]
+    rows += [(sensor_uuid, layer.name, timestamp, -1) for sensor_uuid, layer, timestamp in replaced if sensor_uuid is not None]
+    if not rows:
+        return
+
+    activity = models.SensorActivityRollup
+    events = values(
+        column("sensor_uuid", UUID(as_uuid=False)),
+        column("inference_layer"),
+        column("registered_at", DateTime(timezone=True)),
+        column("delta", Integer),
+        name="events"
+    ).data(rows)
+
+    counts = []
+    for granularity in GRANULARITIES:
+        bucket = _truncate(granularity, cast(events.c.registered_at, DateTime(timezone=True)))
+        counts.append(select(
+            events.c.sensor_uuid,
+            # Typed explicitly, as UNION ALL would otherwise resolve the literal to text
+            cast(literal(granularity, activity.granularity.type), activity.granularity.type),
+            bucket,
+            literal(0),
+            *[
+                func.coalesce(func.sum(events.c.delta).filter(events.c.inference_layer == layer.name), 0)
+                for layer in PREDICTION_COUNT_COLUMNS
+            ]
+        ).group_by(events.c.sensor_uuid, bucket))
+
+    query = pg_insert(activity).from_select(
+        ["sensor_uuid", "granularity", "bucket_start", "reading_count", *PREDICTION_COUNT_COLUMNS.values()],
+        union_all(*counts)
+    )
+    query = query.on_conflict_do_update(
+        index_elements=[activity.sensor_uuid, activity.granularity, activity.bucket_start],
+        set_={name: getattr(activity, name) + query.excluded[name] for name in PREDICTION_COUNT_COLUMNS.values()}
+    )
+    session.execute(query)
+
+def record_latencies(session: Session, sensor_name: str, inference_layer: models.InferenceLayer, timestamp: Optional[datetime], latencies: list[int]):
+    """
+    Account for the inference latencies of a sensor measured at timestamp (None for now()).
+    """
+    if not latencies:
+        return
+
+    rollup = models.InferenceLatencyRollup
+    rows = [
+        {
+            "sensor_name": sensor_name,
+            "inference_layer": inference_layer,
+            "granularity": granularity,
+            "bucket_start": _bucket_start(granularity, timestamp),
+            "latency_count": len(latencies),
+            "latency_sum": sum(latencies),
+            "latency_min": min(latencies),
+            "latency_max": max(latencies),
+        }
+        for granularity in GRANULARITIES
+    ]
+    query = pg_insert(rollup).values(rows)
+    query = query.on_conflict_do_update(
+        index_elements=[rollup.sensor_name, rollup.inference_layer, rollup.granularity, rollup.bucket_start],
+        set_={
+            "latency_count": rollup.latency_count + query.excluded.latency_count,
+            "latency_sum": rollup.latency_sum + query.excluded.latency_sum,
+            "latency_min": func.least(rollup.latency_min, query.excluded.latency_min),
+            "latency_max": func.greatest(rollup.latency_max, query.excluded.latency_max),
+        }
+    )
+    session.execute(query)
+
+
+def rebuild_rollups(session: Session, start: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Recompute every rollup bucket starting at the day of start (or all of
+    them, if start is None) from the raw tables, and commit.
+
+    Rows that have already been archived out of the raw tables are no longer
+    counted, so only rebuild the range that is still in the hot tables.
+    Returns the start of the first rebuilt day, or None for a full rebuild.
+    """
+    if start is not None:
+        # Naive values are taken as UTC, like the buckets
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        start = start.astimezone(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    activity = models.SensorActivityRollup
+    latency = models.InferenceLatencyRollup
+    reading = models.SensorReading
+    prediction = models.PredictionResult
+    benchmark = models.InferenceLatencyBenchmark
+
+    for rollup in (activity, latency):
+        query = delete(rollup)
+        if start is not None:
+            query = query.where(rollup.bucket_start >= start)
+        session.execute(query)
+
+    for granularity in GRANULARITIES:
+        # Readings are bucketed by reading time, predictions by prediction time
+        readings = select(
+            reading.sensor_uuid.label("sensor_uuid"),
+            _truncate(granularity, reading.registered_at).label("bucket_start"),
+            literal(None, prediction.inference_layer.type).label("inference_layer")
+        ).where(reading.sensor_uuid.is_not(None))
+        predictions = select(
+            reading.sensor_uuid.label("sensor_uuid"),
+            _truncate(granularity, prediction.registered_at).label("bucket_start"),
+            prediction.inference_layer.label("inference_layer")
+        ).join(reading, prediction.sensor_reading_uuid == reading.uuid).where(reading.sensor_uuid.is_not(None))
+        if start is not None:
+            readings = readings.where(reading.registered_at >= start)
+            predictions = predictions.where(prediction.registered_at >= start)
+        events = union_all(readings, predictions).subquery("events")
+
+        counts = select(
+            events.c.sensor_uuid,
+            literal(granularity, activity.granularity.type),
+            events.c.bucket_start,
+            func.count().filter(events.c.inference_layer.is_(None)),
+            *[
+                func.count().filter(events.c.inference_layer == layer)
+                for layer in PREDICTION_COUNT_COLUMNS
+            ]
+        ).group_by(events.c.sensor_uuid, events.c.bucket_start)
+        # Ingest keeps upserting while this runs, so a bucket deleted above
+        # may exist again; the recomputed counts replace it
+        query = pg_insert(activity).from_select(
+            ["sensor_uuid", "granularity", "bucket_start", "reading_count", *PREDICTION_COUNT_COLUMNS.values()],
+            counts
+        )
+        session.execute(query.on_conflict_do_update(
+            index_elements=[activity.sensor_uuid, activity.granularity, activity.bucket_start],
+            set_={name: query.excluded[name] for name in ("reading_count", *PREDICTION_COUNT_COLUMNS.values())}
+        ))
+
+        bucket = _truncate(granularity, benchmark.registered_at)
+        latencies = select(
+            benchmark.sensor_name,
+            benchmark.inference_layer,
+            literal(granularity, latency.granularity.type),
+            bucket,
+            func.count(),
+            func.sum(benchmark.inference_latency),
+            func.min(benchmark.inference_latency),
+            func.max(benchmark.inference_latency)
+        ).group_by(benchmark.sensor_name, benchmark.inference_layer, bucket)
+        if start is not None:
+            latencies = latencies.where(benchmark.registered_at >= start)
+        query = pg_insert(latency).from_select(
+            ["sensor_name", "inference_layer", "granularity", "bucket_start", "latency_count", "latency_sum", "latency_min", "latency_max"],
+            latencies
+        )
+        session.execute(query.on_conflict_do_update(
+            index_elements=[latency.sensor_name, latency.inference_layer, latency.granularity, latency.bucket_start],
+            set_={name: query.excluded[name] for name in ("latency_count", "latency_sum", "latency_min", "latency_max")}
+        ))
+
+    session.commit()
+    return start
@@ -1,20 +1,75 @@
 import uvicorn
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 
+from app.api.admission import AdmissionController, size_threadpool
 from app.api.routes import router
-from app.core.config import SECRET_KEY, ORIGINS
+from app.core.config import Settings, get_settings
+from app.core.jobs import JobRunner
+from app.core.logs import RequestLoggingMiddleware, configure_logging, install_slow_query_log, stop_logging
+from app.core.profiling import ProfilingMiddleware
+from app.db import init_engine, dispose_engine
+from app.db import migrations
+from app.db.histograms import HistogramSync
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Set up logging, create the database engine and start the job workers and
+    the latency histogram sync on startup; stop and release them on shutdown.
+    """
+    settings: Settings = app.state.settings
+    configure_logging(settings)
+    install_slow_query_log(settings.slow_query_ms)
+    size_threadpool(app.state.admission)
+    engine = init_engine(settings.database_url, settings.database_replica_url)
+    if settings.database_auto_migrate:
+        migrations.upgrade(engine)
+
+    job_runner = None
+    if settings.job_workers > 0:
+        job_runner = JobRunner(settings)
+        job_runner.start()
+    histogram_sync = None
+    if settings.latency_histogram_flush_s > 0:
+        histogram_sync = HistogramSync(settings)
+        histogram_sync.start()
+    yield
+    if job_runner is not None:
+        job_runner.stop()
+    if histogram_sync is not None:
+        histogram_sync.stop()
+    dispose_engine()
+    stop_logging()
+
+def create_app(settings: Settings = None) -> FastAPI:
+    """
+    Build the FastAPI application.
+    """
+    settings = settings or get_settings()
+    if settings.gateway_auth_enabled and not settings.secret_key:
+        raise RuntimeError("GATEWAY_AUTH_ENABLED requires SECRET_KEY to be set")
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    app.state.admission = AdmissionController(settings)
+    app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    if settings.profiling_enabled:
+        app.add_middleware(ProfilingMiddleware, settings=settings)
+    app.add_middleware(RequestLoggingMiddleware)
+    app.include_router(router, prefix="/api/v1")
+    return app
 
 # --- Init FastAPI app ---
-app = FastAPI()
-app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-app.include_router(router, prefix="/api/v1")
+app = create_app()
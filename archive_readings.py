@@ -0,0 +1,33 @@
+"""
+This utility module moves old entries of the following tables:
+- sensor_reading_table (with prediction_result_table)
+- inference_latency_benchmark_table
+to compressed Parquet files under ARCHIVE_DIR, and deletes them from the
+database in chunks. Rows older than ARCHIVE_AFTER_DAYS are archived, unless
+--older-than-days is given.
+"""
+import argparse
+from datetime import timedelta
+
+from app.db import SessionLocal, init_engine
+from app.db import archive, models
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old readings, predictions and benchmarks to Parquet files.")
+    parser.add_argument("--older-than-days", type=int, default=None, help="archive rows older than this many days (default: ARCHIVE_AFTER_DAYS)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="rows written and deleted per chunk (default: ARCHIVE_CHUNK_SIZE)")
+    args = parser.parse_args()
+
+    before = None
+    if args.older_than_days is not None:
+        before = models.tz_now() - timedelta(days=args.older_than_days)
+
+    init_engine()
+    session = SessionLocal()
+    archived = archive.archive(session=session, before=before, chunk_size=args.chunk_size)
+    for table, count in archived.items():
+        print(f"Archived {count} rows from {table}")
+    session.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+This utility module stores the decoded values (values_array and values_shape)
+of the sensor_reading_table rows written before those columns existed. Use it
+once after upgrading an existing database, so reads and replays stop parsing
+the JSON text of older readings. Readings whose values cannot be decoded are
+reported and left as they are.
+"""
+import argparse
+
+from app.db import SessionLocal, init_engine
+from app.db import crud
+
+def main():
+    parser = argparse.ArgumentParser(description="Store the decoded values of readings written before they were stored.")
+    parser.add_argument("--chunk-size", type=int, default=crud.BULK_WRITE_CHUNK_SIZE, help="readings updated per transaction")
+    args = parser.parse_args()
+
+    init_engine()
+    session = SessionLocal()
+    backfilled, skipped = crud.backfill_sensor_reading_arrays(session=session, chunk_size=args.chunk_size)
+    print(f"Backfilled {backfilled} readings, skipped {skipped} readings whose values cannot be decoded")
+    session.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+This utility module benchmarks the bulk read paths of sensor readings:
+- orm: full ORM objects (select(SensorReading) with their prediction results)
+- rows: SensorReadingRow records built from Core rows (crud.read_sensor_readings)
+- stream: the same records streamed with yield_per (crud.iter_sensor_readings)
+
+It seeds a throwaway gateway and sensor with --rows readings (half of them
+with a prediction result), reads them back with each path, and prints the
+wall time and peak Python memory, scaled to one million rows. The seeded
+data is removed afterwards. Do not run it against a production database.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+import uuid
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import selectinload
+
+from app.db import SessionLocal, init_engine
+from app.db import crud, models
+
+BENCH_NAME = "bench-bulk-reads"
+SEED_CHUNK_SIZE = 10000
+
+
+def seed(session, rows: int):
+    gateway_uuid = str(uuid.uuid4())
+    sensor_uuid = str(uuid.uuid4())
+    session.execute(insert(models.EdgeGateway).values(
+        uuid=gateway_uuid, device_name=BENCH_NAME, device_address="00:00:00:00:00:00", url=f"http://{BENCH_NAME}"
+    ))
+    session.execute(insert(models.EdgeSensor).values(
+        uuid=sensor_uuid, device_name=BENCH_NAME, device_address=BENCH_NAME, gateway_uuid=gateway_uuid
+    ))
+
+    values = "[[" + ", ".join(["0.5"] * 32) + "]]"
+    for offset in range(0, rows, SEED_CHUNK_SIZE):
+        readings, predictions = [], []
+        for i in range(offset, min(offset + SEED_CHUNK_SIZE, rows)):
+            reading_uuid = str(uuid.uuid4())
+            readings.append({"uuid": reading_uuid, "values": values, "values_shape": [1, 32], "sensor_uuid": sensor_uuid})
+            if i % 2 == 0:
+                predictions.append({"uuid": str(uuid.uuid4()), "prediction": i % 3, "inference_layer": models.InferenceLayer.CLOUD, "sensor_reading_uuid": reading_uuid})
+        session.execute(insert(models.SensorReading), readings)
+        session.execute(insert(models.PredictionResult), predictions)
+    session.commit()
+    return gateway_uuid, sensor_uuid
+
+def cleanup(session, gateway_uuid: str, sensor_uuid: str):
+    readings = select(models.SensorReading.uuid).where(models.SensorReading.sensor_uuid == sensor_uuid)
+    session.execute(delete(models.PredictionResult).where(models.PredictionResult.sensor_reading_uuid.in_(readings)))
+    session.execute(delete(models.SensorReading).where(models.SensorReading.sensor_uuid == sensor_uuid))
+    session.execute(delete(models.EdgeSensor).where(models.EdgeSensor.uuid == sensor_uuid))
+    session.execute(delete(models.EdgeGateway).where(models.EdgeGateway.uuid == gateway_uuid))
+    session.commit()
+
+
+def read_orm(session, sensor_uuid: str) -> int:
+    query = select(models.SensorReading).options(
+        selectinload(models.SensorReading.prediction_result)
+    ).where(models.SensorReading.sensor_uuid == sensor_uuid).order_by(models.SensorReading.registered_at)
+    return len(session.execute(query).scalars().all())
+
+def read_rows(session, sensor_uuid: str) -> int:
+    return len(crud.read_sensor_readings(session=session, gateway_name=BENCH_NAME, device_name=BENCH_NAME))
+
+def read_stream(session, sensor_uuid: str) -> int:
+    count = 0
+    for _ in crud.iter_sensor_readings(session=session, sensor_uuid=sensor_uuid):
+        count += 1
+    return count
+
+PATHS = {"orm": read_orm, "rows": read_rows, "stream": read_stream}
+
+
+def measure(path, sensor_uuid: str, trace_memory: bool):
+    # Fresh session per run so no identity map carries over between paths
+    with SessionLocal() as session:
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        count = path(session, sensor_uuid)
+        elapsed = time.perf_counter() - started
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return count, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ORM and row-based bulk read paths.")
+    parser.add_argument("--rows", type=int, default=200000, help="readings to seed (default: 200000)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per path, the best is reported (default: 3)")
+    args = parser.parse_args()
+
+    init_engine()
+    with SessionLocal() as session:
+        gateway_uuid, sensor_uuid = seed(session, args.rows)
+    try:
+        scale = 1_000_000 / args.rows
+        print(f"{'path':<8} {'rows':>10} {'s / 1M rows':>12} {'peak MiB / 1M rows':>20}")
+        for name, path in PATHS.items():
+            # Time without tracemalloc, which slows allocation-heavy code down
+            timings = [measure(path, sensor_uuid, trace_memory=False) for _ in range(args.repeat)]
+            count = timings[0][0]
+            elapsed = min(timing[1] for timing in timings)
+            peak = measure(path, sensor_uuid, trace_memory=True)[2]
+            print(f"{name:<8} {count:>10} {elapsed * scale:>12.2f} {peak * scale / 2**20:>20.1f}")
+    finally:
+        with SessionLocal() as session:
+            cleanup(session, gateway_uuid, sensor_uuid)
+
+if __name__ == "__main__":
+    main()
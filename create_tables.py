@@ -1,15 +1,32 @@
-from app.db import Base, engine, SessionLocal
-from app.db.crud import read_edge_gateways
+"""
+This utility module creates the database schema without touching existing
+data: missing tables are created and pending migrations are applied.
+
+Pass --drop to wipe every table first (destroys all data).
+"""
+import argparse
+
+from app.db import Base, init_engine
+from app.db import migrations
 
 def main():
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+    parser = argparse.ArgumentParser(description="Create missing tables and apply pending migrations.")
+    parser.add_argument("--drop", action="store_true", help="drop every table before recreating it (destroys all data)")
+    args = parser.parse_args()
+
+    engine = init_engine()
 
-    session = SessionLocal()
+    if args.drop:
+        Base.metadata.drop_all(bind=engine)
+        migrations.schema_migration_table.drop(bind=engine, checkfirst=True)
 
-    print(read_edge_gateways(session=session))
+    applied = migrations.upgrade(engine)
+    for migration in applied:
+        print(f"Applied migration {migration.version}: {migration.description}")
+    if not applied:
+        print("Schema is up to date.")
 
-    session.close()
+    engine.dispose()
 
 
 if __name__ == "__main__":
@@ -3,12 +3,14 @@ This utility module cleans all reading-related entries on the following tables:
 - inference_latency_benchmark_table
 - prediction_result_table
 - sensor_reading_table
-in this order, as the tables are related by foreign keys.
+in this order, as the tables are related by foreign keys, and then empties the
+rollup tables derived from them.
 """
-from app.db import SessionLocal
-from app.db.crud import read_edge_gateways, read_edge_sensors, delete_inference_latency_benchmarks, delete_prediction_results, delete_sensor_readings
+from app.db import SessionLocal, init_engine
+from app.db.crud import read_edge_gateways, read_edge_sensors, delete_inference_latency_benchmarks, delete_prediction_results, delete_sensor_readings, delete_rollups
 
 def main():
+    init_engine()
     session = SessionLocal()
     delete_inference_latency_benchmarks(session=session)
 
@@ -20,6 +22,7 @@ def main():
             delete_prediction_results(session=session, gateway_name=edge_gateway.device_name, device_name=edge_sensor.device_name)
             delete_sensor_readings(session=session, gateway_name=edge_gateway.device_name, device_name=edge_sensor.device_name)
 
+    delete_rollups(session=session)
     session.close()
     
 if __name__ == "__main__":
@@ -2,25 +2,21 @@
 This utility module exports all inference latency benchmark data to a CSV file
 which follows the following format:
 
-| gateway_name | sensor_name | inference_layer | inference_latency | registered_at |
+| sensor_name | inference_layer | inference_latency | registered_at |
 
+The same export can run in the service as an "export" background job.
 """
 
-import csv
-from app.db import SessionLocal
-from app.db.crud import read_inference_latency_benchmarks
-from app.db.models import InferenceLatencyBenchmark
+from app.db import ReadSessionLocal, init_engine
+from app.db.export import write_inference_latency_benchmarks
 
 def main():
-    session = SessionLocal()
+    init_engine()
+    session = ReadSessionLocal()
 
     with open(f"inference_latency_benchmarks.csv", mode="w") as file:
-        writer = csv.writer(file)
-        writer.writerow(["sensor_name", "inference_layer", "inference_latency", "registered_at"])
-
-        benchs: list[InferenceLatencyBenchmark] = read_inference_latency_benchmarks(session=session)
-        for bench in benchs:
-            writer.writerow([bench.sensor_name, bench.inference_layer, bench.inference_latency, bench.registered_at])
+        # Rows are streamed from a server-side cursor, so memory stays flat
+        write_inference_latency_benchmarks(session=session, file=file)
     session.close()
 
 if __name__ == "__main__":
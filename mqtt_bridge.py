@@ -0,0 +1,45 @@
+"""
+This utility module runs the MQTT ingest bridge: it subscribes to the gateway
+topics on the broker at MQTT_HOST and stores the readings, prediction results
+and latency benchmarks published there in batches (see app/core/mqtt.py).
+The latency histograms of the benchmarks it stores are persisted for the API
+to merge (see app/db/histograms.py). It runs until interrupted with SIGINT or
+SIGTERM.
+"""
+import argparse
+import signal
+import threading
+
+from app.core.config import get_settings
+from app.core.logs import configure_logging, stop_logging
+from app.core.mqtt import MqttBridge
+from app.db import init_engine, dispose_engine
+from app.db.histograms import HistogramSync
+
+def main():
+    parser = argparse.ArgumentParser(description="Store readings, predictions and latency benchmarks published over MQTT.")
+    parser.parse_args()
+
+    settings = get_settings()
+    if not settings.mqtt_host:
+        parser.error("MQTT_HOST is not set")
+
+    configure_logging(settings)
+    init_engine()
+    bridge = MqttBridge(settings)
+    histogram_sync = HistogramSync(settings)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+
+    bridge.start()
+    histogram_sync.start()
+    stopping.wait()
+    bridge.stop()
+    histogram_sync.stop()
+    dispose_engine()
+    stop_logging()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""
+This utility module recomputes the hourly and daily rollup tables:
+- sensor_activity_rollup_table
+- inference_latency_rollup_table
+from the raw reading, prediction and benchmark tables. Use it to backfill the
+rollups of an existing database, or to repair them after a manual purge.
+
+Pass --since YYYY-MM-DD to only rebuild the days from that date on.
+"""
+import argparse
+from datetime import datetime
+
+from app.db import SessionLocal, init_engine
+from app.db.rollups import rebuild_rollups
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute the rollup tables from the raw tables.")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None, help="first day to rebuild (default: everything)")
+    args = parser.parse_args()
+
+    init_engine()
+    session = SessionLocal()
+    rebuild_rollups(session=session, start=args.since)
+    session.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.api import admission
+from app.core import auth
+from app.db import Base
+from app.db import latest, migrations
+
+from tests import plans, seed
+
+
+def pytest_addoption(parser):
+    parser.addoption("--update-plans", action="store_true", help="record the current query plans as the golden files")
+    parser.addoption("--reseed", action="store_true", help="drop every table of the test database and seed it again")
+
+
+@pytest.fixture
+def clock(monkeypatch) -> list:
+    """
+    Monotonic clock of the modules that expire entries by it, frozen at
+    clock[0] until a test moves it. Wall clock time is left alone.
+    """
+    now = [1000.0]
+    fake_time = SimpleNamespace(monotonic=lambda: now[0], time=time.time)
+    for module in (admission, auth, latest):
+        monkeypatch.setattr(module, "time", fake_time)
+    return now
+
+@pytest.fixture(scope="session")
+def engine(request):
+    """
+    Engine of the test database, seeded on first use. The database is named
+    by TEST_DATABASE_URL, never by the service settings, since the tests fill
+    it with seed data.
+    """
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(url)
+    if request.config.getoption("--reseed"):
+        Base.metadata.drop_all(bind=engine)
+        migrations.schema_migration_table.drop(bind=engine, checkfirst=True)
+    migrations.upgrade(engine)
+    with engine.connect() as connection:
+        if not seed.is_seeded(connection):
+            seed.seed(connection)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def connection(engine):
+    """
+    Connection holding a transaction that is rolled back after the test, so
+    no test changes the seed data.
+    """
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        yield connection
+        transaction.rollback()
+
+@pytest.fixture
+def session(connection):
+    # crud's commits only release savepoints of the outer transaction
+    with Session(bind=connection, join_transaction_mode="create_savepoint") as session:
+        yield session
+    latest.get_buffer().invalidate()
+    auth.get_token_cache().invalidate()
+
+@pytest.fixture
+def queries(connection) -> plans.QueryCapture:
+    return plans.QueryCapture(connection)
+
+@pytest.fixture
+def check_plans(request, queries):
+    """
+    Return a function asserting that the statements captured by queries are
+    as many as expected, scan none of the large tables sequentially (except
+    those allowed) and have the plans recorded in the test's golden file.
+    """
+    update = request.config.getoption("--update-plans")
+
+    def check(count: int, allow_seq_scan: frozenset = frozenset()):
+        statements = queries.explain()
+        rendered = plans.render(statements)
+        assert len(statements) == count, f"Expected {count} queries, got {len(statements)}:\n{rendered}"
+        scans = plans.sequential_scans(statements, seed.LARGE_TABLES - allow_seq_scan)
+        assert not scans, "Sequential scans of large tables:\n" + "\n".join(scans)
+        diff = plans.golden_diff(request.node.name, rendered, update)
+        assert diff is None, "Query plans changed:\n" + diff
+
+    return check
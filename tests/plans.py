@@ -0,0 +1,149 @@
+"""
+Capture the SQL a piece of code emits, with the plan of each statement.
+
+QueryCapture records every statement executed on a connection while it is
+active. explain() then runs EXPLAIN (FORMAT JSON) on each recorded statement
+with its parameters (EXPLAIN without ANALYZE does not execute it, so write
+statements are safe to explain) and renders the plans as indented trees of
+node type, relation and index, leaving out the costs and row estimates,
+which change with every seed. That rendering is what the golden files under
+tests/plans/ hold.
+"""
+import difflib
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection
+
+PLANS_DIR = Path(__file__).parent / "plans"
+
+# Statements that are not queries: transaction control issued by the session
+_SKIPPED = re.compile(r"^\s*(SAVEPOINT|RELEASE|ROLLBACK|BEGIN|COMMIT)\b", re.IGNORECASE)
+
+
+@dataclass
+class Statement:
+    """
+    An executed statement.
+
+    Attributes:
+    sql: str, the statement as sent to the driver
+    parameters: Any, its parameters (the first set, for an executemany)
+    plan: Optional[dict], the root node of its EXPLAIN output, once explained
+    """
+
+    sql: str
+    parameters: Any
+    plan: Optional[dict] = None
+
+    @property
+    def one_line(self) -> str:
+        return " ".join(self.sql.split())
+
+
+@dataclass
+class QueryCapture:
+    """
+    Records the statements executed on a connection between start() and stop().
+    """
+
+    connection: Connection
+    statements: list[Statement] = field(default_factory=list)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if _SKIPPED.match(statement):
+            return
+        if executemany and parameters:
+            parameters = parameters[0]
+        self.statements.append(Statement(statement, parameters))
+
+    def start(self):
+        self.statements.clear()
+        event.listen(self.connection, "before_cursor_execute", self._record)
+
+    def stop(self):
+        event.remove(self.connection, "before_cursor_execute", self._record)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def explain(self) -> list[Statement]:
+        """
+        Attach its plan to every recorded statement and return them.
+        """
+        cursor = self.connection.connection.cursor()
+        try:
+            for statement in self.statements:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + statement.sql, statement.parameters or None)
+                statement.plan = cursor.fetchone()[0][0]["Plan"]
+        finally:
+            cursor.close()
+        return self.statements
+
+
+def _nodes(plan: dict, depth: int = 0):
+    yield depth, plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child, depth + 1)
+
+def describe_node(node: dict) -> str:
+    parts = [node["Node Type"]]
+    if node.get("Join Type") and node["Node Type"] != "Hash":
+        parts.append(f"({node['Join Type']})")
+    if node.get("Relation Name"):
+        parts.append(f"on {node['Relation Name']}")
+    if node.get("Index Name"):
+        parts.append(f"using {node['Index Name']}")
+    if node.get("Parent Relationship") == "SubPlan" and node.get("Subplan Name"):
+        parts.append(f"[{node['Subplan Name']}]")
+    return " ".join(parts)
+
+def render(statements: list[Statement]) -> str:
+    """
+    Render statements and their plans as the text kept in the golden files.
+    """
+    lines = []
+    for number, statement in enumerate(statements, 1):
+        lines.append(f"[{number}] {statement.one_line}")
+        for depth, node in _nodes(statement.plan):
+            lines.append("    " + "  " * depth + describe_node(node))
+    return "\n".join(lines) + "\n"
+
+def sequential_scans(statements: list[Statement], tables: frozenset) -> list[str]:
+    """
+    Return "table in [n] sql" for every sequential scan of one of tables.
+    """
+    found = []
+    for number, statement in enumerate(statements, 1):
+        for _, node in _nodes(statement.plan):
+            if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in tables:
+                found.append(f"{node['Relation Name']} in [{number}] {statement.one_line}")
+    return found
+
+def golden_diff(name: str, actual: str, update: bool) -> Optional[str]:
+    """
+    Compare rendered plans with the golden file of a test. Returns a unified
+    diff (or a note, if there is no golden file) when they differ, or None.
+    With update, (re)writes the golden file instead.
+    """
+    path = PLANS_DIR / f"{name}.txt"
+    if update:
+        PLANS_DIR.mkdir(exist_ok=True)
+        path.write_text(actual)
+        return None
+    if not path.exists():
+        return f"No golden plans for {name}; record them with pytest --update-plans.\n\n{actual}"
+    expected = path.read_text()
+    if expected == actual:
+        return None
+    return "".join(difflib.unified_diff(
+        expected.splitlines(keepends=True), actual.splitlines(keepends=True),
+        fromfile=f"tests/plans/{name}.txt (expected)", tofile=f"{name} (actual)"
+    ))
@@ -0,0 +1,146 @@
+"""
+Seed data for the query plan tests.
+
+Fills an empty test database with a fleet of a realistic size, generated
+on the server with generate_series so that seeding takes seconds. Row
+counts scale with PLAN_TEST_SCALE (default 1):
+
+- 10 gateways with 20 sensors each, half of the sensors configured
+- 1000 readings per sensor over the last 20 days, every other one with a prediction result
+- 500 inference latency benchmarks per sensor
+- 20 state changes per sensor
+- 2000 jobs, nearly all finished
+- hourly and daily rollups rebuilt from the above
+
+Identifiers are derived from md5 hashes rather than drawn at random, so that
+every seeded database holds the same data and gets the same plans.
+"""
+import hashlib
+import os
+import re
+import uuid
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.core import payloads
+from app.db import rollups
+
+SCALE = float(os.environ.get("PLAN_TEST_SCALE", "1"))
+
+GATEWAYS = 10
+SENSORS_PER_GATEWAY = 20
+READINGS_PER_SENSOR = max(int(1000 * SCALE), 10)
+BENCHMARKS_PER_SENSOR = max(int(500 * SCALE), 10)
+STATE_CHANGES_PER_SENSOR = 20
+JOBS = max(int(2000 * SCALE), 10)
+
+GATEWAY_NAME = "plan-gw-000"
+SENSOR_NAME = "plan-gw-000-s00"
+VALUES = "[[0.5, 0.25, 0.125, 0.0625]]"
+VALUES_SHAPE = [1, 4]
+
+# Tables expected to hold many rows in production; a sequential scan of one
+# of these is a regression unless a test allows it
+LARGE_TABLES = frozenset({
+    "sensor_reading_table",
+    "prediction_result_table",
+    "inference_latency_benchmark_table",
+    "sensor_state_change_table",
+    "sensor_activity_rollup_table",
+    "inference_latency_rollup_table",
+    "job_table",
+})
+
+
+def reading_uuid(sensor_uuid: str, index: int) -> str:
+    """
+    Return the uuid of the index-th seeded reading of a sensor, as seed() makes it.
+    """
+    return str(uuid.UUID(hashlib.md5(f"{sensor_uuid}{index}".encode()).hexdigest()))
+
+def is_seeded(connection: Connection) -> bool:
+    return connection.execute(
+        text("SELECT 1 FROM edge_gateway_table WHERE device_name = :name"), {"name": GATEWAY_NAME}
+    ).first() is not None
+
+def seed(connection: Connection):
+    """
+    Insert the seed data and refresh the planner statistics.
+    """
+    params = {
+        "gateways": GATEWAYS,
+        "sensors": SENSORS_PER_GATEWAY,
+        "readings": READINGS_PER_SENSOR,
+        "benchmarks": BENCHMARKS_PER_SENSOR,
+        "state_changes": STATE_CHANGES_PER_SENSOR,
+        "jobs": JOBS,
+        "values": VALUES,
+        "values_shape": VALUES_SHAPE,
+        "values_array": payloads.encode_array(np.array([[0.5, 0.25, 0.125, 0.0625]])),
+    }
+    statements = [
+        """
+        INSERT INTO edge_gateway_table (uuid, device_name, device_address, url, jwt_token)
+        SELECT md5('gateway' || g)::uuid, 'plan-gw-' || lpad(g::text, 3, '0'), 'plan-' || lpad(g::text, 6, '0'),
+               'http://plan-gw-' || g, 'plan-token-' || g
+        FROM generate_series(0, :gateways - 1) g
+        """,
+        """
+        INSERT INTO edge_sensor_table (uuid, device_name, device_address, state, values_shape, gateway_uuid)
+        SELECT md5('sensor' || g || '-' || s)::uuid, 'plan-gw-' || lpad(g::text, 3, '0') || '-s' || lpad(s::text, 2, '0'),
+               'plan-addr-' || g || '-' || s, 'IDLE', :values_shape, md5('gateway' || g)::uuid
+        FROM generate_series(0, :gateways - 1) g, generate_series(0, :sensors - 1) s
+        """,
+        """
+        INSERT INTO sensor_config_table (uuid, sleep_interval_ms, edge_sensor_uuid)
+        SELECT md5('config' || uuid)::uuid, 1000, uuid
+        FROM edge_sensor_table WHERE get_byte(decode(md5(uuid::text), 'hex'), 0) % 2 = 0
+        """,
+        """
+        INSERT INTO sensor_reading_table (uuid, values, values_shape, values_array, registered_at, sensor_uuid)
+        SELECT md5(s.uuid::text || i)::uuid, :values, :values_shape, :values_array,
+               now() - (i + 1) * interval '20 days' / :readings, s.uuid
+        FROM edge_sensor_table s, generate_series(0, :readings - 1) i
+        """,
+        """
+        INSERT INTO prediction_result_table (uuid, prediction, inference_layer, registered_at, sensor_reading_uuid)
+        SELECT md5('prediction' || s.uuid::text || i)::uuid, i % 3, (ARRAY['SENSOR', 'GATEWAY', 'CLOUD'])[i % 3 + 1]::inferencelayer,
+               now() - (i + 1) * interval '20 days' / :readings + interval '1 second', md5(s.uuid::text || i)::uuid
+        FROM edge_sensor_table s, generate_series(0, :readings - 1, 2) i
+        """,
+        """
+        INSERT INTO inference_latency_benchmark_table (uuid, sensor_name, inference_layer, send_timestamp, recv_timestamp, inference_latency, registered_at)
+        SELECT md5('benchmark' || s.uuid::text || i)::uuid, s.device_name, (ARRAY['SENSOR', 'GATEWAY', 'CLOUD'])[i % 3 + 1]::inferencelayer,
+               i * 1000, i * 1000 + (i * 37) % 5000 + 10, (i * 37) % 5000 + 10,
+               now() - (i + 1) * interval '20 days' / :benchmarks
+        FROM edge_sensor_table s, generate_series(0, :benchmarks - 1) i
+        """,
+        """
+        INSERT INTO sensor_state_change_table (sensor_uuid, from_state, to_state, changed_at)
+        SELECT s.uuid, CASE WHEN i % 2 = 0 THEN 'IDLE' ELSE 'WORKING' END::sensorstate,
+               CASE WHEN i % 2 = 0 THEN 'WORKING' ELSE 'IDLE' END::sensorstate,
+               now() - (i + 1) * interval '1 hour'
+        FROM edge_sensor_table s, generate_series(0, :state_changes - 1) i
+        """,
+        """
+        INSERT INTO job_table (kind, params, status, progress, cancel_requested, worker_id, created_at, started_at, heartbeat_at, finished_at)
+        SELECT 'export', '{}', CASE WHEN j < 5 THEN 'QUEUED' WHEN j < 7 THEN 'RUNNING' ELSE 'SUCCEEDED' END::jobstatus,
+               CASE WHEN j < 7 THEN 0 ELSE 1 END, false, CASE WHEN j < 5 THEN NULL ELSE 'plan-worker' END,
+               now() - j * interval '1 minute', now() - j * interval '1 minute', now() - j * interval '1 minute',
+               CASE WHEN j < 7 THEN NULL ELSE now() - j * interval '1 minute' END
+        FROM generate_series(0, :jobs - 1) j
+        """,
+    ]
+    for statement in statements:
+        connection.execute(text(statement).bindparams(**{
+            name: value for name, value in params.items() if re.search(rf":{name}\b", statement)
+        }))
+
+    with Session(bind=connection) as session:
+        rollups.rebuild_rollups(session=session)
+    connection.commit()
+    connection.execute(text("ANALYZE"))
+    connection.commit()
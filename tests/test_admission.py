@@ -0,0 +1,91 @@
+import asyncio
+from dataclasses import replace
+
+import anyio.to_thread
+import pytest
+
+from app.api import admission
+from app.core.config import Settings
+
+
+def test_rate_limiter_allows_a_burst(clock):
+    limiter = admission.GatewayRateLimiter(rate=1.0, burst=3)
+    assert [limiter.acquire("gw") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("gw") == pytest.approx(1.0)
+
+def test_rate_limiter_refills_over_time(clock):
+    limiter = admission.GatewayRateLimiter(rate=2.0, burst=1)
+    assert limiter.acquire("gw") == 0.0
+    assert limiter.acquire("gw") == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert limiter.acquire("gw") == 0.0
+    # Idle time never fills the bucket past its burst
+    clock[0] += 60
+    assert limiter.acquire("gw") == 0.0
+    assert limiter.acquire("gw") > 0
+
+def test_rate_limiter_keeps_gateways_apart(clock):
+    limiter = admission.GatewayRateLimiter(rate=1.0, burst=1)
+    assert limiter.acquire("a") == 0.0
+    assert limiter.acquire("a") > 0
+    assert limiter.acquire("b") == 0.0
+
+def test_rate_limiter_evicts_least_recently_seen(clock):
+    limiter = admission.GatewayRateLimiter(rate=1.0, burst=1, max_gateways=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    limiter.acquire("c")
+    # "a" was evicted and starts again with a full bucket; "c" was not
+    assert limiter.acquire("a") == 0.0
+    assert limiter.acquire("c") > 0
+
+def test_controller_slots():
+    controller = admission.AdmissionController(replace(Settings(), max_concurrent_requests=1, admission_queue_timeout_ms=10.0))
+
+    async def run():
+        assert await controller.acquire_slot()
+        assert not await controller.acquire_slot()
+        controller.release_slot()
+        assert await controller.acquire_slot()
+        controller.release_slot()
+
+    asyncio.run(run())
+
+def test_controller_waits_for_a_slot():
+    controller = admission.AdmissionController(replace(Settings(), max_concurrent_requests=1, admission_queue_timeout_ms=1000.0))
+
+    async def run():
+        assert await controller.acquire_slot()
+        asyncio.get_running_loop().call_later(0.01, controller.release_slot)
+        assert await controller.acquire_slot()
+
+    asyncio.run(run())
+
+def test_controller_without_limits():
+    controller = admission.AdmissionController(replace(Settings(), gateway_rate_limit_per_s=0.0, max_concurrent_requests=0))
+    assert controller.rate_limiter is None
+    assert asyncio.run(controller.acquire_slot())
+
+def test_size_threadpool_covers_every_slot():
+    async def threads(limit: int) -> int:
+        admission.size_threadpool(admission.AdmissionController(replace(Settings(), max_concurrent_requests=limit)))
+        return anyio.to_thread.current_default_thread_limiter().total_tokens
+
+    # Each asyncio.run() starts with anyio's default of 40 threads
+    assert asyncio.run(threads(500)) == 500
+    assert asyncio.run(threads(1)) == 40
+
+def test_kept_slot_is_released_when_the_stream_ends():
+    controller = admission.AdmissionController(replace(Settings(), max_concurrent_requests=1, admission_queue_timeout_ms=0.0))
+
+    async def run():
+        assert await controller.acquire_slot()
+        slot = admission.AdmissionSlot(controller.release_slot)
+        async for _ in slot.stream(iter([b"a", b"b"])):
+            assert not await controller.acquire_slot()
+        # The background task releases it again, which must not free a second slot
+        slot.release()
+        assert await controller.acquire_slot()
+        assert not await controller.acquire_slot()
+
+    asyncio.run(run())
@@ -0,0 +1,95 @@
+import time
+
+import orjson
+import pytest
+
+from app.core import auth
+
+SECRET_KEY = "test-secret"
+GATEWAY = auth.AuthenticatedGateway(name="gw", uuid="00000000-0000-0000-0000-000000000001")
+
+
+def signed(claims: dict, header: dict = auth._HEADER, secret_key: str = SECRET_KEY) -> str:
+    signing_input = auth._b64encode(orjson.dumps(header)) + "." + auth._b64encode(orjson.dumps(claims))
+    return signing_input + "." + auth._signature(secret_key, signing_input)
+
+
+def test_issued_token_verifies():
+    claims = auth.verify_token(SECRET_KEY, auth.issue_token(SECRET_KEY, "gw"))
+    assert claims["sub"] == "gw"
+    assert auth.issue_token(SECRET_KEY, "gw") != auth.issue_token(SECRET_KEY, "gw")
+
+def test_unexpired_token_verifies():
+    assert auth.verify_token(SECRET_KEY, signed({"sub": "gw", "exp": time.time() + 60}))["sub"] == "gw"
+
+@pytest.mark.parametrize("token", [
+    auth.issue_token("another-secret", "gw"),
+    signed({"sub": "gw", "exp": time.time() - 1}),
+    signed({"sub": "gw", "exp": "never"}),
+    signed({"sub": "gw"}, header={"alg": "none", "typ": "JWT"}),
+    signed({"sub": 7}),
+    signed({"iat": 0}),
+    signed(["gw"]),
+    "not-a-token",
+    "a.b.c",
+    "",
+])
+def test_invalid_tokens_are_rejected(token):
+    with pytest.raises(auth.InvalidGatewayToken):
+        auth.verify_token(SECRET_KEY, token)
+
+def test_tampered_claims_are_rejected():
+    header, _, signature = auth.issue_token(SECRET_KEY, "gw").split(".")
+    claims = auth._b64encode(orjson.dumps({"sub": "other-gw"}))
+    with pytest.raises(auth.InvalidGatewayToken, match="signature"):
+        auth.verify_token(SECRET_KEY, f"{header}.{claims}.{signature}")
+
+
+def test_cache_hit_and_expiry(clock):
+    cache = auth.VerifiedTokenCache(max_size=10, ttl_s=60)
+    assert cache.get("token") is None
+    cache.put("token", GATEWAY, {"sub": "gw"}, cache.generation())
+    assert cache.get("token") == GATEWAY
+    clock[0] += 60
+    assert cache.get("token") is None
+
+def test_token_expiry_shortens_caching(clock):
+    cache = auth.VerifiedTokenCache(max_size=10, ttl_s=60)
+    cache.put("token", GATEWAY, {"sub": "gw", "exp": time.time() + 5}, cache.generation())
+    clock[0] += 4
+    assert cache.get("token") == GATEWAY
+    clock[0] += 2
+    assert cache.get("token") is None
+
+def test_put_after_invalidation_is_dropped():
+    cache = auth.VerifiedTokenCache(max_size=10, ttl_s=60)
+    generation = cache.generation()
+    cache.invalidate("gw")
+    cache.put("token", GATEWAY, {"sub": "gw"}, generation)
+    assert cache.get("token") is None
+
+def test_invalidate_a_gateway():
+    cache = auth.VerifiedTokenCache(max_size=10, ttl_s=60)
+    other = auth.AuthenticatedGateway(name="other", uuid="00000000-0000-0000-0000-000000000002")
+    cache.put("token", GATEWAY, {"sub": "gw"}, cache.generation())
+    cache.put("other-token", other, {"sub": "other"}, cache.generation())
+    cache.invalidate("gw")
+    assert cache.get("token") is None
+    assert cache.get("other-token") == other
+    cache.invalidate()
+    assert cache.get("other-token") is None
+
+def test_least_recently_used_tokens_are_evicted():
+    cache = auth.VerifiedTokenCache(max_size=2, ttl_s=60)
+    for token in ("a", "b"):
+        cache.put(token, GATEWAY, {"sub": "gw"}, cache.generation())
+    cache.get("a")
+    cache.put("c", GATEWAY, {"sub": "gw"}, cache.generation())
+    assert cache.get("b") is None
+    assert cache.get("a") == GATEWAY
+    assert cache.get("c") == GATEWAY
+
+def test_disabled_cache_stores_nothing():
+    cache = auth.VerifiedTokenCache(max_size=10, ttl_s=0)
+    cache.put("token", GATEWAY, {"sub": "gw"}, cache.generation())
+    assert cache.get("token") is None
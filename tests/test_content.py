@@ -0,0 +1,80 @@
+import contextvars
+
+import msgpack
+import numpy as np
+import pytest
+
+from app.api import content
+from app.core import payloads
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (None, content.JSON),
+    ("", content.JSON),
+    ("*/*", content.JSON),
+    ("text/html, application/xml", content.JSON),
+    ("application/msgpack", content.MSGPACK),
+    ("application/x-msgpack", content.MSGPACK),
+    ("Application/MsgPack; charset=binary", content.MSGPACK),
+    # Highest quality wins, wherever it is listed
+    ("application/json;q=0.5, application/msgpack", content.MSGPACK),
+    ("application/msgpack;q=0.4, application/json;q=0.9", content.JSON),
+    ("application/json; q=0.1, application/msgpack; q=0.2", content.MSGPACK),
+    # The first listed wins on ties
+    ("application/msgpack, application/json", content.MSGPACK),
+    ("application/json, application/msgpack", content.JSON),
+    # q=0 means "not acceptable", and so does an unreadable quality
+    ("application/msgpack;q=0", content.JSON),
+    ("application/msgpack;q=high", content.JSON),
+])
+def test_negotiate(accept, expected):
+    assert content.negotiate(accept) is expected
+
+def test_negotiate_cbor():
+    pytest.importorskip("cbor2")
+    assert content.negotiate("application/msgpack;q=0.5, application/cbor").media_type == "application/cbor"
+
+@pytest.mark.parametrize("content_type, expected", [
+    (None, content.JSON),
+    ("application/json", content.JSON),
+    ("application/msgpack", content.MSGPACK),
+    ("application/msgpack; charset=binary", content.MSGPACK),
+    ("text/plain", content.JSON),
+])
+def test_request_codec(content_type, expected):
+    assert content.request_codec(content_type) is expected
+
+def test_serialize_values_follows_the_response_codec():
+    def serialize(codec: content.Codec):
+        content.use_response_codec(codec)
+        return content.serialize_values("[[1, 2.5]]")
+
+    # Each run gets its own context, as each request does
+    assert contextvars.copy_context().run(serialize, content.JSON) == "[[1, 2.5]]"
+    assert contextvars.copy_context().run(serialize, content.MSGPACK) == [[1.0, 2.5]]
+
+@pytest.mark.parametrize("values, values_array, values_shape, expected", [
+    # The stored array is used rather than the text
+    ("[[0]]", payloads.encode_array(np.array([[1.0, 2.5]])), [1, 2], [[1.0, 2.5]]),
+    # Older rows without an array are decoded from the text
+    ("[[1, 2.5]]", None, None, [[1.0, 2.5]]),
+    # and sent as the text when that cannot be decoded
+    ("[[1], [2, 3]]", None, None, "[[1], [2, 3]]"),
+])
+def test_serialize_stored_values(values, values_array, values_shape, expected):
+    def serialize():
+        content.use_response_codec(content.MSGPACK)
+        return content.serialize_values(values, values_array, values_shape)
+
+    assert contextvars.copy_context().run(serialize) == expected
+
+def test_negotiated_response_encodes_with_the_codec():
+    def render(codec: content.Codec) -> content.NegotiatedResponse:
+        content.use_response_codec(codec)
+        return content.NegotiatedResponse({"values": [[1.0, 2.5]]})
+
+    response = contextvars.copy_context().run(render, content.MSGPACK)
+    assert response.media_type == "application/msgpack"
+    assert msgpack.unpackb(response.body) == {"values": [[1.0, 2.5]]}
+    response = contextvars.copy_context().run(render, content.JSON)
+    assert response.body == b'{"values":[[1.0,2.5]]}'
@@ -0,0 +1,379 @@
+"""
+Query plan regression tests for app.db.crud.
+
+Each test runs one crud function against the seeded test database and
+checks, for the statements it emits, the number of queries, that none of the
+large tables is scanned sequentially (unless the function reads or deletes
+the whole table) and that the plans match tests/plans/<test name>.txt.
+
+Run with a dedicated database, which is seeded on first use:
+
+    TEST_DATABASE_URL=postgresql://postgres@localhost/esn_test python -m pytest tests
+
+After an intended change, review the diff and record the new plans with
+--update-plans.
+"""
+import uuid
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app.db import crud, models
+
+from tests import seed
+
+G = seed.GATEWAY_NAME
+S = seed.SENSOR_NAME
+ONE_DAY_AGO = models.tz_now() - timedelta(days=1)
+
+
+@pytest.fixture
+def sensor_uuid(session) -> str:
+    return session.execute(select(models.EdgeSensor.uuid).where(models.EdgeSensor.device_name == S)).scalar_one()
+
+@pytest.fixture
+def configured_sensor(session) -> str:
+    return session.execute(
+        select(models.EdgeSensor.device_name).join(
+            models.SensorConfig, models.SensorConfig.edge_sensor_uuid == models.EdgeSensor.uuid
+        ).where(models.EdgeSensor.gateway_uuid == crud.read_edge_gateway(session=session, device_name=G).uuid).order_by(models.EdgeSensor.device_name).limit(1)
+    ).scalar_one()
+
+@pytest.fixture
+def new_sensor(session) -> str:
+    """
+    A sensor of the seeded gateway with three readings, one with a prediction result.
+    """
+    crud.create_edge_sensor(session=session, gateway_name=G, fields={
+        "device_name": "plan-new-sensor", "device_address": "plan-new-address", "values_shape": seed.VALUES_SHAPE
+    })
+    readings = [str(uuid.uuid4()) for _ in range(3)]
+    crud.create_sensor_readings(session=session, readings=[(G, "plan-new-sensor", {"uuid": reading, "values": seed.VALUES}) for reading in readings])
+    crud.create_prediction_result(session=session, gateway_name=G, device_name="plan-new-sensor", reading_uuid=readings[0], fields={
+        "prediction": 1, "inference_layer": models.InferenceLayer.CLOUD
+    })
+    return "plan-new-sensor"
+
+@pytest.fixture
+def queued_job(session) -> int:
+    return session.execute(
+        select(models.Job.id).where(models.Job.status == models.JobStatus.QUEUED).order_by(models.Job.id).limit(1)
+    ).scalar_one()
+
+@pytest.fixture
+def running_job(session) -> int:
+    return session.execute(
+        select(models.Job.id).where(models.Job.status == models.JobStatus.RUNNING).order_by(models.Job.id).limit(1)
+    ).scalar_one()
+
+# A whole sensor's readings are 1/200 of the seeded ones, so the planner
+# rightly hashes them against a scan of the prediction results rather than
+# probing the index once per reading
+SENSOR_WIDE_PREDICTION_SCAN = frozenset({"prediction_result_table"})
+
+def benchmark_fields(sensor_name: str) -> dict:
+    return {"sensor_name": sensor_name, "inference_layer": models.InferenceLayer.GATEWAY, "send_timestamp": 1, "recv_timestamp": 2, "inference_latency": 1}
+
+
+# --- EdgeGateway ---
+
+def test_read_edge_gateways(session, queries, check_plans):
+    with queries:
+        crud.read_edge_gateways(session=session, paginate=True, page_size=10)
+    check_plans(1)
+
+def test_read_edge_gateway(session, queries, check_plans):
+    with queries:
+        crud.read_edge_gateway(session=session, device_name=G)
+    check_plans(1)
+
+def test_read_edge_gateway_by_token(session, queries, check_plans):
+    with queries:
+        crud.read_edge_gateway_by_token(session=session, token="plan-token-0")
+    check_plans(1)
+
+def test_create_edge_gateway(session, queries, check_plans):
+    with queries:
+        crud.create_edge_gateway(session=session, fields={"device_name": "plan-new-gw", "device_address": "plan-new", "url": "http://plan-new-gw"})
+    check_plans(3)
+
+def test_update_edge_gateway(session, queries, check_plans):
+    with queries:
+        crud.update_edge_gateway(session=session, device_name=G, fields={"device_name": G, "url": "http://plan-gw-0-moved"})
+    check_plans(2)
+
+def test_update_edge_gateway_token(session, queries, check_plans):
+    with queries:
+        crud.update_edge_gateway_token(session=session, device_name=G, token="plan-token-new")
+    check_plans(2)
+
+def test_delete_edge_gateway(session, queries, check_plans):
+    crud.create_edge_gateway(session=session, fields={"device_name": "plan-new-gw", "device_address": "plan-new", "url": "http://plan-new-gw"})
+    with queries:
+        crud.delete_edge_gateway(session=session, device_name="plan-new-gw")
+    check_plans(3)
+
+
+# --- EdgeSensor ---
+
+def test_read_edge_sensors(session, queries, check_plans):
+    with queries:
+        crud.read_edge_sensors(session=session, gateway_name=G)
+    check_plans(2)
+
+def test_read_edge_sensor(session, queries, check_plans):
+    with queries:
+        crud.read_edge_sensor(session=session, gateway_name=G, device_name=S)
+    check_plans(2)
+
+def test_create_edge_sensor(session, queries, check_plans):
+    with queries:
+        crud.create_edge_sensor(session=session, gateway_name=G, fields={"device_name": "plan-new-sensor", "device_address": "plan-new-address"})
+    check_plans(4)
+
+def test_update_edge_sensor(session, queries, check_plans):
+    with queries:
+        crud.update_edge_sensor(session=session, gateway_name=G, device_name=S, fields={"device_name": S, "state": models.SensorState.WORKING})
+    check_plans(4)
+
+def test_delete_edge_sensor(session, queries, check_plans):
+    crud.create_edge_sensor(session=session, gateway_name=G, fields={"device_name": "plan-new-sensor", "device_address": "plan-new-address"})
+    with queries:
+        crud.delete_edge_sensor(session=session, gateway_name=G, device_name="plan-new-sensor")
+    check_plans(6)
+
+def test_transition_edge_sensor_state(session, queries, check_plans):
+    with queries:
+        crud.transition_edge_sensor_state(session=session, gateway_name=G, device_name=S, expected_state=models.SensorState.IDLE, new_state=models.SensorState.WORKING)
+    check_plans(1)
+
+def test_read_sensor_state_changes(session, queries, check_plans):
+    with queries:
+        crud.read_sensor_state_changes(session=session, gateway_name=G, device_name=S, limit=10)
+    check_plans(3)
+
+def test_read_fleet_snapshot(session, queries, check_plans):
+    with queries:
+        crud.read_fleet_snapshot(session=session)
+    check_plans(4)
+
+def test_read_fleet_snapshot_of_gateway(session, queries, check_plans):
+    with queries:
+        crud.read_fleet_snapshot(session=session, gateway_name=G)
+    check_plans(4)
+
+
+# --- SensorConfig ---
+
+def test_create_sensor_config(session, new_sensor, queries, check_plans):
+    with queries:
+        crud.create_sensor_config(session=session, gateway_name=G, device_name=new_sensor, fields={"sleep_interval_ms": 500})
+    check_plans(4)
+
+def test_read_sensor_config(session, configured_sensor, queries, check_plans):
+    with queries:
+        crud.read_sensor_config(session=session, gateway_name=G, device_name=configured_sensor)
+    check_plans(3)
+
+def test_update_sensor_config(session, configured_sensor, queries, check_plans):
+    with queries:
+        crud.update_sensor_config(session=session, gateway_name=G, device_name=configured_sensor, fields={"sleep_interval_ms": 500})
+    check_plans(4)
+
+def test_upsert_sensor_configs(session, queries, check_plans):
+    with queries:
+        crud.upsert_sensor_configs(session=session, gateway_name=G, fields={"sleep_interval_ms": 500})
+    check_plans(1)
+
+def test_delete_sensor_config(session, configured_sensor, queries, check_plans):
+    with queries:
+        crud.delete_sensor_config(session=session, gateway_name=G, device_name=configured_sensor)
+    check_plans(4)
+
+
+# --- SensorReading ---
+
+def test_read_sensor_reading(session, sensor_uuid, queries, check_plans):
+    with queries:
+        crud.read_sensor_reading(session=session, gateway_name=G, device_name=S, reading_uuid=seed.reading_uuid(sensor_uuid, 0), with_values_array=True)
+    check_plans(4)
+
+def test_read_sensor_readings(session, queries, check_plans):
+    with queries:
+        crud.read_sensor_readings(session=session, gateway_name=G, device_name=S, paginate=True, page=0, page_size=100, start=ONE_DAY_AGO)
+    check_plans(4)
+
+def test_iter_sensor_readings(session, sensor_uuid, queries, check_plans):
+    with queries:
+        list(crud.iter_sensor_readings(session=session, sensor_uuid=sensor_uuid, start=ONE_DAY_AGO))
+    check_plans(1)
+
+def test_read_latest_sensor_readings(session, queries, check_plans):
+    with queries:
+        crud.read_latest_sensor_readings(session=session, gateway_name=G, device_name=S, limit=10)
+    check_plans(3)
+
+def test_create_sensor_reading(session, queries, check_plans):
+    with queries:
+        crud.create_sensor_reading(session=session, gateway_name=G, device_name=S, fields={"uuid": str(uuid.uuid4()), "values": seed.VALUES})
+    check_plans(5)
+
+def test_create_sensor_reading_of_authenticated_gateway(session, queries, check_plans):
+    gateway_uuid = crud.read_edge_gateway(session=session, device_name=G).uuid
+    with queries:
+        crud.create_sensor_reading(session=session, gateway_name=G, device_name=S, fields={"uuid": str(uuid.uuid4()), "values": seed.VALUES}, gateway_uuid=gateway_uuid)
+    check_plans(3)
+
+def test_create_sensor_readings(session, queries, check_plans):
+    readings = [(G, sensor, {"uuid": str(uuid.uuid4()), "values": seed.VALUES}) for sensor in (S, "plan-gw-000-s01") for _ in range(50)]
+    with queries:
+        crud.create_sensor_readings(session=session, readings=readings)
+    check_plans(4)
+
+def test_delete_sensor_readings(session, new_sensor, queries, check_plans):
+    with queries:
+        crud.delete_sensor_readings(session=session, gateway_name=G, device_name=new_sensor)
+    check_plans(5, allow_seq_scan=SENSOR_WIDE_PREDICTION_SCAN)
+
+
+# --- PredictionResult ---
+
+def test_create_prediction_result(session, sensor_uuid, queries, check_plans):
+    with queries:
+        crud.create_prediction_result(session=session, gateway_name=G, device_name=S, reading_uuid=seed.reading_uuid(sensor_uuid, 1), fields={
+            "prediction": 1, "inference_layer": models.InferenceLayer.CLOUD
+        })
+    check_plans(10)
+
+def test_create_prediction_results(session, sensor_uuid, queries, check_plans):
+    predictions = [
+        (G, S, seed.reading_uuid(sensor_uuid, index), {"prediction": 1, "inference_layer": models.InferenceLayer.CLOUD})
+        for index in range(1, 200, 2)
+    ]
+    with queries:
+        crud.create_prediction_results(session=session, predictions=predictions)
+    check_plans(3)
+
+def test_delete_prediction_results(session, new_sensor, queries, check_plans):
+    with queries:
+        crud.delete_prediction_results(session=session, gateway_name=G, device_name=new_sensor)
+    check_plans(4, allow_seq_scan=SENSOR_WIDE_PREDICTION_SCAN)
+
+def test_upsert_prediction_results(session, sensor_uuid, queries, check_plans):
+    predictions = {seed.reading_uuid(sensor_uuid, index): 2 for index in range(100)}
+    with queries:
+        crud.upsert_prediction_results(session=session, inference_layer=models.InferenceLayer.GATEWAY, predictions=predictions)
+    check_plans(4)
+
+
+# --- InferenceLatencyBenchmark ---
+
+def test_create_inference_latency_benchmark(session, queries, check_plans):
+    with queries:
+        crud.create_inference_latency_benchmark(session=session, gateway_name=G, device_name=S, fields=benchmark_fields(S))
+    check_plans(5)
+
+def test_create_inference_latency_benchmarks(session, queries, check_plans):
+    benchmarks = [(G, sensor, benchmark_fields(sensor)) for sensor in (S, "plan-gw-000-s01") for _ in range(50)]
+    with queries:
+        crud.create_inference_latency_benchmarks(session=session, benchmarks=benchmarks)
+    check_plans(4)
+
+def test_read_inference_latency_benchmarks(session, queries, check_plans):
+    with queries:
+        crud.read_inference_latency_benchmarks(session=session, paginate=True, page=0, page_size=100)
+    check_plans(1)
+
+def test_iter_inference_latency_benchmarks(session, queries, check_plans):
+    # Streams the whole table, so scanning it is the right plan
+    with queries:
+        for _ in crud.iter_inference_latency_benchmarks(session=session):
+            break
+    check_plans(1, allow_seq_scan=frozenset({"inference_latency_benchmark_table"}))
+
+def test_delete_inference_latency_benchmarks(session, queries, check_plans):
+    with queries:
+        crud.delete_inference_latency_benchmarks(session=session)
+    check_plans(1, allow_seq_scan=frozenset({"inference_latency_benchmark_table"}))
+
+
+# --- Replay ---
+
+def test_read_replay_sensors(session, queries, check_plans):
+    with queries:
+        crud.read_replay_sensors(session=session, gateway_name=G)
+    check_plans(2)
+
+def test_iter_replay_readings(session, queries, check_plans):
+    sensors = list(crud.read_replay_sensors(session=session, gateway_name=G))
+    with queries:
+        list(crud.iter_replay_readings(session=session, sensor_uuids=sensors, start=ONE_DAY_AGO))
+    check_plans(1)
+
+
+# --- Rollups ---
+
+def test_read_sensor_activity_rollups(session, queries, check_plans):
+    with queries:
+        crud.read_sensor_activity_rollups(session=session, gateway_name=G, device_name=S, granularity=models.RollupGranularity.HOUR, start=ONE_DAY_AGO)
+    check_plans(3)
+
+def test_read_inference_latency_rollups(session, queries, check_plans):
+    with queries:
+        crud.read_inference_latency_rollups(session=session, granularity=models.RollupGranularity.HOUR, sensor_name=S, start=ONE_DAY_AGO)
+    check_plans(1)
+
+def test_delete_rollups(session, queries, check_plans):
+    # Empties both tables
+    with queries:
+        crud.delete_rollups(session=session)
+    check_plans(2, allow_seq_scan=frozenset({"sensor_activity_rollup_table", "inference_latency_rollup_table"}))
+
+
+# --- Job ---
+
+def test_create_job(session, queries, check_plans):
+    with queries:
+        crud.create_job(session=session, kind="export", params={})
+    check_plans(1)
+
+def test_read_job(session, queued_job, queries, check_plans):
+    with queries:
+        crud.read_job(session=session, job_id=queued_job)
+    check_plans(1)
+
+def test_read_jobs(session, queries, check_plans):
+    with queries:
+        crud.read_jobs(session=session, status=models.JobStatus.QUEUED, limit=100)
+    check_plans(1)
+
+def test_cancel_job(session, queued_job, queries, check_plans):
+    with queries:
+        crud.cancel_job(session=session, job_id=queued_job)
+    check_plans(2)
+
+def test_claim_job(session, queries, check_plans):
+    with queries:
+        crud.claim_job(session=session, worker_id="plan-test", limits={"export": 5})
+    check_plans(4)
+
+def test_update_job_progress(session, running_job, queries, check_plans):
+    with queries:
+        crud.update_job_progress(session=session, job_id=running_job, progress=0.5, message="Halfway")
+    check_plans(1)
+
+def test_heartbeat_jobs(session, running_job, queries, check_plans):
+    with queries:
+        crud.heartbeat_jobs(session=session, job_ids=[running_job])
+    check_plans(1)
+
+def test_finish_job(session, running_job, queries, check_plans):
+    with queries:
+        crud.finish_job(session=session, job_id=running_job, status=models.JobStatus.SUCCEEDED, result={})
+    check_plans(1)
+
+def test_requeue_stale_jobs(session, queries, check_plans):
+    with queries:
+        crud.requeue_stale_jobs(session=session, stale_before=models.tz_now() - timedelta(hours=1))
+    check_plans(2)
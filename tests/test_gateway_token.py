@@ -0,0 +1,46 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core import auth
+from app.core.config import Settings
+from app.db import crud
+from app.main import create_app
+
+SECRET_KEY = "test-secret"
+ADMIN_TOKEN = "test-admin-token"
+URL = "/api/v1/gateway/gw/token"
+
+
+@pytest.fixture
+def client():
+    return TestClient(create_app(Settings(secret_key=SECRET_KEY, admin_token=ADMIN_TOKEN)))
+
+@pytest.fixture
+def issued(monkeypatch):
+    tokens = []
+    monkeypatch.setattr(crud, "update_edge_gateway_token", lambda session, device_name, token: tokens.append((device_name, token)))
+    return tokens
+
+
+@pytest.mark.parametrize("headers", [
+    {},
+    {"Authorization": ADMIN_TOKEN},
+    {"Authorization": "Bearer wrong-admin-token"},
+    {"Authorization": f"Bearer {auth.issue_token('another-secret', 'gw')}"},
+])
+def test_anonymous_calls_are_rejected(client, issued, headers):
+    response = client.post(URL, headers=headers)
+    assert response.status_code == 401
+    assert issued == []
+
+def test_admin_token_issues_a_token(client, issued):
+    response = client.post(URL, headers={"Authorization": f"Bearer {ADMIN_TOKEN}"})
+    assert response.status_code == 201
+    assert issued == [("gw", response.json()["token"])]
+    assert auth.verify_token(SECRET_KEY, response.json()["token"])["sub"] == "gw"
+
+def test_without_admin_token_only_gateway_tokens_are_accepted(issued):
+    client = TestClient(create_app(Settings(secret_key=SECRET_KEY)))
+    assert client.post(URL, headers={"Authorization": "Bearer "}).status_code == 401
+    assert client.post(URL, headers={"Authorization": "Bearer None"}).status_code == 401
+    assert issued == []
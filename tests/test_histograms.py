@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.db import histograms
+from app.db.histograms import LatencyHistogram
+from app.db.models import InferenceLayer
+
+# A percentile is reported as the highest value of its bucket
+RELATIVE_ERROR = 1 / 64
+
+
+def histogram_of(values) -> LatencyHistogram:
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    return histogram
+
+
+def test_small_values_are_exact():
+    histogram = histogram_of(range(1, 101))
+    assert histogram.percentile(50) == 50
+    assert histogram.percentile(99) == 99
+    assert histogram.percentile(100) == 100
+    assert (histogram.count, histogram.total, histogram.min, histogram.max) == (100, 5050, 1, 100)
+
+def test_percentile_error_is_bounded():
+    values = np.random.default_rng(7).lognormal(mean=9, sigma=1.5, size=20000).astype(np.int64)
+    histogram = histogram_of(values)
+    for percentile in histograms.PERCENTILES.values():
+        exact = np.percentile(values, percentile, method="inverted_cdf")
+        assert exact <= histogram.percentile(percentile) <= exact * (1 + RELATIVE_ERROR)
+
+def test_percentile_stays_within_min_and_max():
+    # 1000 and 1001 share a bucket whose highest value is past both
+    assert histogram_of([1000]).percentile(50) == 1000
+    assert histogram_of([1000, 1001]).percentile(50) == 1001
+
+def test_empty_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(99) == 0
+    restored = LatencyHistogram.deserialize(histogram.serialize())
+    assert (restored.count, restored.counts) == (0, {})
+
+def test_serialize_round_trip():
+    histogram = histogram_of([0, 5, 127, 128, 5000, 5001, 10 ** 9, 10 ** 12])
+    restored = LatencyHistogram.deserialize(histogram.serialize())
+    assert restored.counts == histogram.counts
+    assert (restored.count, restored.total, restored.min, restored.max) == (histogram.count, histogram.total, histogram.min, histogram.max)
+
+def test_merge_equals_recording_everything():
+    merged = histogram_of([1, 50, 3000])
+    merged.merge(histogram_of([2, 70000]))
+    combined = histogram_of([1, 50, 3000, 2, 70000])
+    assert merged.counts == combined.counts
+    assert (merged.count, merged.total, merged.min, merged.max) == (5, 73053, 1, 70000)
+
+def test_merge_into_empty_histogram():
+    merged = LatencyHistogram()
+    merged.merge(histogram_of([40, 60]))
+    assert (merged.min, merged.max) == (40, 60)
+
+
+def test_summaries_over_a_window():
+    now = datetime.now(timezone.utc)
+    latencies = histograms.LatencyHistograms(window_minutes=60)
+    latencies.record("s1", InferenceLayer.CLOUD, [10, 20], timestamp=now)
+    latencies.record("s1", InferenceLayer.CLOUD, [30], timestamp=now - timedelta(minutes=10))
+    latencies.record("s2", InferenceLayer.GATEWAY, [5], timestamp=now)
+
+    [recent] = latencies.summaries(window_minutes=5, sensor_name="s1")
+    assert (recent["latency_count"], recent["latency_min"], recent["latency_max"]) == (2, 10, 20)
+    [hour] = latencies.summaries(window_minutes=60, sensor_name="s1")
+    assert (hour["latency_count"], hour["latency_avg"], hour["p99"]) == (3, 20, 30)
+    assert [summary["sensor_name"] for summary in latencies.summaries(window_minutes=5)] == ["s1", "s2"]
+    assert latencies.summaries(window_minutes=5, inference_layer=InferenceLayer.SENSOR) == []
+
+def test_window_longer_than_kept():
+    with pytest.raises(histograms.LatencyWindowTooLong):
+        histograms.LatencyHistograms(window_minutes=60).summaries(window_minutes=61)
+
+def test_remote_histograms_are_merged_and_replaced():
+    now = datetime.now(timezone.utc)
+    latencies = histograms.LatencyHistograms(window_minutes=60)
+    latencies.record("s1", InferenceLayer.CLOUD, [10], timestamp=now)
+
+    def row(worker_id: str, values: list[int]):
+        return SimpleNamespace(sensor_name="s1", inference_layer=InferenceLayer.CLOUD.value, bucket_start=now, worker_id=worker_id, counts=histogram_of(values).serialize())
+
+    latencies.load_remote([row("other", [20]), row("third", [30])])
+    assert latencies.summaries(window_minutes=2)[0]["latency_count"] == 3
+    # Reloading a process's minute replaces what was loaded for it
+    latencies.load_remote([row("other", [20, 40])])
+    summary = latencies.summaries(window_minutes=2)[0]
+    assert (summary["latency_count"], summary["latency_max"]) == (4, 40)
+
+def test_take_dirty_returns_changed_minutes_once():
+    now = datetime.now(timezone.utc)
+    latencies = histograms.LatencyHistograms(window_minutes=60)
+    latencies.record("s1", InferenceLayer.CLOUD, [10, 20], timestamp=now)
+    [(key, data, count)] = latencies.take_dirty()
+    assert key[:2] == ("s1", InferenceLayer.CLOUD) and count == 2
+    assert LatencyHistogram.deserialize(data).max == 20
+    assert latencies.take_dirty() == []
+    latencies.mark_dirty([key])
+    assert len(latencies.take_dirty()) == 1
+
+def test_prune_keeps_unsaved_minutes():
+    old = datetime.now(timezone.utc) - timedelta(hours=2)
+    latencies = histograms.LatencyHistograms(window_minutes=60)
+    latencies.record("s1", InferenceLayer.CLOUD, [10], timestamp=old)
+    latencies.prune()
+    assert len(latencies.take_dirty()) == 1
+    latencies.prune()
+    assert latencies.take_dirty() == []
+    latencies.mark_dirty([("s1", InferenceLayer.CLOUD, old.replace(second=0, microsecond=0))])
+    assert latencies.take_dirty() == []
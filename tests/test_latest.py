@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta, timezone
+
+from app.db import latest
+from app.db.crud import PredictionResultRow, SensorReadingRow
+from app.db.models import InferenceLayer
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+SENSOR = ("gw", "s")
+
+
+def reading(index: int, values: str = "[[1.0]]") -> SensorReadingRow:
+    return SensorReadingRow(f"r{index:04d}", values, [1, 1], START + timedelta(seconds=index), None)
+
+def uuids(readings) -> list[str]:
+    return [reading.uuid for reading in readings]
+
+
+def test_recorded_readings_newest_first():
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=1 << 20, ttl_s=0)
+    for index in (0, 2, 1):
+        buffer.record_reading(*SENSOR, reading(index))
+    assert uuids(buffer.get(*SENSOR, limit=3)) == ["r0002", "r0001", "r0000"]
+    assert uuids(buffer.get(*SENSOR, limit=2)) == ["r0002", "r0001"]
+
+def test_partial_buffer_cannot_answer_for_more_than_it_has():
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=1 << 20, ttl_s=0)
+    buffer.record_reading(*SENSOR, reading(0))
+    # Older readings may exist in the database
+    assert buffer.get(*SENSOR, limit=2) is None
+    assert buffer.get("gw", "other", limit=1) is None
+    assert buffer.get(*SENSOR, limit=6) is None
+
+def test_buffer_keeps_the_newest_capacity_readings():
+    buffer = latest.LatestReadingsBuffer(capacity=3, max_bytes=1 << 20, ttl_s=0)
+    for index in range(5):
+        buffer.record_reading(*SENSOR, reading(index))
+    assert uuids(buffer.get(*SENSOR, limit=3)) == ["r0004", "r0003", "r0002"]
+    assert buffer.size == 3 * (len("[[1.0]]") + latest._READING_OVERHEAD_BYTES)
+
+def test_fill_makes_the_buffer_complete():
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=1 << 20, ttl_s=0)
+    buffer.fill(*SENSOR, [reading(1), reading(0)], buffer.generation())
+    assert uuids(buffer.get(*SENSOR, limit=5)) == ["r0001", "r0000"]
+
+def test_fill_keeps_readings_recorded_meanwhile():
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=1 << 20, ttl_s=0)
+    generation = buffer.generation()
+    buffer.record_reading(*SENSOR, reading(2))
+    buffer.fill(*SENSOR, [reading(1), reading(0)], generation)
+    assert uuids(buffer.get(*SENSOR, limit=5)) == ["r0002", "r0001", "r0000"]
+
+def test_fill_after_invalidation_is_dropped():
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=1 << 20, ttl_s=0)
+    generation = buffer.generation()
+    buffer.invalidate(*SENSOR)
+    buffer.fill(*SENSOR, [reading(0)], generation)
+    assert buffer.get(*SENSOR, limit=1) is None
+
+def test_buffers_expire(clock):
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=1 << 20, ttl_s=5)
+    buffer.fill(*SENSOR, [reading(0)], buffer.generation())
+    clock[0] += 4.9
+    assert uuids(buffer.get(*SENSOR, limit=1)) == ["r0000"]
+    clock[0] += 0.1
+    assert buffer.get(*SENSOR, limit=1) is None
+    assert buffer.size == 0
+
+def test_least_recently_used_sensors_are_evicted():
+    size = len("[[1.0]]") + latest._READING_OVERHEAD_BYTES
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=2 * size, ttl_s=0)
+    buffer.fill("gw", "a", [reading(0)], buffer.generation())
+    buffer.fill("gw", "b", [reading(1)], buffer.generation())
+    buffer.get("gw", "a", limit=1)
+    buffer.fill("gw", "c", [reading(2)], buffer.generation())
+    assert buffer.get("gw", "b", limit=1) is None
+    assert uuids(buffer.get("gw", "a", limit=1)) == ["r0000"]
+    assert uuids(buffer.get("gw", "c", limit=1)) == ["r0002"]
+    assert buffer.size == 2 * size
+
+def test_a_sensor_past_the_size_cap_keeps_its_newest_readings():
+    size = len("[[1.0]]") + latest._READING_OVERHEAD_BYTES
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=2 * size, ttl_s=0)
+    buffer.fill(*SENSOR, [reading(index) for index in range(4, -1, -1)], buffer.generation())
+    assert uuids(buffer.get(*SENSOR, limit=2)) == ["r0004", "r0003"]
+    # Older readings were dropped, so the buffer cannot answer for them
+    assert buffer.get(*SENSOR, limit=3) is None
+    assert buffer.size == 2 * size
+    buffer.record_reading(*SENSOR, reading(5, values="[[1.0]]" * 1000))
+    assert buffer.get(*SENSOR, limit=1) is None
+    assert buffer.size == 0
+
+def test_record_prediction_updates_a_buffered_reading():
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=1 << 20, ttl_s=0)
+    buffer.record_reading(*SENSOR, reading(0))
+    prediction = PredictionResultRow(1, InferenceLayer.CLOUD)
+    buffer.record_prediction("r0000", prediction)
+    buffer.record_prediction("unknown", prediction)
+    assert buffer.get(*SENSOR, limit=1)[0].prediction_result == prediction
+
+def test_invalidate_a_gateway():
+    buffer = latest.LatestReadingsBuffer(capacity=5, max_bytes=1 << 20, ttl_s=0)
+    buffer.fill("gw", "a", [reading(0)], buffer.generation())
+    buffer.fill("other", "a", [reading(1)], buffer.generation())
+    buffer.invalidate(gateway_name="gw")
+    assert buffer.get("gw", "a", limit=1) is None
+    assert uuids(buffer.get("other", "a", limit=1)) == ["r0001"]
+
+def test_disabled_buffer_stores_nothing():
+    buffer = latest.LatestReadingsBuffer(capacity=0, max_bytes=1 << 20, ttl_s=0)
+    buffer.record_reading(*SENSOR, reading(0))
+    buffer.fill(*SENSOR, [reading(0)], buffer.generation())
+    assert buffer.get(*SENSOR, limit=1) is None
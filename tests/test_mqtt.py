@@ -0,0 +1,135 @@
+from contextlib import nullcontext
+from dataclasses import replace
+
+import msgpack
+import orjson
+import paho.mqtt.client as mqtt
+import pytest
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from app.api import content, schemas
+from app.core import mqtt as bridge_module
+from app.core.config import Settings
+from app.db import crud
+
+READING_UUID = "00000000-0000-0000-0000-000000000001"
+LATENCY = {"sensor_name": "s", "inference_layer": 2, "send_timestamp": 10, "recv_timestamp": 25, "inference_latency": 15}
+
+
+def message(topic: str, payload: bytes, qos: int = 1, mid: int = 1, content_type: str = None) -> mqtt.MQTTMessage:
+    result = mqtt.MQTTMessage(mid=mid, topic=topic.encode())
+    result.payload = payload
+    result.qos = qos
+    if content_type is not None:
+        result.properties = Properties(PacketTypes.PUBLISH)
+        result.properties.ContentType = content_type
+    return result
+
+
+@pytest.mark.parametrize("topic, expected", [
+    ("esn/gw/s/reading", ("gw", "s", "reading")),
+    ("esn/gw/s/prediction", ("gw", "s", "prediction")),
+    ("esn/gw/s/latency", ("gw", "s", "latency")),
+    ("other/gw/s/reading", None),
+    ("esn/gw/s/unknown", None),
+    ("esn/gw/reading", None),
+    ("esn/gw/s/reading/extra", None),
+])
+def test_parse_topic(topic, expected):
+    assert bridge_module.parse_topic(topic, "esn") == expected
+
+@pytest.mark.parametrize("payload, content_type, expected", [
+    (b'{"uuid": "r"}', None, content.JSON),
+    (b'\n {"uuid": "r"}', None, content.JSON),
+    (msgpack.packb({"uuid": "r"}), None, content.MSGPACK),
+    # The content type wins over the first byte
+    (msgpack.packb({"uuid": "r"}), "application/json", content.JSON),
+    (b'{"uuid": "r"}', "application/msgpack", content.MSGPACK),
+])
+def test_payload_codec(payload, content_type, expected):
+    assert bridge_module.payload_codec(message("esn/gw/s/reading", payload, content_type=content_type)) is expected
+
+def test_payload_codec_cbor():
+    cbor2 = pytest.importorskip("cbor2")
+    codec = bridge_module.payload_codec(message("esn/gw/s/reading", cbor2.dumps({"uuid": "r"})))
+    assert codec.media_type == "application/cbor"
+
+def test_latency_key_is_stable():
+    benchmark = schemas.PublishedInferenceLatencyBenchmark(**LATENCY)
+    key = bridge_module.latency_key("gw", "s", benchmark)
+    assert key == bridge_module.latency_key("gw", "s", benchmark.model_copy())
+    assert key != bridge_module.latency_key("gw", "s", benchmark.model_copy(update={"recv_timestamp": 26}))
+    assert key != bridge_module.latency_key("other", "s", benchmark)
+
+
+def recorder(stored: list, kind: str, error: Exception = None):
+    # Stands in for a crud bulk writer, returning the same error for every item
+    def store(session, **items):
+        [items] = items.values()
+        stored.append((kind, items))
+        return [error] * len(items)
+    return store
+
+@pytest.fixture
+def bridge(monkeypatch):
+    bridge = bridge_module.MqttBridge(replace(Settings(), mqtt_topic_prefix="esn", mqtt_batch_size=1))
+    bridge.acked = []
+    bridge.stored = []
+    monkeypatch.setattr(bridge_module, "SessionLocal", nullcontext)
+    monkeypatch.setattr(bridge_module, "ENQUEUE_TIMEOUT_S", 0)
+    monkeypatch.setattr(bridge.client, "ack", lambda mid, qos: bridge.acked.append(mid))
+    return bridge
+
+def test_store_writes_readings_before_predictions(bridge, monkeypatch):
+    monkeypatch.setattr(crud, "create_sensor_readings", recorder(bridge.stored, "readings"))
+    monkeypatch.setattr(crud, "create_prediction_results", recorder(bridge.stored, "predictions"))
+    bridge._store([
+        message("esn/gw/s/prediction", orjson.dumps({"prediction": 1, "inference_layer": 2, "sensor_reading_uuid": READING_UUID}), mid=1),
+        message("esn/gw/s/reading", orjson.dumps({"uuid": READING_UUID, "values": "[[1.0]]"}), mid=2),
+    ])
+    assert [kind for kind, _ in bridge.stored] == ["readings", "predictions"]
+    assert bridge.stored[0][1] == [("gw", "s", {"uuid": READING_UUID, "values": "[[1.0]]"})]
+    assert bridge.stored[1][1] == [("gw", "s", READING_UUID, {"prediction": 1, "inference_layer": 2})]
+    assert sorted(bridge.acked) == [1, 2]
+
+def test_store_acknowledges_rejected_messages(bridge, monkeypatch):
+    monkeypatch.setattr(crud, "create_sensor_readings", recorder(bridge.stored, "readings", crud.SensorReadingAlreadyExists()))
+    bridge._store([
+        message("esn/gw/s/reading", b"not json", mid=1),
+        message("esn/gw/s/unknown", b"{}", mid=2),
+        message("esn/gw/s/reading", orjson.dumps({"uuid": READING_UUID, "values": [[1.0, True]]}), mid=3),
+        message("esn/gw/s/reading", orjson.dumps({"uuid": READING_UUID, "values": "[[1.0]]"}), mid=4),
+    ])
+    assert len(bridge.stored) == 1
+    assert sorted(bridge.acked) == [1, 2, 3, 4]
+
+def test_store_keys_latencies(bridge, monkeypatch):
+    monkeypatch.setattr(crud, "create_inference_latency_benchmarks", recorder(bridge.stored, "latencies"))
+    keyed = {**LATENCY, "uuid": READING_UUID}
+    bridge._store([
+        message("esn/gw/s/latency", orjson.dumps(LATENCY), mid=1),
+        message("esn/gw/s/latency", orjson.dumps(LATENCY), mid=2),
+        message("esn/gw/s/latency", orjson.dumps(keyed), mid=3),
+    ])
+    [(_, benchmarks)] = bridge.stored
+    keys = [fields["uuid"] for _, _, fields in benchmarks]
+    # A message delivered again gets the same key
+    assert keys[0] == keys[1] != READING_UUID
+    assert keys[2] == READING_UUID
+    assert sorted(bridge.acked) == [1, 2, 3]
+
+def test_store_keeps_a_batch_it_could_not_write(bridge, monkeypatch):
+    def fail(session, readings):
+        bridge._stopping.set()
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(crud, "create_sensor_readings", fail)
+    bridge._store([message("esn/gw/s/reading", orjson.dumps({"uuid": READING_UUID, "values": "[[1.0]]"}))])
+    assert bridge.acked == []
+
+def test_full_queue_drops_messages(bridge):
+    for mid in range(bridge._messages.maxsize + 1):
+        bridge._on_message(bridge.client, None, message("esn/gw/s/reading", b"{}", mid=mid))
+    # The message that found the queue full was dropped rather than waited for
+    assert [queued.mid for queued in bridge._messages.queue] == list(range(bridge._messages.maxsize))
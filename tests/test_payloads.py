@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from app.core import payloads
+
+
+def test_decode_values_from_json_text():
+    array = payloads.decode_values("[[0.5, 1], [2, 3.25]]")
+    assert array.dtype == payloads.VALUES_DTYPE
+    assert array.tolist() == [[0.5, 1.0], [2.0, 3.25]]
+
+def test_decode_values_from_bytes_and_lists():
+    assert payloads.decode_values(b"[[1, 2]]").tolist() == [[1.0, 2.0]]
+    assert payloads.decode_values([[1, 2.5]]).tolist() == [[1.0, 2.5]]
+
+@pytest.mark.parametrize("values", [
+    "[[1, 2]",              # not JSON
+    "[[1, 2], [3]]",        # ragged
+    "[1, 2]",               # 1-D
+    "[[[1]]]",              # 3-D
+    "[[]]",                 # empty
+    "[[true]]",             # boolean
+    "[[1, false]]",         # boolean among numbers
+    '[["1"]]',              # numeric string
+    "[[null]]",
+    [[float("nan")]],
+    [[1.0, float("inf")]],
+])
+def test_decode_values_rejects(values):
+    with pytest.raises(payloads.InvalidReadingValues):
+        payloads.decode_values(values)
+
+def test_validate_shape():
+    array = np.zeros((1, 4))
+    payloads.validate_shape(array, None)
+    payloads.validate_shape(array, [1, 4])
+    payloads.validate_shape(array, [-1, 4])
+    payloads.validate_shape(array, [-1, -1])
+
+@pytest.mark.parametrize("expected_shape", [[1, 3], [2, -1], [1, 4, 1], [4]])
+def test_validate_shape_rejects(expected_shape):
+    with pytest.raises(payloads.InvalidReadingValues, match=r"shape \[1, 4\]"):
+        payloads.validate_shape(np.zeros((1, 4)), expected_shape)
+
+def test_values_text_keeps_received_text():
+    assert payloads.values_text("[[1,2]]", np.array([[1.0, 2.0]])) == "[[1,2]]"
+    assert payloads.values_text(b"[[1,2]]", np.array([[1.0, 2.0]])) == "[[1,2]]"
+    assert payloads.values_text([[1, 2]], np.array([[1.0, 2.0]])) == "[[1.0,2.0]]"
+
+def test_array_round_trip():
+    array = payloads.decode_values("[[0.5, 0.25], [0.125, 0.0625]]")
+    blob = payloads.encode_array(array)
+    assert len(blob) == 4 * payloads.VALUES_DTYPE.itemsize
+    assert np.array_equal(payloads.decode_array(blob, [2, 2]), array)
+
+def test_stored_values():
+    array = np.array([[1.0, 2.0]])
+    assert np.array_equal(payloads.stored_values("ignored", payloads.encode_array(array), [1, 2]), array)
+    # Rows stored before values_array existed are parsed from their text
+    assert payloads.stored_values("[[3, 4]]", None, None).tolist() == [[3.0, 4.0]]
@@ -0,0 +1,19 @@
+import pytest
+from pydantic import ValidationError
+
+from app.api import schemas
+
+
+@pytest.mark.parametrize("values", ["[[1.0, 2]]", [[1.0, 2]]])
+def test_create_sensor_reading_values(values):
+    assert schemas.CreateSensorReading(uuid="r", values=values).values == values
+
+@pytest.mark.parametrize("values", [
+    [[1.0, True]],
+    [[False]],
+    [["1.5"]],
+    [[None]],
+])
+def test_create_sensor_reading_rejects_non_numbers(values):
+    with pytest.raises(ValidationError):
+        schemas.CreateSensorReading(uuid="r", values=values)